@@ -1,31 +1,281 @@
-from django.contrib import admin
+import hashlib
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.utils.functional import cached_property
+from . import deletion
 from .models import *
 
 
-class BookAdmin(admin.ModelAdmin):
+class AutocompleteFilter(admin.SimpleListFilter):
+    """
+    Sidebar filter on a foreign key that picks the related object with the admin autocomplete.
+
+    The default related-field filter lists every related object; this one
+    only loads the objects matching what is typed, through the related
+    model admin's `search_fields`. It uses the same query parameter as the
+    default filter, so existing links keep working.
+
+    Subclasses set `field_name`, the foreign key to filter on.
+    """
+
+    template = "admin/book_nest/autocomplete_filter.html"
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.parameter_name = f"{self.field_name}__id__exact"
+        self.field = model._meta.get_field(self.field_name)
+        self.admin_site = model_admin.admin_site
+        if self.title is None:
+            self.title = self.field.verbose_name
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                value = int(self.value())
+            except (TypeError, ValueError) as error:
+                raise IncorrectLookupParameters(error)
+            return queryset.filter(**{self.field.attname: value})
+        return queryset
+
+    def choices(self, changelist):
+        form_field = forms.ModelChoiceField(
+            queryset=self.field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(self.field, self.admin_site),
+            required=False,
+        )
+        self.rendered_widget = form_field.widget.render(
+            self.parameter_name,
+            self.value(),
+            attrs={
+                "id": f"filter_{self.parameter_name}",
+                "style": "width: 100%",
+                "data-filter-param": self.parameter_name,
+                "data-filter-url": changelist.get_query_string(
+                    remove=[self.parameter_name]
+                ),
+            },
+        )
+        yield {
+            "selected": self.value() is None,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+            "display": "All",
+        }
+
+
+class AutherFilter(AutocompleteFilter):
+    title = "auther"
+    field_name = "auther"
+
+
+class UserFilter(AutocompleteFilter):
+    title = "user"
+    field_name = "user"
+
+
+class BookFilter(AutocompleteFilter):
+    title = "book"
+    field_name = "book"
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator caching the changelist's COUNT(*) for a minute per distinct query.
+
+    Paging through a large changelist otherwise counts the whole filtered
+    table on every page.
+    """
+
+    timeout = 60
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is None:
+            return super().count
+        try:
+            sql = str(query)
+        except EmptyResultSet:
+            # E.g. .none() or an empty __in; counting runs no query.
+            return super().count
+        key = "admin:count:" + hashlib.md5(sql.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, self.timeout)
+        return count
+
+
+@admin.action(
+    description="Delete selected %(verbose_name_plural)s in batches",
+    permissions=["delete"],
+)
+def delete_in_batches(modeladmin, request, queryset):
+    """
+    Delete the selected objects a thousand at a time, each batch in its own transaction.
+
+    Unlike the default delete action, nothing is loaded up front to build a
+    confirmation page, so it also works when "select all" covers millions of
+    rows. Each batch goes through the model admin's `delete_queryset`, so
+    books and authors are soft-deleted like everywhere else.
+    """
+
+    batch_size = 1000
+    ids = (
+        queryset.order_by().values_list("pk", flat=True).iterator(chunk_size=batch_size)
+    )
+    deleted = 0
+    batch = []
+    for pk in ids:
+        batch.append(pk)
+        if len(batch) == batch_size:
+            deleted += _delete_batch(modeladmin, request, batch)
+            batch = []
+    if batch:
+        deleted += _delete_batch(modeladmin, request, batch)
+    modeladmin.message_user(
+        request,
+        f"Deleted {deleted} {queryset.model._meta.verbose_name_plural}.",
+        messages.SUCCESS,
+    )
+
+
+def _delete_batch(modeladmin, request, ids):
+    with transaction.atomic():
+        modeladmin.delete_queryset(
+            request, modeladmin.model._default_manager.filter(pk__in=ids)
+        )
+    return len(ids)
+
+
+class SoftDeleteAdminMixin:
+    """
+    Route every admin delete of a book or an author through `deletion.soft_delete`.
+
+    Covers the delete view, the default "delete selected" action and
+    `delete_in_batches`; the rows are then purged in the background.
+    """
+
+    def delete_model(self, request, obj):
+        deletion.soft_delete(obj)
+
+    def delete_queryset(self, request, queryset):
+        deletion.soft_delete_many(
+            queryset.model, list(queryset.values_list("pk", flat=True))
+        )
+
+
+class ScalableAdminMixin:
+    """
+    Changelist settings for tables with millions of rows.
+
+    Skips the unfiltered COUNT(*) and the facet counts, caches the paginated
+    count, loads the autocomplete assets used by AutocompleteFilter and adds
+    the batched delete action.
+    """
+
+    show_full_result_count = False
+    show_facets = admin.ShowFacets.NEVER
+    paginator = CachedCountPaginator
+    actions = [delete_in_batches]
+
+    @property
+    def media(self):
+        media = super().media
+        if any(
+            isinstance(spec, type) and issubclass(spec, AutocompleteFilter)
+            for spec in self.list_filter
+        ):
+            # The widget's assets do not depend on the field it is bound to.
+            media += AutocompleteSelect(None, self.admin_site).media + forms.Media(
+                js=["book_nest/admin/autocomplete_filter.js"]
+            )
+        return media
+
+
+class BookAdmin(SoftDeleteAdminMixin, ScalableAdminMixin, admin.ModelAdmin):
     """
     Admin View for user in django admin panel
 
     """
 
     list_display = ["title", "auther", "category"]
-    list_filter = ["title", "auther"]
-    search_fields = ["title", "auther__name"]
+    list_filter = [AutherFilter, "category"]
+    list_select_related = ["auther"]
+    search_fields = ["^title", "^auther__name"]
+    ordering = ["title"]
+    autocomplete_fields = ["auther"]
 
 
-class AutherAdmin(admin.ModelAdmin):
+class AutherAdmin(SoftDeleteAdminMixin, ScalableAdminMixin, admin.ModelAdmin):
     """
     Admin View for user in django admin panel
 
     """
 
     list_display = ["name", "nationality"]
-    list_filter = ["name", "nationality"]
+    list_filter = ["nationality"]
     search_fields = [
-        "name",
+        "^name",
     ]
+    ordering = ["name"]
+
+
+class FavoriteAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    """
+    Admin View for favorites in django admin panel
+
+    """
+
+    list_display = ["id", "user", "book"]
+    list_filter = [UserFilter, BookFilter]
+    list_select_related = ["user", "book"]
+    search_fields = ["^book__title", "^user__username"]
+    autocomplete_fields = ["user", "book"]
+
+    def get_queryset(self, request):
+        # `Favorite.__str__` reads the user, e.g. in delete confirmations.
+        return super().get_queryset(request).select_related("user")
+
+
+class DeletionAdmin(admin.ModelAdmin):
+    """
+    Read-only admin View following the progress of background purges
+
+    """
+
+    list_display = [
+        "model",
+        "object_id",
+        "requested_at",
+        "finished_at",
+        "books_purged",
+        "favorites_purged",
+    ]
+    list_filter = ["model"]
+    ordering = ["-requested_at"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 admin.site.register(Book, BookAdmin)
 admin.site.register(Auther, AutherAdmin)
-admin.site.register(Favorite)
+admin.site.register(Favorite, FavoriteAdmin)
+admin.site.register(Deletion, DeletionAdmin)
@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class BookNestConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "book_nest"
+
+    def ready(self):
+        from project.db import apply_sqlite_pragmas
+        from project.startup import lazy_import, register_warm_up
+        from . import artifacts, signals, similarity, snapshot, titles
+
+        connection_created.connect(
+            apply_sqlite_pragmas, dispatch_uid="book_nest.apply_sqlite_pragmas"
+        )
+
+        # Run before forking workers when STARTUP["WARM_UP"] is set (see project.startup).
+        register_warm_up("numpy", lambda: lazy_import("numpy").ndarray)
+        register_warm_up("recommender artifacts", artifacts.store.current)
+        register_warm_up("similarity index", similarity.get_index)
+        register_warm_up("catalog snapshot", snapshot.get_snapshot)
+        register_warm_up("title map", titles.get_map)
@@ -0,0 +1,280 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+
+from project.startup import lazy_import
+
+from .similarity import LSHIndex, similarity_settings
+
+np = lazy_import("numpy")
+
+
+logger = logging.getLogger(__name__)
+
+# Arrays written for every version; each is stored as `<name>.npy`.
+ARRAYS = (
+    "ids",
+    "vectors",
+    "idf",
+    "planes",
+    "orders",
+    "sorted_codes",
+    "neighbours",
+    "neighbour_scores",
+)
+
+DEFAULT_ARTIFACTS = {
+    "CHECK_INTERVAL": 5,
+    "NEIGHBOURS": 10,
+    "KEEP": 3,
+}
+
+
+def artifact_settings():
+    """
+    Return settings.RECOMMENDER_ARTIFACTS merged over the defaults.
+    """
+
+    options = {**DEFAULT_ARTIFACTS, **getattr(settings, "RECOMMENDER_ARTIFACTS", {})}
+    options.setdefault("DIR", Path(settings.BASE_DIR) / "artifacts" / "recommender")
+    options["DIR"] = Path(options["DIR"])
+    return options
+
+
+class ArtifactBundle:
+    """
+    One version of the recommender model, memory-mapped read-only.
+
+    The arrays are backed by the page cache, so every worker process mapping
+    the same version shares a single copy in memory.
+
+    Attributes:
+        version (str): The version name, i.e. its directory name.
+        manifest (dict): The version's manifest.json.
+        index (LSHIndex): The similarity index over the mapped arrays.
+        neighbours (np.ndarray): The precomputed `(books, k)` neighbour IDs, -1 padded.
+        neighbour_scores (np.ndarray): The similarity of each precomputed neighbour.
+    """
+
+    def __init__(self, version, manifest, arrays):
+        self.version = version
+        self.manifest = manifest
+        options = similarity_settings()
+        self.index = LSHIndex(
+            arrays["ids"],
+            arrays["vectors"],
+            arrays["idf"],
+            arrays["planes"],
+            probes=options["PROBES"],
+            exact_threshold=options["EXACT_THRESHOLD"],
+            orders=arrays["orders"],
+            sorted_codes=arrays["sorted_codes"],
+        )
+        self.neighbours = arrays["neighbours"]
+        self.neighbour_scores = arrays["neighbour_scores"]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Map the version stored in `path`.
+        """
+
+        manifest = json.loads((path / "manifest.json").read_text())
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+        return cls(path.name, manifest, arrays)
+
+    def neighbours_of(self, book_id, k):
+        """
+        Return the precomputed neighbours of a book.
+
+        Returns:
+            tuple | None: `(ids, scores)` arrays with at most `k` entries, or None
+            if the book was not in the catalog when this version was built.
+        """
+
+        position = self.index.positions([book_id])
+        if not len(position):
+            return None
+        ids = self.neighbours[position[0], :k]
+        found = ids >= 0
+        return np.asarray(ids[found]), np.asarray(
+            self.neighbour_scores[position[0], :k][found]
+        )
+
+
+def write_version(index, neighbours, neighbour_scores, directory=None):
+    """
+    Write a new artifact version and make it current.
+
+    The files are written to a temporary directory that is renamed into place
+    once complete, then the CURRENT pointer is replaced atomically, so
+    readers never see a partial version.
+
+    Args:
+        index (LSHIndex): The index to persist.
+        neighbours (np.ndarray): `(len(index), k)` neighbour IDs.
+        neighbour_scores (np.ndarray): `(len(index), k)` neighbour similarities.
+        directory (Path | None): The artifact root; RECOMMENDER_ARTIFACTS["DIR"] by default.
+
+    Returns:
+        str: The new version name.
+    """
+
+    directory = Path(directory or artifact_settings()["DIR"])
+    directory.mkdir(parents=True, exist_ok=True)
+    version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    staging = directory / f".{version}.tmp"
+    staging.mkdir()
+
+    arrays = {
+        "ids": index.ids,
+        "vectors": index.vectors,
+        "idf": index.idf,
+        "planes": index.planes,
+        "orders": index.orders,
+        "sorted_codes": index.sorted_codes,
+        "neighbours": neighbours,
+        "neighbour_scores": neighbour_scores,
+    }
+    for name, array in arrays.items():
+        np.save(staging / f"{name}.npy", np.ascontiguousarray(array))
+
+    manifest = {
+        "version": version,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "books": len(index),
+        "dimensions": int(index.vectors.shape[1]),
+        "tables": int(index.planes.shape[0]),
+        "bits": int(index.planes.shape[1]),
+        "neighbours": int(neighbours.shape[1]),
+        "arrays": {
+            name: {"dtype": str(array.dtype), "shape": list(array.shape)}
+            for name, array in arrays.items()
+        },
+    }
+    (staging / "manifest.json").write_text(json.dumps(manifest, indent=2))
+
+    os.rename(staging, directory / version)
+    publish(version, directory)
+    return version
+
+
+def publish(version, directory=None):
+    """
+    Atomically point CURRENT at `version`; running workers pick it up on their next check.
+    """
+
+    directory = Path(directory or artifact_settings()["DIR"])
+    if not (directory / version / "manifest.json").exists():
+        raise FileNotFoundError(f"No artifact version {version!r} in {directory}")
+
+    pointer = directory / f".CURRENT.{os.getpid()}.tmp"
+    pointer.write_text(version)
+    os.replace(pointer, directory / "CURRENT")
+
+
+def current_version(directory=None):
+    """
+    Return the version named by CURRENT, or None if nothing was published yet.
+    """
+
+    directory = Path(directory or artifact_settings()["DIR"])
+    try:
+        return (directory / "CURRENT").read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def versions(directory=None):
+    """
+    Return the complete versions in `directory`, oldest first.
+    """
+
+    directory = Path(directory or artifact_settings()["DIR"])
+    if not directory.exists():
+        return []
+    return sorted(
+        path.name
+        for path in directory.iterdir()
+        if path.is_dir() and not path.name.startswith(".")
+    )
+
+
+def prune(keep, directory=None):
+    """
+    Delete all but the newest `keep` versions, never deleting the current one.
+
+    Workers that still map a deleted version keep reading it until they swap;
+    the files are only freed once the last mapping is closed.
+
+    Returns:
+        list: The deleted version names.
+    """
+
+    directory = Path(directory or artifact_settings()["DIR"])
+    current = current_version(directory)
+    old = [name for name in versions(directory)[:-keep] if name != current]
+    for name in old:
+        shutil.rmtree(directory / name)
+    return old
+
+
+class ArtifactStore:
+    """
+    Process-wide handle on the current artifact version, with hot-swapping.
+
+    At most every RECOMMENDER_ARTIFACTS["CHECK_INTERVAL"] seconds, the first
+    caller re-reads CURRENT and maps the new version if it changed. The swap
+    is a single reference assignment, so concurrent readers keep using the
+    bundle they already hold and no restart is needed.
+    """
+
+    def __init__(self):
+        self._bundle = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        Return the current ArtifactBundle, or None if no version was published.
+        """
+
+        interval = artifact_settings()["CHECK_INTERVAL"]
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= interval:
+            self.refresh(blocking=checked_at is None)
+        return self._bundle
+
+    def refresh(self, blocking=True):
+        """
+        Map the version named by CURRENT if it differs from the loaded one.
+
+        Args:
+            blocking (bool): Wait for a refresh already running in another thread.
+        """
+
+        if not self._lock.acquire(blocking=blocking):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            directory = artifact_settings()["DIR"]
+            version = current_version(directory)
+            if version is None:
+                self._bundle = None
+            elif self._bundle is None or self._bundle.version != version:
+                try:
+                    self._bundle = ArtifactBundle.load(directory / version)
+                except (OSError, ValueError, KeyError):
+                    logger.exception("Could not load recommender artifacts %s", version)
+        finally:
+            self._lock.release()
+
+
+store = ArtifactStore()
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import CatalogVersion
+
+
+DEFAULT_CATALOG_CACHE = {
+    "BOOK_LIST_TIMEOUT": 60,
+    "RECOMMENDATIONS_TIMEOUT": 300,
+    "SEARCH_TIMEOUT": 300,
+    "SEARCH_MAX_IDS": 5000,
+    "VERSION_CHECK_INTERVAL": 5,
+}
+
+
+def catalog_cache_settings():
+    """
+    Return settings.CATALOG_CACHE merged over the defaults.
+    """
+
+    return {**DEFAULT_CATALOG_CACHE, **getattr(settings, "CATALOG_CACHE", {})}
+
+
+# The version read from the database and when, shared by the threads of a process.
+_version = (None, None)
+_version_lock = threading.Lock()
+
+
+def catalog_version():
+    """
+    Return the catalog version, part of every key derived from the catalog.
+
+    It is re-read from the database at most every VERSION_CHECK_INTERVAL
+    seconds, so entries cached by a process are dropped that soon after
+    another process writes to the catalog.
+    """
+
+    global _version
+    version, checked_at = _version
+    interval = catalog_cache_settings()["VERSION_CHECK_INTERVAL"]
+    if checked_at is None or time.monotonic() - checked_at >= interval:
+        with _version_lock:
+            version = (
+                CatalogVersion.objects.filter(pk=1)
+                .values_list("version", flat=True)
+                .first()
+                or 0
+            )
+            _version = (version, time.monotonic())
+    return version
+
+
+def bump_catalog_version():
+    """
+    Move every catalog-derived key to a new version; the old entries simply expire.
+
+    Call inside the transaction writing to the catalog, so other processes
+    see the new version together with the write.
+    """
+
+    if not CatalogVersion.objects.filter(pk=1).update(version=F("version") + 1):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+    # This process sees the new version once it commits, others after their next check.
+    transaction.on_commit(forget_version)
+
+
+def forget_version():
+    global _version
+    _version = (None, None)
+
+
+def make_key(prefix, *parts):
+    digest = hashlib.md5(json.dumps(parts, default=str).encode()).hexdigest()
+    return f"book_nest:{prefix}:{catalog_version()}:{digest}"
+
+
+def book_list_key(query_params):
+    """
+    Return the cache key of a /books/ response for the given query parameters.
+    """
+
+    return make_key("books", sorted(query_params.lists()))
+
+
+def recommendations_key(favorites, mode, limit):
+    """
+    Return the cache key of the recommendations for a favorites list.
+
+    The key depends on the favorites rather than the user, so users with the
+    same favorites share an entry and any change to the favorites misses.
+    """
+
+    return make_key("recommendations", sorted(favorites), mode, limit)
+
+
+def normalize_search_terms(terms):
+    """
+    Reduce search terms to a canonical form, so equivalent queries share a cache entry.
+
+    Every term must match (in any order), so the terms are deduplicated and
+    sorted. ASCII terms are lowercased: the `icontains` lookups ignore their
+    case on every database, whereas SQLite matches other characters
+    case-sensitively. Whitespace inside quoted phrases is kept, as it is
+    part of what they match.
+
+    Args:
+        terms (list): The terms split by SearchFilter, e.g. `["Harry", "potter"]`.
+
+    Returns:
+        list: The normalized terms, e.g. `["harry", "potter"]`.
+    """
+
+    return sorted({term.lower() if term.isascii() else term for term in terms})
+
+
+def search_key(model, search_fields, terms):
+    """
+    Return the cache key of the ids matching normalized search terms.
+    """
+
+    return make_key("search", model._meta.label_lower, list(search_fields), terms)
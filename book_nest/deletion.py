@@ -0,0 +1,174 @@
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import neighbours, signals, tasks
+from .models import Auther, Book, BookNeighbour, Deletion, Favorite
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELETION = {
+    "BATCH_SIZE": 500,
+    "PAUSE": 0.05,
+}
+
+
+def deletion_settings():
+    """
+    Return settings.DELETION merged over the defaults.
+    """
+
+    return {**DEFAULT_DELETION, **getattr(settings, "DELETION", {})}
+
+
+def soft_delete(instance):
+    """
+    Hide a book, or an author and their books, and purge them in the background.
+
+    Only the deleted rows are updated here, with one statement per table; the
+    favorites and neighbour lists referencing the books are removed later by
+    `purge`, a batch at a time.
+
+    Args:
+        instance (Book | Auther): The object to delete.
+
+    Returns:
+        Deletion: The record tracking the purge.
+    """
+
+    return soft_delete_many(type(instance), [instance.id])[0]
+
+
+def soft_delete_many(model, ids):
+    """
+    Soft-delete several books or authors in one transaction, as `soft_delete` does one.
+
+    Args:
+        model (type): Book or Auther.
+        ids (list): The IDs of the objects to delete.
+
+    Returns:
+        list: The Deletion records tracking the purges, one per object.
+    """
+
+    now = timezone.now()
+    with transaction.atomic():
+        if issubclass(model, Auther):
+            books = Book.objects.filter(auther_id__in=ids)
+            book_ids = list(books.values_list("id", flat=True))
+            books.update(deleted_at=now)
+            Auther.objects.filter(id__in=ids).update(deleted_at=now)
+        else:
+            book_ids = list(ids)
+            Book.objects.filter(id__in=ids).update(deleted_at=now)
+        deletions = Deletion.objects.bulk_create(
+            [Deletion(model=model._meta.model_name, object_id=pk) for pk in ids]
+        )
+        signals.books_soft_deleted.send(sender=Book, book_ids=book_ids)
+        # Cached neighbour lists still show the books until they are purged.
+        neighbours.bump_version()
+        for deletion in deletions:
+            tasks.purge_deletion.delay(deletion.id)
+    return deletions
+
+
+def delete_rows(model, where, params):
+    """
+    Delete rows with one raw statement, without loading them or sending signals.
+
+    Returns:
+        int: The number of rows deleted.
+    """
+
+    connection = connections[router.db_for_write(model)]
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {where}", params)
+        return cursor.rowcount
+
+
+def placeholders(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def purge_books(deletion, book_ids, batch_size):
+    """
+    Remove soft-deleted books and every row referencing them.
+
+    Favorites are deleted `batch_size` at a time, each batch in its own
+    transaction, so the write lock is never held for long. The counters of
+    `deletion` are updated in the same transactions, so they stay exact if
+    the purge is interrupted and run again.
+    """
+
+    in_books = f"book_id IN ({placeholders(book_ids)})"
+    deleted = batch_size
+    while deleted == batch_size:
+        with transaction.atomic():
+            deleted = delete_rows(
+                Favorite,
+                f"id IN (SELECT id FROM {Favorite._meta.db_table} "
+                f"WHERE {in_books} LIMIT %s)",
+                [*book_ids, batch_size],
+            )
+            deletion.favorites_purged += deleted
+            deletion.save(update_fields=["favorites_purged"])
+
+    with transaction.atomic():
+        # The lists the books appear on are recomputed without them.
+        neighbours.enqueue(set(neighbours.reverse_neighbours(book_ids)) - set(book_ids))
+        delete_rows(
+            BookNeighbour,
+            f"{in_books} OR neighbour_id IN ({placeholders(book_ids)})",
+            [*book_ids, *book_ids],
+        )
+        deletion.books_purged += delete_rows(
+            Book,
+            f"id IN ({placeholders(book_ids)}) AND deleted_at IS NOT NULL",
+            book_ids,
+        )
+        deletion.save(update_fields=["books_purged"])
+
+
+def purge(deletion, progress=None):
+    """
+    Remove the rows of a soft delete, `DELETION["BATCH_SIZE"]` books at a time.
+
+    Safe to run again after an interruption: every batch picks up the
+    soft-deleted books still left.
+
+    Args:
+        deletion (Deletion): The deletion to carry out.
+        progress (callable | None): Called with `deletion` after each batch.
+    """
+
+    options = deletion_settings()
+    books = Book.all_objects.filter(deleted_at__isnull=False)
+    if deletion.model == "auther":
+        books = books.filter(auther_id=deletion.object_id)
+    else:
+        books = books.filter(id=deletion.object_id)
+
+    while book_ids := list(
+        books.order_by("id").values_list("id", flat=True)[: options["BATCH_SIZE"]]
+    ):
+        purge_books(deletion, book_ids, options["BATCH_SIZE"])
+        if progress:
+            progress(deletion)
+        # Let other writers take the lock between batches.
+        time.sleep(options["PAUSE"])
+
+    if deletion.model == "auther":
+        delete_rows(Auther, "id = %s AND deleted_at IS NOT NULL", [deletion.object_id])
+    deletion.finished_at = timezone.now()
+    deletion.save(update_fields=["finished_at"])
+    logger.info(
+        "Purged %s: %s books, %s favorites",
+        deletion,
+        deletion.books_purged,
+        deletion.favorites_purged,
+    )
@@ -0,0 +1,400 @@
+import json
+import os
+import shutil
+import struct
+import zipfile
+from datetime import datetime, timezone
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+
+from project.startup import lazy_import
+
+from .models import Auther, Book, Favorite
+
+np = lazy_import("numpy")
+
+
+FORMAT = "book_nest-columns"
+FORMAT_VERSION = 1
+
+# Fixed .npy header size, large enough for any row count, so the header can
+# be rewritten in place once the number of rows is known.
+HEADER_SIZE = 128
+
+
+def npy_header(dtype, rows):
+    """
+    Return a version 1.0 .npy header of exactly HEADER_SIZE bytes.
+    """
+
+    text = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (rows,),
+        }
+    )
+    padding = HEADER_SIZE - 10 - len(text) - 1
+    return (
+        np.lib.format.magic(1, 0)
+        + struct.pack("<H", HEADER_SIZE - 10)
+        + (text + " " * padding + "\n").encode("latin1")
+    )
+
+
+class ArrayWriter:
+    """
+    Stream a one-dimensional array of unknown length to a .npy file.
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * HEADER_SIZE)
+
+    def write(self, values):
+        array = np.asarray(values, dtype=self.dtype)
+        array.tofile(self.file)
+        self.rows += len(array)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, self.rows))
+        self.file.close()
+
+
+class Column:
+    """
+    An exported column: a model field converted to one numpy array per chunk.
+
+    Args:
+        name (str): The column name, also its file name.
+        lookup (str): The field read with `values_list()`.
+        dtype (str): The numpy dtype, e.g. "int64", "datetime64[D]".
+        missing: The value stored for NULL, for integer columns.
+    """
+
+    def __init__(self, name, lookup, dtype, missing=None):
+        self.name = name
+        self.lookup = lookup
+        self.dtype = dtype
+        self.missing = missing
+
+    def open(self, directory):
+        self.writer = ArrayWriter(directory / f"{self.name}.npy", self.dtype)
+
+    def convert(self, values):
+        if self.missing is not None:
+            values = [self.missing if value is None else value for value in values]
+        return values
+
+    def write(self, values):
+        self.writer.write(self.convert(values))
+
+    def close(self):
+        self.writer.close()
+        return {"file": self.writer.path.name, "dtype": str(self.writer.dtype)}
+
+
+class DateTimeColumn(Column):
+    """
+    Datetimes, stored as naive UTC `datetime64[us]`; NULL is NaT.
+    """
+
+    def __init__(self, name, lookup):
+        super().__init__(name, lookup, "datetime64[us]")
+
+    def convert(self, values):
+        return [
+            (
+                value
+                if value is None or value.tzinfo is None
+                else value.astimezone(timezone.utc).replace(tzinfo=None)
+            )
+            for value in values
+        ]
+
+
+class StringColumn(Column):
+    """
+    Strings stored as their concatenated UTF-8 bytes plus `rows + 1` offsets.
+
+    String `i` is `data[offsets[i]:offsets[i + 1]]`; NULL is stored as "".
+    """
+
+    def __init__(self, name, lookup):
+        super().__init__(name, lookup, "uint8")
+
+    def open(self, directory):
+        self.writer = ArrayWriter(directory / f"{self.name}.data.npy", "uint8")
+        self.offsets = ArrayWriter(directory / f"{self.name}.offsets.npy", "int64")
+        self.offsets.write([0])
+        self.end = 0
+
+    def write(self, values):
+        encoded = [(value or "").encode() for value in values]
+        ends = np.cumsum([len(value) for value in encoded], dtype=np.int64) + self.end
+        if len(ends):
+            self.end = int(ends[-1])
+        self.offsets.write(ends)
+        self.writer.write(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def close(self):
+        self.writer.close()
+        self.offsets.close()
+        return {
+            "file": self.writer.path.name,
+            "offsets": self.offsets.path.name,
+            "dtype": "utf-8",
+        }
+
+
+class CategoryColumn(Column):
+    """
+    Dictionary-encoded strings: codes into a list kept in the manifest; NULL is -1.
+
+    Args:
+        choices (list | None): The known values, coded in this order; values
+            first seen during the export are appended.
+    """
+
+    def __init__(self, name, lookup, dtype="int16", choices=None):
+        super().__init__(name, lookup, dtype)
+        self.codes = {value: code for code, value in enumerate(choices or [])}
+
+    def convert(self, values):
+        codes = self.codes
+        return [
+            -1 if value is None else codes.setdefault(value, len(codes))
+            for value in values
+        ]
+
+    def close(self):
+        return {**super().close(), "dictionary": list(self.codes)}
+
+
+def id_dtype(manager):
+    """
+    Return the narrowest integer dtype holding the ids of a table, with room to grow.
+
+    A row whose id does not fit after all makes numpy raise OverflowError.
+    """
+
+    largest = manager.aggregate(largest=Max("id"))["largest"] or 0
+    return "int32" if largest < 2**30 else "int64"
+
+
+def tables():
+    """
+    Return the exported tables: name -> (queryset, columns).
+
+    Long free text (descriptions, biographies) is left out.
+    """
+
+    book_id, user_id, auther_id = (
+        id_dtype(Book.all_objects),
+        id_dtype(User.objects),
+        id_dtype(Auther.all_objects),
+    )
+    return {
+        "favorites": (
+            Favorite.objects.filter(book__deleted_at__isnull=True),
+            [
+                Column("user_id", "user_id", user_id),
+                Column("book_id", "book_id", book_id),
+            ],
+        ),
+        "books": (
+            Book.objects.all(),
+            [
+                Column("id", "id", book_id),
+                Column("auther_id", "auther_id", auther_id),
+                StringColumn("title", "title"),
+                CategoryColumn(
+                    "category",
+                    "category",
+                    "int8",
+                    [value for value, _ in Book.CATEGORY_CHOICES],
+                ),
+                CategoryColumn("language", "language"),
+                Column("pages", "pages", "int32", missing=-1),
+                Column("published_date", "published_date", "datetime64[D]"),
+                DateTimeColumn("created_at", "created_at"),
+            ],
+        ),
+        "authers": (
+            Auther.objects.all(),
+            [
+                Column("id", "id", auther_id),
+                StringColumn("name", "name"),
+                CategoryColumn("nationality", "nationality"),
+                Column("birth_date", "birth_date", "datetime64[D]"),
+                DateTimeColumn("created_at", "created_at"),
+            ],
+        ),
+    }
+
+
+def export_table(directory, queryset, columns, chunk_size, progress=None):
+    """
+    Write the columns of a queryset, streaming it `chunk_size` rows at a time.
+
+    Returns:
+        dict: The table's manifest entry.
+    """
+
+    directory.mkdir()
+    for column in columns:
+        column.open(directory)
+    rows = (
+        queryset.order_by("id")
+        .values_list(*[column.lookup for column in columns])
+        .iterator(chunk_size=chunk_size)
+    )
+    count = 0
+    while chunk := list(islice(rows, chunk_size)):
+        for column, values in zip(columns, zip(*chunk)):
+            column.write(values)
+        count += len(chunk)
+        if progress:
+            progress(count)
+    return {
+        "rows": count,
+        "columns": {column.name: column.close() for column in columns},
+    }
+
+
+def compress_table(directory, entry):
+    """
+    Pack the .npy files of a table into `<table>.npz`, deflated, and remove them.
+
+    The files are copied into the archive in blocks, so memory stays bounded.
+    """
+
+    archive = directory.with_suffix(".npz")
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as npz:
+        for path in sorted(directory.iterdir()):
+            with open(path, "rb") as source, npz.open(
+                path.name, "w", force_zip64=True
+            ) as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+    shutil.rmtree(directory)
+    entry["archive"] = archive.name
+
+
+def export(output, chunk_size=50000, compress=False, only=None, progress=None):
+    """
+    Export favorites, books and authors as columnar numpy files.
+
+    Every table is a directory of .npy files, one per column, which `load`
+    maps without copying; with `compress` each table is a deflated .npz
+    instead, which must be read into memory. The tables are read in one
+    transaction, so on SQLite they are a consistent snapshot. Files are
+    written to a staging directory renamed to `output` once complete, with
+    `manifest.json` describing every column.
+
+    Args:
+        output (Path): The directory to create.
+        chunk_size (int): Rows fetched and written at a time.
+        compress (bool): Write .npz archives instead of .npy files.
+        only (list | None): The tables to export; all by default.
+        progress (callable | None): Called with `(table, rows written)`.
+
+    Returns:
+        dict: The manifest.
+    """
+
+    output = Path(output)
+    if output.exists():
+        raise FileExistsError(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    staging = output.with_name(f".{output.name}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir()
+
+    manifest = {
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "compressed": compress,
+        "tables": {},
+    }
+    try:
+        with transaction.atomic():
+            for name, (queryset, columns) in tables().items():
+                if only and name not in only:
+                    continue
+                entry = export_table(
+                    staging / name,
+                    queryset,
+                    columns,
+                    chunk_size,
+                    progress and (lambda count, name=name: progress(name, count)),
+                )
+                if compress:
+                    compress_table(staging / name, entry)
+                manifest["tables"][name] = entry
+        (staging / "manifest.json").write_text(json.dumps(manifest, indent=2))
+        os.rename(staging, output)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+class Strings:
+    """
+    Read-only sequence over an exported string column, decoding on access.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return bytes(self.data[start:end]).decode()
+
+
+def load(directory, table):
+    """
+    Load the columns of an exported table.
+
+    Uncompressed exports are memory-mapped, so this is instant whatever their
+    size. String columns are returned as `Strings`; category columns as their
+    codes, which index `manifest["tables"][table]["columns"][name]["dictionary"]`.
+
+    Returns:
+        tuple: `(columns, manifest)`, with `columns` mapping names to arrays.
+    """
+
+    directory = Path(directory)
+    manifest = json.loads((directory / "manifest.json").read_text())
+    entry = manifest["tables"][table]
+    if "archive" in entry:
+        archive = np.load(directory / entry["archive"])
+
+        def read(name):
+            return archive[name]
+
+    else:
+
+        def read(name):
+            return np.load(directory / table / name, mmap_mode="r")
+
+    columns = {}
+    for name, column in entry["columns"].items():
+        if "offsets" in column:
+            columns[name] = Strings(read(column["file"]), read(column["offsets"]))
+        else:
+            columns[name] = read(column["file"])
+    return columns, manifest
@@ -0,0 +1,56 @@
+from rest_framework.filters import SearchFilter
+
+from project.singleflight import single_flight
+
+from . import cache
+
+
+class CachedSearchFilter(SearchFilter):
+    """
+    SearchFilter caching the ids of the objects matching each search.
+
+    The terms are normalized first (see `cache.normalize_search_terms`), so
+    "Harry  Potter", "potter harry" and "harry,potter" share one entry. The
+    entry holds the matching ids in order and is keyed by the catalog
+    version, so any book or author write invalidates it; a hit then costs a
+    single `pk IN (...)` query for the rows. Searches matching more than
+    CATALOG_CACHE["SEARCH_MAX_IDS"] objects are remembered as too broad and
+    run uncached.
+
+    The ids are computed from the view's base queryset, so this backend must
+    come before any filter that depends on the request.
+    """
+
+    def get_search_terms(self, request):
+        return cache.normalize_search_terms(super().get_search_terms(request))
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        terms = self.get_search_terms(request)
+        if not search_fields or not terms:
+            return queryset
+
+        options = cache.catalog_cache_settings()
+        if not queryset.ordered:
+            queryset = queryset.order_by("pk")
+
+        def matching_ids():
+            ids = super(CachedSearchFilter, self).filter_queryset(
+                request, queryset, view
+            )
+            ids = list(
+                ids.values_list("pk", flat=True)[: options["SEARCH_MAX_IDS"] + 1]
+            )
+            return ids if len(ids) <= options["SEARCH_MAX_IDS"] else None
+
+        ids = single_flight.get(
+            cache.search_key(queryset.model, search_fields, terms),
+            matching_ids,
+            options["SEARCH_TIMEOUT"],
+        )
+        if ids is None:
+            return super().filter_queryset(request, queryset, view)
+        if not ids:
+            return queryset.none()
+        # Same ordering as when the ids were cached, so the rows come back in their order.
+        return queryset.filter(pk__in=ids)
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.http import QueryDict
+from django.test import Client
+
+from book_nest.cache import book_list_key
+from project.singleflight import single_flight
+
+
+class Command(BaseCommand):
+    help = (
+        "Send bursts of concurrent /books/ requests at an expired cache entry and "
+        "report how many computations request coalescing avoided"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=32)
+        parser.add_argument("--bursts", type=int, default=5)
+
+    def burst(self, threads, path, params):
+        """
+        Expire the cached page, then request it from `threads` threads at once.
+
+        Returns:
+            float: The seconds until the last response.
+        """
+
+        cache.delete(book_list_key(params))
+        barrier = threading.Barrier(threads)
+
+        def request():
+            client = Client()
+            barrier.wait()
+            try:
+                client.get(path)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=request) for _ in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        query = "search=a"
+        path = f"/books/?{query}"
+        params = QueryDict(query)
+        before = single_flight.stats()
+        elapsed = [
+            self.burst(options["threads"], path, params)
+            for _ in range(options["bursts"])
+        ]
+        after = single_flight.stats()
+
+        requests = options["threads"] * options["bursts"]
+        computed = after["computed"] - before["computed"]
+        avoided = after["avoided"] - before["avoided"]
+        self.stdout.write(
+            f"{requests} requests in {options['bursts']} bursts, "
+            f"{sum(elapsed) / len(elapsed) * 1000:.1f} ms per burst"
+        )
+        self.stdout.write(
+            f"  computed {computed}, coalesced {after['coalesced'] - before['coalesced']}, "
+            f"stale {after['stale'] - before['stale']}, "
+            f"hits {after['hits'] - before['hits']}"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Coalescing avoided {avoided} of {computed + avoided} computations"
+            )
+        )
@@ -0,0 +1,92 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from book_nest.models import Auther, Book
+from book_nest.serializers import BookSerializer
+from project.middleware import compress
+from project.renderers import FastJSONRenderer
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark rendering a large /books/ page with DRF's JSONRenderer "
+        "against the fast renderer, on the same data, and response compression"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--level", type=int, default=6)
+
+    def best_of(self, repeat, func):
+        """
+        Run `func` `repeat` times and return its last result and the best time in ms.
+        """
+
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - start)
+        return result, best * 1000
+
+    def handle(self, *args, **options):
+        auther = Auther(id=1, name="Benchmark Author")
+        books = [
+            Book(
+                id=i,
+                title=f"Benchmark Book {i}",
+                auther=auther,
+                description="A generated book used to benchmark JSON rendering. " * 4,
+                category="FIC",
+                language="English",
+                pages=100 + i % 900,
+                published_date=date(1950 + i % 70, 1 + i % 12, 1 + i % 28),
+            )
+            for i in range(options["books"])
+        ]
+        repeat = options["repeat"]
+
+        data, serialize_ms = self.best_of(
+            repeat, lambda: BookSerializer(books, many=True).data
+        )
+        self.stdout.write(
+            f"{'BookSerializer':<16} serialize {serialize_ms:8.1f} ms  "
+            "(input of both renderers)"
+        )
+
+        # Both renderers encode the same serializer output, so the comparison
+        # measures the renderer alone.
+        body, render_ms = self.best_of(repeat, lambda: JSONRenderer().render(data))
+        self.stdout.write(
+            f"{'JSONRenderer':<16} render    {render_ms:8.1f} ms  "
+            f"size {len(body):>10} bytes"
+        )
+
+        renderer = FastJSONRenderer()
+        fast_body, fast_ms = self.best_of(repeat, lambda: renderer.render(data))
+        backend = "orjson" if renderer.use_orjson else "json"
+        self.stdout.write(
+            f"{'fast ' + backend:<16} render    {fast_ms:8.1f} ms  "
+            f"size {len(fast_body):>10} bytes"
+        )
+
+        for encoding in ("gzip", "deflate"):
+            compressed, compress_ms = self.best_of(
+                repeat, lambda: compress(fast_body, encoding, options["level"])
+            )
+            self.stdout.write(
+                f"{'+ ' + encoding:<16} compress  {compress_ms:8.1f} ms  "
+                f"{'':18}size {len(compressed):>10} bytes "
+                f"({len(compressed) / len(fast_body):.1%})"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"FastJSONRenderer is {render_ms / fast_ms:.1f}x faster than "
+                f"JSONRenderer at rendering {options['books']} books"
+            )
+        )
@@ -0,0 +1,96 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from book_nest.similarity import LSHIndex, book_text, similarity_settings
+from book_nest.models import Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure recall@k and query latency of the LSH similarity index against "
+        "exact search, on the catalog or on a synthetic catalog"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            default=0,
+            help="Benchmark on this many generated books instead of the catalog.",
+        )
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--tables", type=int)
+        parser.add_argument("--bits", type=int)
+        parser.add_argument("--probes", type=int)
+
+    def synthetic_texts(self, count, rng):
+        """
+        Generate topical book texts so that neighbourhoods are meaningful.
+        """
+
+        vocabulary = np.array([f"word{i}" for i in range(20000)])
+        topics = rng.integers(0, len(vocabulary), size=(500, 60))
+        texts = []
+        for topic in rng.integers(0, len(topics), size=count):
+            words = np.concatenate(
+                [
+                    vocabulary[rng.choice(topics[topic], size=25)],
+                    vocabulary[rng.integers(0, len(vocabulary), size=5)],
+                ]
+            )
+            texts.append(" ".join(words))
+        return texts
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        if options["synthetic"]:
+            texts = self.synthetic_texts(options["synthetic"], rng)
+            ids = list(range(1, len(texts) + 1))
+        else:
+            rows = Book.objects.order_by("id").values_list("id", "title", "description")
+            ids, texts = [], []
+            for book_id, title, description in rows.iterator(chunk_size=10000):
+                ids.append(book_id)
+                texts.append(book_text(title, description))
+
+        overrides = {"EXACT_THRESHOLD": 0}
+        for option in ("tables", "bits", "probes"):
+            if options[option] is not None:
+                overrides[option.upper()] = options[option]
+
+        start = time.perf_counter()
+        index = LSHIndex.build(ids, texts, overrides)
+        build_seconds = time.perf_counter() - start
+        config = {**similarity_settings(), **overrides}
+        self.stdout.write(
+            f"{len(index)} books, tables={config['TABLES']} bits={config['BITS']} "
+            f"probes={config['PROBES']}, built in {build_seconds:.2f}s"
+        )
+
+        k = options["k"]
+        queries = rng.choice(
+            index.ids, size=min(options["queries"], len(index)), replace=False
+        )
+        hits = total = 0
+        exact_seconds = ann_seconds = 0.0
+        for book_id in queries.tolist():
+            start = time.perf_counter()
+            exact_ids, _ = index.similar(book_id, k, exact=True)
+            exact_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            ann_ids, _ = index.similar(book_id, k)
+            ann_seconds += time.perf_counter() - start
+
+            hits += len(np.intersect1d(exact_ids, ann_ids))
+            total += len(exact_ids)
+
+        count = len(queries)
+        self.stdout.write(
+            f"exact: {exact_seconds / count * 1000:8.2f} ms/query\n"
+            f"ann:   {ann_seconds / count * 1000:8.2f} ms/query"
+        )
+        self.stdout.write(self.style.SUCCESS(f"recall@{k}: {hits / max(total, 1):.3f}"))
@@ -0,0 +1,145 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from project.db import pragma_statements
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark concurrent read/write throughput of a scratch SQLite database "
+        "under each database profile in settings.DATABASE_PROFILES"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument("--writers", type=int, default=2)
+        parser.add_argument("--seconds", type=float, default=5.0)
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument(
+            "--profile",
+            action="append",
+            dest="profiles",
+            help="Profile to benchmark; repeat for several. Defaults to all profiles.",
+        )
+
+    def connect(self, path, profile):
+        """
+        Open a connection configured like Django would for the given profile.
+        """
+
+        connection = sqlite3.connect(
+            path, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        for statement in pragma_statements(profile["PRAGMAS"]):
+            connection.execute(statement)
+        return connection
+
+    def populate(self, path, rows):
+        """
+        Create the scratch schema with `rows` books in rollback-journal mode.
+        """
+
+        connection = sqlite3.connect(path, isolation_level=None)
+        connection.executescript(
+            """
+            CREATE TABLE book (id INTEGER PRIMARY KEY, title TEXT, category TEXT);
+            CREATE INDEX book_category ON book (category);
+            CREATE TABLE favorite (
+                id INTEGER PRIMARY KEY, user_id INTEGER, book_id INTEGER
+            );
+            """
+        )
+        connection.execute("BEGIN")
+        connection.executemany(
+            "INSERT INTO book (title, category) VALUES (?, ?)",
+            ((f"Book {i}", f"C{i % 11}") for i in range(rows)),
+        )
+        connection.execute("COMMIT")
+        connection.close()
+
+    def run_profile(self, name, profile, options):
+        """
+        Run readers and writers against a fresh database and count completed operations.
+
+        When CONN_MAX_AGE is 0 every operation opens its own connection, like a
+        request does under Django's default settings.
+        """
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "benchmark.sqlite3")
+        self.populate(path, options["rows"])
+
+        persistent = profile["CONN_MAX_AGE"] != 0
+        deadline = time.monotonic() + options["seconds"]
+        counts = {"reads": 0, "writes": 0, "busy": 0}
+        lock = threading.Lock()
+
+        def read(connection):
+            category = f"C{random.randrange(11)}"
+            connection.execute(
+                "SELECT id, title FROM book WHERE category = ? LIMIT 20", (category,)
+            ).fetchall()
+
+        def write(connection):
+            connection.execute(
+                "INSERT INTO favorite (user_id, book_id) VALUES (?, ?)",
+                (random.randrange(1000), random.randrange(options["rows"])),
+            )
+
+        def worker(operation, counter):
+            done = busy = 0
+            connection = self.connect(path, profile) if persistent else None
+            while time.monotonic() < deadline:
+                current = connection or self.connect(path, profile)
+                try:
+                    operation(current)
+                    done += 1
+                except sqlite3.OperationalError:
+                    busy += 1
+                finally:
+                    if connection is None:
+                        current.close()
+            if connection is not None:
+                connection.close()
+            with lock:
+                counts[counter] += done
+                counts["busy"] += busy
+
+        threads = [
+            threading.Thread(target=worker, args=(read, "reads"))
+            for _ in range(options["readers"])
+        ] + [
+            threading.Thread(target=worker, args=(write, "writes"))
+            for _ in range(options["writers"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        seconds = options["seconds"]
+        self.stdout.write(
+            f"{name:<12} reads/s {counts['reads'] / seconds:>10.0f}  "
+            f"writes/s {counts['writes'] / seconds:>8.0f}  "
+            f"busy errors {counts['busy']:>6}"
+        )
+
+    def handle(self, *args, **options):
+        names = options["profiles"] or list(settings.DATABASE_PROFILES)
+        unknown = set(names) - set(settings.DATABASE_PROFILES)
+        if unknown:
+            raise CommandError(f"Unknown profile(s): {', '.join(sorted(unknown))}")
+
+        self.stdout.write(
+            f"{options['readers']} readers, {options['writers']} writers, "
+            f"{options['seconds']}s per profile"
+        )
+        for name in names:
+            self.run_profile(name, settings.DATABASE_PROFILES[name], options)
@@ -0,0 +1,120 @@
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from book_nest.models import Auther, Book
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request overhead of the session, CSRF, auth and messages "
+        "middleware on API requests, with the stateless API profile on and off"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--rounds", type=int, default=5)
+        parser.add_argument("--signups", type=int, default=3)
+
+    def client(self, stateless, cookie):
+        """
+        Return a test client whose middleware chain was loaded with the given profile.
+        """
+
+        with override_settings(STATELESS_API={"ENABLED": stateless}):
+            client = Client()
+            client.cookies["sessionid"] = cookie
+            client.get("/")  # Load the middleware chain.
+        return client
+
+    def time_requests(self, client, count, path, headers):
+        """
+        Time `count` requests to `path` and return the microseconds per request.
+        """
+
+        start = time.perf_counter()
+        for _ in range(count):
+            client.get(path, **headers)
+        return (time.perf_counter() - start) / count * 1e6
+
+    def count_signup_sessions(self, stateless, signups, offset):
+        """
+        Sign up `signups` users and return the number of sessions written.
+        """
+
+        sessions = Session.objects.count()
+        with override_settings(STATELESS_API={"ENABLED": stateless}):
+            client = Client()
+            for i in range(signups):
+                client.cookies.clear()
+                client.post(
+                    "/post/register/",
+                    {
+                        "first_name": "Bench",
+                        "last_name": "Mark",
+                        "email": f"benchmark-{offset + i}@example.com",
+                        "password": "benchmark-password",
+                    },
+                    content_type="application/json",
+                )
+        return Session.objects.count() - sessions
+
+    def handle(self, *args, **options):
+        # Everything created here, sessions included, is rolled back.
+        with transaction.atomic():
+            user = User.objects.create_user("stateless-benchmark", password="unused")
+            auther = Auther.objects.create(name="Benchmark Author")
+            book = Book.objects.create(
+                title="Stateless Benchmark Book", auther=auther, description="d"
+            )
+            token = RefreshToken.for_user(user).access_token
+            headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+            # A browser that once visited the admin keeps sending its session cookie.
+            session = SessionStore()
+            session.create()
+
+            path = f"/books/{book.id}/?fields=title"
+            modes = {"stateful": False, "stateless": True}
+            clients = {
+                label: self.client(stateless, session.session_key)
+                for label, stateless in modes.items()
+            }
+            # Interleave the modes and keep the best round to reduce noise.
+            results = dict.fromkeys(modes, float("inf"))
+            for _ in range(options["rounds"]):
+                for label, client in clients.items():
+                    results[label] = min(
+                        results[label],
+                        self.time_requests(client, options["requests"], path, headers),
+                    )
+
+            for offset, (label, client) in enumerate(clients.items()):
+                with CaptureQueriesContext(connection) as queries:
+                    client.get(path, **headers)
+                query_count = len(queries)
+                sessions = self.count_signup_sessions(
+                    modes[label], options["signups"], offset=offset * 1000
+                )
+                self.stdout.write(
+                    f"{label:<10} {results[label]:8.1f} us/request  "
+                    f"{query_count} queries/request  "
+                    f"{sessions}/{options['signups']} signups wrote a session"
+                )
+
+            transaction.set_rollback(True)
+
+        saved = results["stateful"] - results["stateless"]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stateless API saves {saved:.1f} us per request "
+                f"({saved / results['stateful'] * 100:.1f}%)"
+            )
+        )
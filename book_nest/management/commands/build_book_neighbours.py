@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book_nest import neighbours
+from book_nest.similarity import build_index_from_db
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the precomputed neighbour table used by /books/<id>/similar/: "
+        "refresh the books queued by catalog edits, or every book with --full"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Recompute every book instead of only the queued ones.",
+        )
+        parser.add_argument(
+            "--k",
+            type=int,
+            default=neighbours.neighbour_settings()["K"],
+            help="Neighbours per book.",
+        )
+        parser.add_argument("--workers", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if not options["full"] and not neighbours.queue_size():
+            self.stdout.write("No books queued for refresh")
+            return
+
+        start = time.perf_counter()
+        index = build_index_from_db()
+        self.stdout.write(
+            f"Indexed {len(index)} books in {time.perf_counter() - start:.1f}s"
+        )
+
+        start = time.perf_counter()
+        if options["full"]:
+            count = neighbours.rebuild(index, options["k"], options["workers"])
+        else:
+            count = neighbours.process_queue(index, options["k"], options["workers"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored neighbours of {count} books "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+        )
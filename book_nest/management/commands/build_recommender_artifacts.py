@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book_nest import artifacts
+from book_nest.similarity import build_index_from_db, neighbour_lists
+
+
+class Command(BaseCommand):
+    help = (
+        "Build a new version of the memory-mapped recommender artifacts from the "
+        "catalog and make it current; running workers swap to it without a restart"
+    )
+
+    def add_arguments(self, parser):
+        options = artifacts.artifact_settings()
+        parser.add_argument(
+            "--neighbours",
+            type=int,
+            default=options["NEIGHBOURS"],
+            help="Precomputed neighbours per book.",
+        )
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=options["KEEP"],
+            help="Number of versions to keep on disk.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        index = build_index_from_db()
+        self.stdout.write(
+            f"Indexed {len(index)} books in {time.perf_counter() - start:.1f}s"
+        )
+
+        start = time.perf_counter()
+        neighbours, scores = neighbour_lists(
+            index, options["neighbours"], workers=options["workers"]
+        )
+        self.stdout.write(
+            f"Computed {options['neighbours']} neighbours per book "
+            f"in {time.perf_counter() - start:.1f}s"
+        )
+
+        version = artifacts.write_version(index, neighbours, scores)
+        pruned = artifacts.prune(options["keep"])
+        if pruned:
+            self.stdout.write(f"Pruned {len(pruned)} old version(s)")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Published recommender artifacts {version}")
+        )
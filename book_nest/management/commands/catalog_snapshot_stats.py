@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from book_nest.snapshot import CatalogSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the column-oriented catalog snapshot and report its memory use per book"
+    )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        catalog = CatalogSnapshot.from_db()
+        seconds = time.perf_counter() - start
+
+        self.stdout.write(f"Loaded {len(catalog)} books in {seconds:.2f}s")
+        for name, array in catalog.columns.items():
+            self.stdout.write(
+                f"  {name:<14} {str(array.dtype):<8} {array.itemsize:>2} bytes/book"
+            )
+        self.stdout.write(
+            f"  {'titles':<14} {'utf-8':<8} {catalog.titles.nbytes} bytes"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{catalog.bytes_per_book():.1f} bytes per book "
+                f"({catalog.nbytes / 1024:.1f} KiB allocated)"
+            )
+        )
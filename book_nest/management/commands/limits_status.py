@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from project.limits import LimiterState, limits_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the current concurrency limit, smoothed latency and in-flight "
+        "requests of every load-shed route"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Delete the shared state, restoring every limit to its maximum.",
+        )
+
+    def handle(self, *args, **options):
+        settings = limits_settings()
+        path = Path(settings["STATE"])
+        if options["reset"]:
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{path}{suffix}").unlink(missing_ok=True)
+            self.stdout.write(self.style.SUCCESS(f"Deleted {path}"))
+            return
+
+        state = LimiterState(path, settings["LOCK_TIMEOUT"])
+        for row in state.snapshot():
+            maximum = settings["ROUTES"].get(row["route"], {}).get("MAX_CONCURRENCY")
+            latency = (
+                "-" if row["latency"] is None else f"{row['latency'] * 1000:.1f} ms"
+            )
+            self.stdout.write(
+                f"{row['route']}: limit {int(row['concurrency'])}/{maximum}, "
+                f"{row['in_flight']} in flight, latency {latency}"
+            )
@@ -0,0 +1,109 @@
+import io
+import json
+import pstats
+import shutil
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import slugify
+
+from project.profiling import collapsed_stacks, make_token, profiling_settings
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the hottest functions of each profiled route, merged across the "
+        "processes that wrote profiles to PROFILING['OUTPUT_DIR']"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", help="Defaults to PROFILING['OUTPUT_DIR'].")
+        parser.add_argument(
+            "--route", help="Only report routes containing this text, e.g. book-list."
+        )
+        parser.add_argument("--limit", type=int, default=15)
+        parser.add_argument(
+            "--sort", choices=["tottime", "cumulative", "calls"], default="tottime"
+        )
+        parser.add_argument(
+            "--collapsed",
+            metavar="DIR",
+            help="Also write one collapsed-stack file per route, for flame graph tools.",
+        )
+        parser.add_argument(
+            "--token",
+            action="store_true",
+            help="Print a value for the profiling header that profiles a request, and exit.",
+        )
+        parser.add_argument(
+            "--clear", action="store_true", help="Delete the profiles and exit."
+        )
+
+    def load(self, directory, route_filter):
+        """
+        Merge the dumps of every process per route.
+
+        Returns:
+            dict: `route -> (pstats.Stats, samples, seconds)`.
+        """
+
+        files = defaultdict(list)
+        samples = defaultdict(int)
+        seconds = defaultdict(float)
+        for index in directory.glob("profiles.*.json"):
+            for route, entry in json.loads(index.read_text()).items():
+                if route_filter and route_filter not in route:
+                    continue
+                if (directory / entry["file"]).exists():
+                    files[route].append(str(directory / entry["file"]))
+                    samples[route] += entry["samples"]
+                    seconds[route] += entry["seconds"]
+        return {
+            route: (pstats.Stats(*paths), samples[route], seconds[route])
+            for route, paths in files.items()
+        }
+
+    def handle(self, *args, **options):
+        if options["token"]:
+            header = profiling_settings()["HEADER"]
+            self.stdout.write(f"{header}: {make_token()}")
+            return
+
+        directory = Path(options["dir"] or profiling_settings()["OUTPUT_DIR"])
+        if options["clear"]:
+            shutil.rmtree(directory, ignore_errors=True)
+            self.stdout.write(self.style.SUCCESS(f"Deleted {directory}"))
+            return
+        if not directory.is_dir():
+            raise CommandError(f"No profiles in {directory}")
+
+        routes = self.load(directory, options["route"])
+        if not routes:
+            raise CommandError(f"No matching profiles in {directory}")
+
+        ordered = sorted(routes.items(), key=lambda item: -item[1][2])
+        if options["collapsed"]:
+            # Before strip_dirs(), which would merge functions of different files.
+            output = Path(options["collapsed"])
+            output.mkdir(parents=True, exist_ok=True)
+            for route, (stats, _, _) in ordered:
+                path = output / f"{slugify(route)}.collapsed"
+                path.write_text(
+                    "".join(
+                        f"{stack} {micros}\n"
+                        for stack, micros in collapsed_stacks(stats).items()
+                    )
+                )
+                self.stdout.write(f"Wrote {path}")
+
+        for route, (stats, samples, seconds) in ordered:
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    f"{route}: {samples} samples, "
+                    f"{seconds / samples * 1000:.1f} ms per profiled request"
+                )
+            )
+            stats.stream = io.StringIO()
+            stats.strip_dirs().sort_stats(options["sort"]).print_stats(options["limit"])
+            self.stdout.write(stats.stream.getvalue())
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from book_nest.deletion import purge
+from book_nest.models import Deletion
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish the purges of deleted books and authors that have not completed, "
+        "reporting their progress"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--status",
+            action="store_true",
+            help="Only list the unfinished purges.",
+        )
+
+    def report(self, deletion):
+        self.stdout.write(
+            f"{deletion}: {deletion.books_purged} books, "
+            f"{deletion.favorites_purged} favorites purged"
+        )
+
+    def handle(self, *args, **options):
+        pending = Deletion.objects.filter(finished_at__isnull=True).order_by("id")
+        if options["status"]:
+            for deletion in pending:
+                self.report(deletion)
+            self.stdout.write(f"{len(pending)} unfinished purge(s)")
+            return
+
+        count = 0
+        for deletion in pending:
+            purge(deletion, progress=self.report)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Finished {count} purge(s)"))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from project.tasks import runner
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the background tasks waiting in the outbox, e.g. after a restart, "
+        "and report the queue depth"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Give jobs that ran out of attempts a fresh set first.",
+        )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Only report the queue depth.",
+        )
+
+    def handle(self, *args, **options):
+        outbox = runner.get_outbox()
+        if not options["stats"]:
+            if options["retry_failed"]:
+                self.stdout.write(f"Requeued {outbox.requeue_failed()} failed job(s)")
+            self.stdout.write(f"Ran {runner.run_pending()} job(s)")
+
+        stats = runner.stats()
+        depth = ", ".join(
+            f"{status}={count}" for status, count in stats["outbox"].items()
+        )
+        self.stdout.write(f"Outbox: {depth}")
+        if not options["stats"]:
+            self.stdout.write(
+                f"completed={stats['completed']} retried={stats['retried']} "
+                f"failed={stats['failed']}"
+            )
@@ -0,0 +1,124 @@
+import json
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Runs in a fresh interpreter, so that nothing is imported yet.
+CHILD = """
+import json, os, sys, time
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+
+def phase(name):
+    sys.stderr.write(f"@phase {name}\\n")
+    sys.stderr.flush()
+
+phase("django.setup()")
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+from project import startup
+steps = []
+if WARM_UP:
+    phase("warm-up")
+    steps = startup.warm_up()
+print(json.dumps({
+    "setup": setup,
+    "steps": steps,
+    "lazy": {name: module.import_seconds for name, module in startup.lazy_modules().items()},
+}))
+"""
+
+
+def parse_importtime(output):
+    """
+    Sum the `-X importtime` output per phase and top-level package.
+
+    Returns:
+        dict: `phase -> {package: self microseconds}`.
+    """
+
+    phases = defaultdict(lambda: defaultdict(int))
+    phase = "interpreter"
+    for line in output.splitlines():
+        if line.startswith("@phase "):
+            phase = line[len("@phase ") :]
+            continue
+        if not line.startswith("import time:"):
+            continue
+        self_time, _, name = line[len("import time:") :].split("|")
+        if not self_time.strip().isdigit():
+            continue
+        phases[phase][name.strip().split(".")[0]] += int(self_time)
+    return phases
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the project in a fresh interpreter and report where its startup time "
+        "goes: module imports per phase and package, then each warm-up step"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument(
+            "--no-warm-up",
+            action="store_true",
+            help="Only report django.setup(), without running the warm-up.",
+        )
+
+    def handle(self, *args, **options):
+        code = CHILD.replace("WARM_UP", str(not options["no_warm_up"]))
+        environ = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ.get(
+                "DJANGO_SETTINGS_MODULE", "project.settings"
+            ),
+        }
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=settings.BASE_DIR,
+            env=environ,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f"django.setup(): {report['setup'] * 1000:.0f} ms"
+            )
+        )
+        for phase, packages in parse_importtime(result.stderr).items():
+            total = sum(packages.values())
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    f"Imports during {phase}: {total / 1000:.0f} ms"
+                )
+            )
+            ranked = sorted(packages.items(), key=lambda item: -item[1])
+            for package, micros in ranked[: options["limit"]]:
+                self.stdout.write(f"  {package:<30} {micros / 1000:8.1f} ms")
+
+        if report["steps"]:
+            total = sum(seconds for _, seconds, _ in report["steps"])
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(f"Warm-up: {total * 1000:.0f} ms")
+            )
+            for name, seconds, error in report["steps"]:
+                line = f"  {name:<30} {seconds * 1000:8.1f} ms"
+                self.stdout.write(
+                    line if error is None else self.style.ERROR(f"{line}  {error}")
+                )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Lazy imports"))
+        for name, seconds in sorted(report["lazy"].items()):
+            state = "not imported" if seconds is None else f"{seconds * 1000:.1f} ms"
+            self.stdout.write(f"  {name:<30} {state}")
@@ -0,0 +1,32 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into every alias in "
+        "settings.DATABASE_REPLICAS, standing in for replication locally"
+    )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES["default"]
+        if primary["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("Replica sync is only needed for the SQLite stand-in.")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured; set DJANGO_DATABASE_REPLICAS.")
+
+        source = sqlite3.connect(primary["NAME"])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+                try:
+                    # The online backup API copies a consistent snapshot without
+                    # blocking writers on the primary for the whole copy.
+                    source.backup(target, pages=1024)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(f"Synced replica '{alias}'"))
+        finally:
+            source.close()
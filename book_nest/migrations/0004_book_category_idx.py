@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0003_favorite"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["category"], name="book_category_idx"),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0004_book_category_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NeighbourRefresh",
+            fields=[
+                (
+                    "book_id",
+                    models.PositiveIntegerField(primary_key=True, serialize=False),
+                ),
+                ("queued_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Neighbour refresh",
+                "verbose_name_plural": "Neighbour refreshes",
+            },
+        ),
+        migrations.CreateModel(
+            name="BookNeighbour",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("score", models.FloatField()),
+                (
+                    "book",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbours",
+                        to="book_nest.book",
+                    ),
+                ),
+                (
+                    "neighbour",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbour_of",
+                        to="book_nest.book",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Book neighbour",
+                "verbose_name_plural": "Book neighbours",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("book", "rank"), name="book_neighbour_rank_unique"
+                    )
+                ],
+            },
+        ),
+    ]
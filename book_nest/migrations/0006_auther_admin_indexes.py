@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0005_book_neighbours"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="auther",
+            index=models.Index(fields=["name"], name="auther_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="auther",
+            index=models.Index(fields=["nationality"], name="auther_nationality_idx"),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0006_auther_admin_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Deletion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "model",
+                    models.CharField(
+                        choices=[("book", "Book"), ("auther", "Auther")], max_length=10
+                    ),
+                ),
+                ("object_id", models.PositiveIntegerField()),
+                ("requested_at", models.DateTimeField(auto_now_add=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("books_purged", models.PositiveIntegerField(default=0)),
+                ("favorites_purged", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Deletion",
+                "verbose_name_plural": "Deletions",
+            },
+        ),
+        migrations.AddField(
+            model_name="auther",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="book",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+
+def fill_title_normalized(apps, schema_editor):
+    """
+    Set title_normalized on existing books, in batches.
+
+    Computed in Python, as Book.save() does: SQL LOWER() only folds ASCII on SQLite.
+    """
+
+    Book = apps.get_model("book_nest", "Book")
+    batch = []
+    for book in Book.objects.only("id", "title").iterator(chunk_size=2000):
+        book.title_normalized = book.title.casefold()
+        batch.append(book)
+        if len(batch) == 2000:
+            Book.objects.bulk_update(batch, ["title_normalized"])
+            batch = []
+    if batch:
+        Book.objects.bulk_update(batch, ["title_normalized"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0007_soft_delete"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="book",
+            name="title_normalized",
+            field=models.CharField(default="", editable=False, max_length=100),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_title_normalized, migrations.RunPython.noop),
+        # Indexed once filled, rather than updating the index row by row.
+        migrations.AlterField(
+            model_name="book",
+            name="title_normalized",
+            field=models.CharField(db_index=True, editable=False, max_length=100),
+        ),
+    ]
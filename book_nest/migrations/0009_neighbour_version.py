@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0008_book_title_normalized"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NeighbourVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Neighbour version",
+                "verbose_name_plural": "Neighbour versions",
+            },
+        ),
+    ]
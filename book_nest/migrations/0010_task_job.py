@@ -0,0 +1,62 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0009_neighbour_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255)),
+                ("payload", models.TextField()),
+                ("key", models.CharField(max_length=40)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("max_attempts", models.PositiveIntegerField()),
+                ("run_at", models.FloatField()),
+                ("claimed_at", models.FloatField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, null=True)),
+                ("created_at", models.FloatField()),
+            ],
+            options={
+                "verbose_name": "Task job",
+                "verbose_name_plural": "Task jobs",
+                "indexes": [
+                    models.Index(fields=["status", "run_at"], name="task_job_due")
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("status", "pending")),
+                        fields=("key",),
+                        name="task_job_pending_key",
+                    )
+                ],
+            },
+        ),
+    ]
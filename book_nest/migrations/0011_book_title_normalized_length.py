@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("book_nest", "0010_task_job"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="book",
+            name="title_normalized",
+            field=models.CharField(db_index=True, editable=False, max_length=300),
+        ),
+    ]
@@ -1,7 +1,28 @@
-from django.db import models
+from django.db import models, connections, router, transaction
 from django.contrib.auth.models import User
 
 
+class LiveManager(models.Manager):
+    """
+    Default manager hiding soft-deleted rows; `all_objects` still sees them.
+
+    Related objects reached through a foreign key are loaded with the base
+    manager, so a deleted row stays readable from the rows pointing to it
+    until it is purged.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+def normalize_title(title):
+    """
+    Return the form of a title that case-insensitive lookups compare, e.g. "the hobbit".
+    """
+
+    return title.casefold()
+
+
 class Book(models.Model):
     """
     Represents a book in the library.
@@ -15,10 +36,16 @@ class Book(models.Model):
         pages (int): The number of pages in the book.
         published_date (date): The publication date of the book.
         created_at (datetime): The timestamp when the book entry was created.
+        deleted_at (datetime): When the book was deleted; it is hidden from
+            `objects` until a background job purges it (see book_nest.deletion).
+        title_normalized (str): The title as `normalize_title` returns it,
+            indexed for lookups by title. Set by `save()`; bulk writes must
+            set it themselves.
 
     Meta:
         verbose_name (str): Singular name for the model.
         verbose_name_plural (str): Plural name for the model.
+        indexes (list): An index on category for recommendation queries.
     """
 
     CATEGORY_CHOICES = [
@@ -45,14 +72,29 @@ class Book(models.Model):
     pages = models.PositiveIntegerField(blank=True, null=True)
     published_date = models.DateField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)
+    # casefold() can lengthen a title up to three times, e.g. "ﬃ" becomes "ffi".
+    title_normalized = models.CharField(max_length=300, db_index=True, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = "Book"
         verbose_name_plural = "Books"
+        # auther_id is already indexed by its ForeignKey; recommendations filter on both.
+        indexes = [models.Index(fields=["category"], name="book_category_idx")]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.title_normalized = normalize_title(self.title)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "title" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "title_normalized"}
+        super().save(*args, **kwargs)
+
 
 class Auther(models.Model):
     """
@@ -66,10 +108,12 @@ class Auther(models.Model):
         website (URLField): The author's website.
         awards (str): Any awards won by the author.
         created_at (datetime): The timestamp when the author entry was created.
+        deleted_at (datetime): When the author, and with it their books, was deleted.
 
     Meta:
         verbose_name (str): Singular name for the model.
         verbose_name_plural (str): Plural name for the model.
+        indexes (list): Indexes on name and nationality for the admin.
     """
 
     name = models.CharField(max_length=100)
@@ -79,15 +123,105 @@ class Auther(models.Model):
     website = models.URLField(blank=True, null=True)
     awards = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = "Auther"
         verbose_name_plural = "Authers"
+        # Admin search and filters on large catalogs.
+        indexes = [
+            models.Index(fields=["name"], name="auther_name_idx"),
+            models.Index(fields=["nationality"], name="auther_nationality_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class FavoriteManager(models.Manager):
+    """
+    Manager implementing the favorites write path as single, race-free statements.
+
+    Both methods use raw SQL, so they do not send `post_save`/`post_delete`
+    signals for the Favorite row.
+    """
+
+    def add(self, user_id, book_id):
+        """
+        Add a book to a user's favorites unless it is already there or the cap is reached.
+
+        The insert, the duplicate check (`ON CONFLICT DO NOTHING`) and the
+        per-user cap check run as one statement inside one transaction, so
+        concurrent requests can neither create duplicates nor exceed the cap.
+        Favorites of soft-deleted books, waiting to be purged, do not count.
+
+        Args:
+            user_id (int): The ID of the user.
+            book_id (int): The ID of the book to add.
+
+        Returns:
+            str: One of Favorite.ADDED, Favorite.ALREADY_FAVORITE,
+            Favorite.LIMIT_REACHED or Favorite.BOOK_NOT_FOUND.
+        """
+
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        quote = connection.ops.quote_name
+        favorite_table = quote(self.model._meta.db_table)
+        book_table = quote(Book._meta.db_table)
+
+        with transaction.atomic(using=db):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {favorite_table} (user_id, book_id) "
+                    f"SELECT %s, id FROM {book_table} "
+                    f"WHERE id = %s AND deleted_at IS NULL AND "
+                    f"(SELECT COUNT(*) FROM {favorite_table} AS f "
+                    f"JOIN {book_table} AS b ON b.id = f.book_id "
+                    f"WHERE f.user_id = %s AND b.deleted_at IS NULL) < %s "
+                    f"ON CONFLICT (user_id, book_id) DO NOTHING",
+                    [user_id, book_id, user_id, self.model.MAX_PER_USER],
+                )
+                if cursor.rowcount == 1:
+                    return self.model.ADDED
+
+            # Nothing was inserted; work out why.
+            if self.using(db).filter(user_id=user_id, book_id=book_id).exists():
+                return self.model.ALREADY_FAVORITE
+            if not Book.objects.using(db).filter(id=book_id).exists():
+                return self.model.BOOK_NOT_FOUND
+            return self.model.LIMIT_REACHED
+
+    def remove(self, user_id, book_id):
+        """
+        Remove a book from a user's favorites with a single DELETE statement.
+
+        Args:
+            user_id (int): The ID of the user.
+            book_id (int): The ID of the book to remove.
+
+        Returns:
+            bool: True if the favorite existed and was removed.
+        """
+
+        db = router.db_for_write(self.model)
+        connection = connections[db]
+        sql = (
+            f"DELETE FROM {connection.ops.quote_name(self.model._meta.db_table)} "
+            f"WHERE user_id = %s AND book_id = %s"
+        )
+
+        with connection.cursor() as cursor:
+            if connection.features.can_return_columns_from_insert:
+                cursor.execute(sql + " RETURNING id", [user_id, book_id])
+                return cursor.fetchone() is not None
+            cursor.execute(sql, [user_id, book_id])
+            return cursor.rowcount > 0
+
+
 class Favorite(models.Model):
     """
     Represents a user's favorite book.
@@ -95,6 +229,7 @@ class Favorite(models.Model):
     Attributes:
         user (ForeignKey): A reference to the user who marked the book as a favorite.
         book (ForeignKey): A reference to the favorite book.
+        MAX_PER_USER (int): The maximum number of favorite books per user.
 
     Meta:
         unique_together (tuple): Ensures that a user can only mark a book as favorite once.
@@ -105,6 +240,16 @@ class Favorite(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="favorites")
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="favorites")
 
+    MAX_PER_USER = 20
+
+    # Outcomes of FavoriteManager.add
+    ADDED = "added"
+    ALREADY_FAVORITE = "already_favorite"
+    LIMIT_REACHED = "limit_reached"
+    BOOK_NOT_FOUND = "book_not_found"
+
+    objects = FavoriteManager()
+
     class Meta:
         unique_together = ("user", "book")
         verbose_name = "Favorite"
@@ -112,3 +257,193 @@ class Favorite(models.Model):
 
     def __str__(self):
         return self.user.first_name
+
+
+class BookNeighbour(models.Model):
+    """
+    One entry of a book's precomputed "similar books" list.
+
+    The lists are written by the `build_book_neighbours` command; see
+    book_nest.neighbours.
+
+    Attributes:
+        book (ForeignKey): The book the list belongs to.
+        neighbour (ForeignKey): A similar book.
+        rank (int): The position in the list, 0 being the most similar.
+        score (float): The cosine similarity of the two books.
+
+    Meta:
+        constraints (list): One neighbour per rank; also the index the list is read through.
+    """
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="neighbours")
+    neighbour = models.ForeignKey(
+        Book, on_delete=models.CASCADE, related_name="neighbour_of"
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["book", "rank"], name="book_neighbour_rank_unique"
+            )
+        ]
+        verbose_name = "Book neighbour"
+        verbose_name_plural = "Book neighbours"
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.neighbour_id}"
+
+
+class NeighbourRefresh(models.Model):
+    """
+    A book whose precomputed neighbour list is stale.
+
+    Rows are queued by catalog signals and consumed by `build_book_neighbours`.
+    The book is stored by ID only, so deleting it does not drop the entry.
+
+    Attributes:
+        book_id (int): The ID of the book to refresh.
+        queued_at (datetime): When the book was last queued.
+    """
+
+    book_id = models.PositiveIntegerField(primary_key=True)
+    queued_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Neighbour refresh"
+        verbose_name_plural = "Neighbour refreshes"
+
+    def __str__(self):
+        return str(self.book_id)
+
+
+class CatalogVersion(models.Model):
+    """
+    A counter bumped by every book and author write, part of the catalog cache keys.
+
+    Like NeighbourVersion it lives in the database, so that a write in one
+    worker invalidates the entries cached by every other worker even without
+    a shared cache backend. There is a single row.
+
+    Attributes:
+        version (int): The current version.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Catalog version"
+        verbose_name_plural = "Catalog versions"
+
+    def __str__(self):
+        return str(self.version)
+
+
+class NeighbourVersion(models.Model):
+    """
+    A counter bumped whenever neighbour lists are stored, part of their cache keys.
+
+    It lives in the database rather than the cache, so that web workers see
+    lists written by `build_book_neighbours` even without a shared cache
+    backend. There is a single row.
+
+    Attributes:
+        version (int): The current version.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Neighbour version"
+        verbose_name_plural = "Neighbour versions"
+
+    def __str__(self):
+        return str(self.version)
+
+
+class Deletion(models.Model):
+    """
+    A soft-deleted book or author whose rows are being purged in the background.
+
+    See book_nest.deletion. The counters are updated after every batch, so
+    they report the progress of a running purge.
+
+    Attributes:
+        model (str): "book" or "auther".
+        object_id (int): The ID of the deleted object.
+        requested_at (datetime): When the delete request was made.
+        finished_at (datetime): When the last row was purged, or None while running.
+        books_purged (int): The books removed so far.
+        favorites_purged (int): The favorites removed so far.
+    """
+
+    MODEL_CHOICES = [("book", "Book"), ("auther", "Auther")]
+
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.PositiveIntegerField()
+    requested_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    books_purged = models.PositiveIntegerField(default=0)
+    favorites_purged = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Deletion"
+        verbose_name_plural = "Deletions"
+
+    def __str__(self):
+        return f"{self.model} {self.object_id}"
+
+
+class TaskJob(models.Model):
+    """
+    A background task waiting in the transactional outbox of project.tasks.
+
+    Jobs are inserted in the transaction that queues them, so they exist if
+    and only if it commits, and are deleted once they succeed.
+
+    Attributes:
+        name (str): The dotted path of the task.
+        payload (str): The JSON arguments.
+        key (str): Deduplication key; at most one pending job has a given key.
+        status (str): "pending", "running" or "failed".
+        attempts (int): The runs started so far.
+        max_attempts (int): The runs allowed before the job is kept as failed.
+        run_at (float): When the job is due, as a Unix timestamp.
+        claimed_at (float): When a worker last claimed the job.
+        last_error (str): The error of the last failed run.
+        created_at (float): When the job was queued.
+    """
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("running", "Running"),
+        ("failed", "Failed"),
+    ]
+
+    name = models.CharField(max_length=255)
+    payload = models.TextField()
+    key = models.CharField(max_length=40)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField()
+    run_at = models.FloatField()
+    claimed_at = models.FloatField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["key"],
+                condition=models.Q(status="pending"),
+                name="task_job_pending_key",
+            )
+        ]
+        indexes = [models.Index(fields=["status", "run_at"], name="task_job_due")]
+        verbose_name = "Task job"
+        verbose_name_plural = "Task jobs"
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,294 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BookNeighbour, NeighbourRefresh, NeighbourVersion
+from .similarity import neighbour_lists
+
+
+DEFAULT_NEIGHBOURS = {
+    "K": 20,
+    "CACHE_TIMEOUT": 300,
+    "BATCH_SIZE": 1000,
+    "VERSION_CHECK_INTERVAL": 5,
+}
+
+
+def neighbour_settings():
+    """
+    Return settings.BOOK_NEIGHBOURS merged over the defaults.
+    """
+
+    return {**DEFAULT_NEIGHBOURS, **getattr(settings, "BOOK_NEIGHBOURS", {})}
+
+
+# The version read from the database and when, shared by the threads of a process.
+_version = (None, None)
+_version_lock = threading.Lock()
+
+
+def current_version():
+    """
+    Return the neighbour version, re-read at most every VERSION_CHECK_INTERVAL seconds.
+    """
+
+    global _version
+    version, checked_at = _version
+    interval = neighbour_settings()["VERSION_CHECK_INTERVAL"]
+    if checked_at is None or time.monotonic() - checked_at >= interval:
+        with _version_lock:
+            version = (
+                NeighbourVersion.objects.filter(pk=1)
+                .values_list("version", flat=True)
+                .first()
+                or 0
+            )
+            _version = (version, time.monotonic())
+    return version
+
+
+def bump_version():
+    """
+    Move every cached neighbour list to a new version. Call inside the transaction storing lists.
+    """
+
+    if not NeighbourVersion.objects.filter(pk=1).update(version=F("version") + 1):
+        NeighbourVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+    # This process sees the new version once it commits, others after their next check.
+    transaction.on_commit(forget_version)
+
+
+def forget_version():
+    global _version
+    _version = (None, None)
+
+
+def cache_key(book_id):
+    return f"book_nest:neighbours:{current_version()}:{book_id}"
+
+
+def similar_books(book_id, limit):
+    """
+    Return the precomputed neighbours of a book, best first.
+
+    The whole list is read with one query on the (book, rank) index and
+    cached for BOOK_NEIGHBOURS["CACHE_TIMEOUT"] seconds, under the version
+    bumped whenever lists are stored. Every process re-reads the version
+    from the database at most every VERSION_CHECK_INTERVAL seconds, so new
+    lists are served that soon even with a per-process cache.
+
+    Args:
+        book_id (int): The ID of the book.
+        limit (int): The number of neighbours to return.
+
+    Returns:
+        list | None: `{"id", "title", "score"}` dicts, or None if no list was
+        computed for the book or `limit` exceeds BOOK_NEIGHBOURS["K"].
+    """
+
+    options = neighbour_settings()
+    if limit > options["K"]:
+        return None
+
+    key = cache_key(book_id)
+    neighbours = cache.get(key)
+    if neighbours is None:
+        rows = (
+            BookNeighbour.objects.filter(
+                book_id=book_id,
+                book__deleted_at__isnull=True,
+                neighbour__deleted_at__isnull=True,
+            )
+            .order_by("rank")
+            .values_list("neighbour_id", "neighbour__title", "score")
+        )
+        neighbours = [
+            {"id": neighbour_id, "title": title, "score": round(score, 4)}
+            for neighbour_id, title, score in rows
+        ]
+        cache.set(key, neighbours, options["CACHE_TIMEOUT"])
+    return neighbours[:limit] or None
+
+
+def enqueue(book_ids):
+    """
+    Mark the neighbour lists of `book_ids` as stale.
+    """
+
+    NeighbourRefresh.objects.bulk_create(
+        [NeighbourRefresh(book_id=book_id) for book_id in set(book_ids)],
+        update_conflicts=True,
+        unique_fields=["book_id"],
+        update_fields=["queued_at"],
+    )
+
+
+def reverse_neighbours(book_ids):
+    """
+    Return the IDs of the books listing any of `book_ids` as a neighbour.
+    """
+
+    return list(
+        BookNeighbour.objects.filter(neighbour_id__in=book_ids)
+        .values_list("book_id", flat=True)
+        .distinct()
+    )
+
+
+def store(book_ids, ids, scores):
+    """
+    Replace the neighbour lists of `book_ids` in one transaction and bump the version.
+
+    Args:
+        book_ids (list): The books whose lists are replaced.
+        ids (np.ndarray): `(len(book_ids), k)` neighbour IDs; -1 marks a missing neighbour.
+        scores (np.ndarray): The matching similarities.
+    """
+
+    rows = [
+        BookNeighbour(
+            book_id=book_id, neighbour_id=neighbour_id, rank=rank, score=score
+        )
+        for book_id, row_ids, row_scores in zip(book_ids, ids.tolist(), scores.tolist())
+        for rank, (neighbour_id, score) in enumerate(zip(row_ids, row_scores))
+        if neighbour_id >= 0
+    ]
+    with transaction.atomic():
+        BookNeighbour.objects.filter(book_id__in=book_ids).delete()
+        BookNeighbour.objects.bulk_create(rows, batch_size=5000)
+        bump_version()
+
+
+def displaced(book_ids, ids, scores, k):
+    """
+    Find the books whose stored lists should now include one of `book_ids`.
+
+    A book qualifies when one of `book_ids` found it as a neighbour with a
+    higher score than the last entry of its list (or its list is short) but
+    is not on that list yet. Books without a stored list are skipped; they
+    are filled by a full build.
+
+    Returns:
+        set: The IDs of the books to refresh.
+    """
+
+    best = {}
+    for book_id, row_ids, row_scores in zip(book_ids, ids.tolist(), scores.tolist()):
+        for neighbour_id, score in zip(row_ids, row_scores):
+            if neighbour_id >= 0:
+                best.setdefault(neighbour_id, []).append((book_id, score))
+
+    lists = {}
+    for book_id, neighbour_id, score in BookNeighbour.objects.filter(
+        book_id__in=list(best)
+    ).values_list("book_id", "neighbour_id", "score"):
+        lists.setdefault(book_id, {})[neighbour_id] = score
+
+    stale = set()
+    for neighbour_id, candidates in best.items():
+        current = lists.get(neighbour_id)
+        if current is None:
+            continue
+        worst = min(current.values()) if len(current) >= k else -1.0
+        if any(b not in current and s > worst for b, s in candidates):
+            stale.add(neighbour_id)
+    return stale
+
+
+def rebuild(index, k=None, workers=1):
+    """
+    Recompute the neighbour list of every indexed book and clear the refresh queue.
+
+    Books are written in ascending id order, one transaction per BATCH_SIZE
+    books, so the write lock is released between batches and every book
+    keeps its old list until its batch commits. Each batch also drops the
+    lists of the unindexed (deleted) books within its id range.
+
+    Args:
+        index (LSHIndex): The index to search, covering the whole catalog.
+        k (int | None): Neighbours per book; BOOK_NEIGHBOURS["K"] by default.
+        workers (int): Processes used to search the index.
+
+    Returns:
+        int: The number of books processed.
+    """
+
+    options = neighbour_settings()
+    k = k or options["K"]
+    started = timezone.now()
+    book_ids = index.ids.tolist()
+    ids, scores = neighbour_lists(index, k, workers=workers)
+
+    batch = options["BATCH_SIZE"]
+    previous = 0
+    for start in range(0, len(book_ids), batch):
+        chunk = book_ids[start : start + batch]
+        with transaction.atomic():
+            BookNeighbour.objects.filter(
+                book_id__gt=previous, book_id__lte=chunk[-1]
+            ).delete()
+            store(chunk, ids[start : start + batch], scores[start : start + batch])
+        previous = chunk[-1]
+
+    with transaction.atomic():
+        BookNeighbour.objects.filter(book_id__gt=previous).delete()
+        NeighbourRefresh.objects.filter(queued_at__lte=started).delete()
+        bump_version()
+    return len(book_ids)
+
+
+def process_queue(index, k=None, workers=1):
+    """
+    Refresh the neighbour lists of the queued books.
+
+    Each batch recomputes the queued books, replaces their lists and queues
+    the books they displaced, until the queue is empty. A book is refreshed at
+    most once per call, since every refresh searches the same `index`.
+    Queue entries re-queued while their batch ran are kept for the next call.
+
+    Args:
+        index (LSHIndex): The index to search, built after the queued changes.
+        k (int | None): Neighbours per book; BOOK_NEIGHBOURS["K"] by default.
+        workers (int): Processes used to search the index.
+
+    Returns:
+        int: The number of books refreshed.
+    """
+
+    options = neighbour_settings()
+    k = k or options["K"]
+    refreshed = set()
+
+    while True:
+        started = timezone.now()
+        queued = list(
+            NeighbourRefresh.objects.exclude(book_id__in=refreshed)
+            .order_by("queued_at")
+            .values_list("book_id", flat=True)[: options["BATCH_SIZE"]]
+        )
+        if not queued:
+            return len(refreshed)
+
+        positions = index.positions(queued)
+        book_ids = index.ids[positions].tolist()
+        ids, scores = neighbour_lists(index, k, positions=positions, workers=workers)
+        refreshed.update(queued)
+
+        with transaction.atomic():
+            # Deleted books are no longer indexed; their rows went with them.
+            store(book_ids, ids, scores)
+            stale = displaced(book_ids, ids, scores, k) - refreshed
+            if stale:
+                enqueue(stale)
+            NeighbourRefresh.objects.filter(
+                book_id__in=queued, queued_at__lte=started
+            ).delete()
+
+
+def queue_size():
+    return NeighbourRefresh.objects.count()
@@ -0,0 +1,161 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Case, Count, F, FloatField, Q, Value, When
+
+from .models import Book
+from . import similarity, snapshot
+
+
+def titles_in_order(book_ids):
+    """
+    Fetch the titles of `book_ids` with one query, keeping the given order.
+    """
+
+    titles = dict(Book.objects.filter(id__in=book_ids).values_list("id", "title"))
+    return [titles[book_id] for book_id in book_ids if book_id in titles]
+
+
+def recommend_by_category(favorites, limit):
+    """
+    Recommend books sharing a category with any of the favorites.
+
+    Args:
+        favorites (list[tuple]): `(book_id, category, auther_id)` of each favorite.
+        limit (int): The maximum number of recommendations.
+
+    Returns:
+        list: The recommended book titles.
+    """
+
+    categories = [fav[1] for fav in favorites]
+    favorite_ids = [fav[0] for fav in favorites]
+    recommended_books = Book.objects.filter(category__in=categories).exclude(
+        id__in=favorite_ids
+    )[:limit]
+    return [book.title for book in recommended_books]
+
+
+def recommend_by_similarity(favorites, limit):
+    """
+    Recommend the books whose descriptions are most similar to the favorites, using the ANN index.
+
+    Args:
+        favorites (list[tuple]): `(book_id, category, auther_id)` of each favorite.
+        limit (int): The maximum number of recommendations.
+
+    Returns:
+        list: The recommended book titles, most similar first.
+    """
+
+    ids, _ = similarity.get_index().recommend([fav[0] for fav in favorites], limit)
+    return titles_in_order(ids.tolist())
+
+
+def recommend_from_snapshot(favorites, limit):
+    """
+    Recommend books by category and author overlap, scored over the in-process catalog snapshot.
+
+    Every book is scored with vectorized numpy operations and the titles
+    come from the snapshot's string table, so no query hits the catalog.
+
+    Args:
+        favorites (list[tuple]): `(book_id, category, auther_id)` of each favorite.
+        limit (int): The maximum number of recommendations.
+
+    Returns:
+        list: The recommended book titles, best first.
+    """
+
+    catalog = snapshot.get_snapshot()
+    with snapshot.lock:
+        ids = catalog.recommend(
+            [fav[0] for fav in favorites],
+            limit,
+            category_weight=settings.RECOMMENDATIONS["CATEGORY_WEIGHT"],
+            author_weight=settings.RECOMMENDATIONS["AUTHOR_WEIGHT"],
+        )
+        return [catalog.title(catalog.position(book_id)) for book_id in ids]
+
+
+def recommend_by_score(favorites, limit):
+    """
+    Rank candidate books with one grouped SQL query.
+
+    Each book scores CATEGORY_WEIGHT for every favorite in its category,
+    AUTHOR_WEIGHT for every favorite by its author and POPULARITY_WEIGHT for
+    every user who favorited it. Only books sharing a category or author
+    with the favorites are considered (both columns are indexed), favorites
+    are excluded, and the database returns just the top `limit` rows.
+
+    Args:
+        favorites (list[tuple]): `(book_id, category, auther_id)` of each favorite.
+        limit (int): The maximum number of recommendations.
+
+    Returns:
+        list: The recommended book titles, best first.
+    """
+
+    weights = settings.RECOMMENDATIONS
+    categories = Counter(fav[1] for fav in favorites)
+    authors = Counter(fav[2] for fav in favorites)
+
+    category_score = Case(
+        *[
+            When(category=category, then=Value(weights["CATEGORY_WEIGHT"] * count))
+            for category, count in categories.items()
+        ],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    author_score = Case(
+        *[
+            When(auther_id=auther_id, then=Value(weights["AUTHOR_WEIGHT"] * count))
+            for auther_id, count in authors.items()
+        ],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+    books = (
+        Book.objects.filter(Q(category__in=categories) | Q(auther_id__in=authors))
+        .exclude(id__in=[fav[0] for fav in favorites])
+        .values("id", "title")
+        .annotate(
+            score=category_score
+            + author_score
+            + Value(weights["POPULARITY_WEIGHT"]) * Count("favorites")
+        )
+        .order_by(F("score").desc(), "id")
+        .values_list("title", flat=True)[:limit]
+    )
+    return list(books)
+
+
+BACKENDS = {
+    "category": recommend_by_category,
+    "ann": recommend_by_similarity,
+    "snapshot": recommend_from_snapshot,
+    "score": recommend_by_score,
+}
+
+
+def recommend(favorites, mode=None, limit=None):
+    """
+    Recommend books for a favorites list with the chosen backend.
+
+    Args:
+        favorites (list[tuple]): `(book_id, category, auther_id)` of each favorite.
+        mode (str | None): A key of BACKENDS; defaults to RECOMMENDATIONS["BACKEND"].
+        limit (int | None): Defaults to RECOMMENDATIONS["LIMIT"].
+
+    Returns:
+        list: The recommended book titles.
+
+    Raises:
+        KeyError: If `mode` is not a known backend.
+    """
+
+    mode = mode or settings.RECOMMENDATIONS["BACKEND"]
+    limit = limit or settings.RECOMMENDATIONS["LIMIT"]
+    return BACKENDS[mode](favorites, limit)
@@ -1,8 +1,76 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
 from .models import *
+from .signals import books_bulk_saved
+
+
+class DynamicFieldsMixin:
+    """
+    Mixin that lets a serializer render only a subset of its declared fields.
+
+    The caller passes `fields` (the fields to keep) and/or `omit` (the fields to
+    drop) as keyword arguments. Dropped fields are removed before any
+    representation work happens, so they cost nothing per row.
+
+    Serializers using this mixin also declare `value_lookups`, a mapping of each
+    output field to the ORM lookup it reads from. Views use it to trim the SQL
+    with `only()`/`values()` and to build rows straight from `values()`.
+    """
+
+    value_lookups = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        omit = kwargs.pop("omit", None)
+        super().__init__(*args, **kwargs)
+
+        # Building the fields is left for later unless some are dropped: the
+        # child of a list serializer builds them once bound to its parent.
+        if fields is not None or omit:
+            for name in self.excluded_fields(self.fields, fields, omit):
+                self.fields.pop(name)
+
+    @staticmethod
+    def excluded_fields(available, fields=None, omit=None):
+        """
+        Work out which of the available fields should be dropped.
+
+        Args:
+            available (Iterable[str]): The serializer field names.
+            fields (Iterable[str] | None): The fields to keep, or None for all.
+            omit (Iterable[str] | None): The fields to drop.
+
+        Returns:
+            set: The names of the fields to drop.
+        """
+
+        excluded = set(omit or ())
+        if fields is not None:
+            excluded |= set(available) - set(fields)
+        return excluded & set(available)
+
+    @classmethod
+    def selected_fields(cls, fields=None, omit=None):
+        """
+        Return the output fields that remain after applying `fields` and `omit`.
 
+        Args:
+            fields (Iterable[str] | None): The fields to keep, or None for all.
+            omit (Iterable[str] | None): The fields to drop.
 
-class AutherSerializer(serializers.ModelSerializer):
+        Returns:
+            list: The remaining field names, in declaration order.
+        """
+
+        available = cls.Meta.fields
+        excluded = cls.excluded_fields(available, fields, omit)
+        return [name for name in available if name not in excluded]
+
+
+class AutherSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for the Auther model.
 
@@ -15,12 +83,169 @@ class AutherSerializer(serializers.ModelSerializer):
         awards (str): Any awards won by the author.
     """
 
+    value_lookups = {
+        "name": "name",
+        "biography": "biography",
+        "birth_date": "birth_date",
+        "nationality": "nationality",
+        "website": "website",
+        "awards": "awards",
+    }
+
     class Meta:
         model = Auther
         fields = ["name", "biography", "birth_date", "nationality", "website", "awards"]
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BulkAutherField(serializers.PrimaryKeyRelatedField):
+    """
+    `auther` field of the items of a BookListSerializer, reading the authors it loaded in advance.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            auther = self.root.authers.get(int(data))
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if auther is None:
+            self.fail("does_not_exist", pk_value=data)
+        return auther
+
+
+class BookListSerializer(serializers.ListSerializer):
+    """
+    Serializer for a list of books, validated and written with a fixed number of queries.
+
+    One serializer per book would look up its author and check that its
+    title is unique with a query each. Here the authors of all the items are
+    loaded with one `IN` query, and the titles checked with another, before
+    the items are validated. The books are then written with `bulk_create`
+    or `bulk_update`.
+
+    To update, pass a dict of the books by id as the instance; every item
+    then carries the `id` of the book it changes.
+
+    Attributes:
+        authers (dict): The authors referenced by the items, by id.
+        title_owners (dict): The id of the existing book with each title of the items.
+        title_counts (Counter): How often each title appears in the items.
+    """
+
+    # SQLite limits the number of parameters of a statement.
+    query_batch_size = 900
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.prefetch([item for item in data if isinstance(item, dict)])
+        return super().to_internal_value(data)
+
+    def prefetch(self, items):
+        auther_ids = set()
+        for item in items:
+            try:
+                auther_ids.add(int(item.get("auther")))
+            except (TypeError, ValueError):
+                pass
+        self.authers = Auther.objects.in_bulk(auther_ids)
+
+        titles = [
+            item["title"].strip()
+            for item in items
+            if isinstance(item.get("title"), str)
+        ]
+        self.title_counts = Counter(titles)
+        unique_titles = list(self.title_counts)
+        self.title_owners = {}
+        for start in range(0, len(unique_titles), self.query_batch_size):
+            batch = unique_titles[start : start + self.query_batch_size]
+            self.title_owners.update(
+                Book.all_objects.filter(title__in=batch).values_list("title", "id")
+            )
+
+    def check_title(self, title, book):
+        """
+        Reject a title held by another book or given to several items.
+        """
+
+        owner = self.title_owners.get(title)
+        if owner is not None and (book is None or owner != book.id):
+            raise serializers.ValidationError(
+                f"{Book._meta.verbose_name} with this title already exists."
+            )
+        if self.title_counts[title] > 1:
+            raise serializers.ValidationError("This title appears more than once.")
+
+    def run_child_validation(self, data):
+        if self.instance is None:
+            return super().run_child_validation(data)
+        try:
+            book = self.instance.get(int(data.get("id")))
+        except (AttributeError, TypeError, ValueError):
+            book = None
+        if book is None:
+            raise serializers.ValidationError({"id": ["No book with this id."]})
+        self.child.instance = book
+        attrs = super().run_child_validation(data)
+        attrs["id"] = book.id
+        return attrs
+
+    def write(self, func, *args):
+        """
+        Run a bulk write in a savepoint, turning a title taken concurrently into a validation error.
+        """
+
+        try:
+            with transaction.atomic():
+                return func(*args)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                "Another request wrote one of these titles meanwhile; try again."
+            )
+
+    def create(self, validated_data):
+        books = self.write(
+            Book.objects.bulk_create,
+            [
+                Book(**attrs, title_normalized=normalize_title(attrs["title"]))
+                for attrs in validated_data
+            ],
+        )
+        books_bulk_saved.send(
+            sender=Book,
+            books=books,
+            created=True,
+            text_changed=[book.id for book in books],
+        )
+        return books
+
+    def update(self, instance, validated_data):
+        books = []
+        fields = set()
+        text_changed = []
+        for attrs in validated_data:
+            book = instance[attrs.pop("id")]
+            if any(
+                name in attrs and attrs[name] != getattr(book, name)
+                for name in ("title", "description")
+            ):
+                text_changed.append(book.id)
+            if "title" in attrs:
+                attrs["title_normalized"] = normalize_title(attrs["title"])
+            for name, value in attrs.items():
+                setattr(book, name, value)
+            fields.update(attrs)
+            books.append(book)
+        if fields:
+            self.write(Book.objects.bulk_update, books, sorted(fields))
+        books_bulk_saved.send(
+            sender=Book, books=books, created=False, text_changed=text_changed
+        )
+        return books
+
+
+class BookSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for the Book model.
 
@@ -37,8 +262,20 @@ class BookSerializer(serializers.ModelSerializer):
     auther_name = serializers.SerializerMethodField()
     auther = serializers.PrimaryKeyRelatedField(queryset=Auther.objects.all())
 
+    value_lookups = {
+        "title": "title",
+        "auther": "auther",
+        "auther_name": "auther__name",
+        "description": "description",
+        "category": "category",
+        "published_date": "published_date",
+        "language": "language",
+        "pages": "pages",
+    }
+
     class Meta:
         model = Book
+        list_serializer_class = BookListSerializer
         fields = [
             "title",
             "auther",
@@ -50,6 +287,27 @@ class BookSerializer(serializers.ModelSerializer):
             "pages",
         ]
 
+    def get_fields(self):
+        fields = super().get_fields()
+        # Deleted books keep their title until they are purged.
+        for validator in fields["title"].validators:
+            if isinstance(validator, UniqueValidator):
+                validator.queryset = Book.all_objects.all()
+        if isinstance(self.parent, BookListSerializer):
+            # The list serializer checks every author and title with one query each.
+            fields["auther"] = BulkAutherField(queryset=Auther.objects.all())
+            fields["title"].validators = [
+                validator
+                for validator in fields["title"].validators
+                if not isinstance(validator, UniqueValidator)
+            ]
+        return fields
+
+    def validate_title(self, value):
+        if isinstance(self.parent, BookListSerializer):
+            self.parent.check_title(value, self.instance)
+        return value
+
     def get_auther_name(self, obj):
         """
         Retrieve the name of the author for a given book.
@@ -64,7 +322,7 @@ class BookSerializer(serializers.ModelSerializer):
         return obj.auther.name
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for the Favorite model.
 
@@ -79,6 +337,14 @@ class FavoriteSerializer(serializers.ModelSerializer):
     book = serializers.PrimaryKeyRelatedField(queryset=Book.objects.all())
     user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
 
+    value_lookups = {
+        "id": "id",
+        "user": "user",
+        "book": "book",
+        "first_name": "user__first_name",
+        "book_title": "book__title",
+    }
+
     class Meta:
         model = Favorite
         fields = ["id", "user", "book", "first_name", "book_title"]
@@ -0,0 +1,142 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from .models import Auther, Book
+from . import cache, neighbours, similarity, snapshot, tasks, titles
+
+# Sent with `books`, `created` and `text_changed` (the IDs of the books whose
+# title or description changed) after books are written with bulk_create or
+# bulk_update, which send no post_save.
+books_bulk_saved = Signal()
+
+# Sent with `book_ids` when books are soft-deleted (see book_nest.deletion),
+# which updates them without sending post_save or post_delete.
+books_soft_deleted = Signal()
+
+
+@receiver(post_save, sender=Book)
+def update_similarity_index(sender, instance, update_fields=None, **kwargs):
+    """
+    Apply a saved book to the in-process similarity index once the write commits.
+    """
+
+    if update_fields is not None and not {"title", "description"} & set(update_fields):
+        return
+    transaction.on_commit(lambda: similarity.books_saved([instance]))
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_similarity_index(sender, instance, **kwargs):
+    """
+    Drop a deleted book from the in-process similarity index once the delete commits.
+    """
+
+    book_id = instance.id
+    transaction.on_commit(lambda: similarity.books_deleted([book_id]))
+
+
+@receiver(post_save, sender=Book)
+def update_catalog_snapshot(sender, instance, **kwargs):
+    """
+    Apply a saved book to the in-process catalog snapshot once the write commits.
+    """
+
+    transaction.on_commit(lambda: snapshot.book_saved(instance))
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_catalog_snapshot(sender, instance, **kwargs):
+    """
+    Drop a deleted book from the in-process catalog snapshot once the delete commits.
+    """
+
+    book_id = instance.id
+    transaction.on_commit(lambda: snapshot.book_deleted(book_id))
+
+
+@receiver(post_save, sender=Book)
+def update_title_map(sender, instance, **kwargs):
+    """
+    Apply a saved book to the in-process title map once the write commits.
+    """
+
+    transaction.on_commit(lambda: titles.book_saved(instance))
+
+
+@receiver(post_delete, sender=Book)
+def remove_from_title_map(sender, instance, **kwargs):
+    """
+    Drop a deleted book from the in-process title map once the delete commits.
+    """
+
+    book_id = instance.id
+    transaction.on_commit(lambda: titles.book_deleted(book_id))
+
+
+@receiver(post_save, sender=Book)
+def queue_neighbour_refresh(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Queue the neighbour lists affected by a text change in the background.
+    """
+
+    if update_fields is not None and not {"title", "description"} & set(update_fields):
+        return
+    tasks.queue_neighbour_refresh.delay(instance.id, created)
+
+
+@receiver(pre_delete, sender=Book)
+def queue_neighbour_refresh_on_delete(sender, instance, **kwargs):
+    """
+    Queue the neighbour lists a book is about to disappear from.
+    """
+
+    neighbours.enqueue(neighbours.reverse_neighbours([instance.id]))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Auther)
+@receiver(post_delete, sender=Auther)
+def bump_catalog_version(sender, instance, **kwargs):
+    """
+    Invalidate cached book lists, searches and recommendations with the catalog change.
+    """
+
+    cache.bump_catalog_version()
+
+
+@receiver(books_bulk_saved, sender=Book)
+def refresh_after_bulk_save(sender, books, created, text_changed, **kwargs):
+    """
+    Do for books written in bulk what the post_save receivers do for single saves.
+    """
+
+    changed = set(text_changed)
+
+    def apply():
+        similarity.books_saved([book for book in books if book.id in changed])
+        for book in books:
+            snapshot.book_saved(book)
+            titles.book_saved(book)
+
+    cache.bump_catalog_version()
+    transaction.on_commit(apply)
+    if text_changed:
+        tasks.queue_neighbour_refresh_many.delay(text_changed, created)
+
+
+@receiver(books_soft_deleted, sender=Book)
+def hide_soft_deleted_books(sender, book_ids, **kwargs):
+    """
+    Drop soft-deleted books from the similarity index, the snapshot, the title map and the caches.
+    """
+
+    def apply():
+        similarity.books_deleted(book_ids)
+        for book_id in book_ids:
+            snapshot.book_deleted(book_id)
+            titles.book_deleted(book_id)
+
+    cache.bump_catalog_version()
+    transaction.on_commit(apply)
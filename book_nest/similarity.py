@@ -0,0 +1,660 @@
+import logging
+import multiprocessing
+import re
+import threading
+import zlib
+
+from django.conf import settings
+from django.db import connection
+
+from project.startup import lazy_import
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+DEFAULT_SIMILARITY = {
+    "DIMENSIONS": 128,
+    "TABLES": 12,
+    "BITS": 10,
+    "PROBES": 1,
+    "SEED": 42,
+    "EXACT_THRESHOLD": 5000,
+    "REBUILD_AFTER": 1000,
+}
+
+
+def similarity_settings():
+    """
+    Return settings.SIMILARITY merged over the defaults.
+    """
+
+    return {**DEFAULT_SIMILARITY, **getattr(settings, "SIMILARITY", {})}
+
+
+def book_text(title, description):
+    """
+    Return the text a book is vectorized from; the title counts twice.
+    """
+
+    return f"{title} {title} {description or ''}"
+
+
+def hashed_tokens(texts, dimensions):
+    """
+    Hash every token of every text into one of `dimensions` signed buckets.
+
+    crc32 is used instead of `hash()` so buckets are stable across processes.
+
+    Args:
+        texts (Iterable[str]): The documents.
+        dimensions (int): The number of buckets.
+
+    Returns:
+        tuple: `(rows, columns, signs)` arrays with one entry per token.
+    """
+
+    rows, columns, signs = [], [], []
+    for row, text in enumerate(texts):
+        for token in TOKEN_RE.findall(text.lower()):
+            digest = zlib.crc32(token.encode())
+            rows.append(row)
+            columns.append(digest % dimensions)
+            signs.append(1.0 if digest & 0x80000000 else -1.0)
+    return (
+        np.asarray(rows, dtype=np.int64),
+        np.asarray(columns, dtype=np.int64),
+        np.asarray(signs, dtype=np.float32),
+    )
+
+
+def vectorize(texts, dimensions, idf=None):
+    """
+    Turn texts into L2-normalized hashed TF-IDF vectors.
+
+    Args:
+        texts (list[str]): The documents.
+        dimensions (int): The vector size.
+        idf (np.ndarray | None): Precomputed IDF weights; computed from `texts` if None.
+
+    Returns:
+        tuple: `(vectors, idf)`, a float32 `(len(texts), dimensions)` matrix and the IDF weights.
+    """
+
+    rows, columns, signs = hashed_tokens(texts, dimensions)
+
+    if idf is None:
+        present = np.unique(rows * dimensions + columns) % dimensions
+        document_frequency = np.bincount(present, minlength=dimensions)
+        idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(
+            np.float32
+        )
+
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    np.add.at(vectors, (rows, columns), signs)
+    vectors *= idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors, idf
+
+
+def top_k(scores, k):
+    """
+    Return the positions of the `k` highest scores, best first.
+    """
+
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+class LSHIndex:
+    """
+    Approximate nearest-neighbour index over book vectors using random-projection LSH.
+
+    Every table hashes a vector to a `bits`-bit code from the signs of its
+    projections onto random hyperplanes; similar vectors tend to share codes.
+    A query collects the books in its own bucket, plus the buckets one bit
+    away in each table when `probes` is 1, and ranks those candidates by
+    exact cosine similarity.
+
+    More tables and probes raise recall at the cost of more candidates; more
+    bits make buckets smaller and queries faster but lower recall.
+    Catalogs with at most `exact_threshold` books are searched exactly.
+
+    Attributes:
+        ids (np.ndarray): Book IDs, sorted ascending.
+        vectors (np.ndarray): One normalized vector per book, aligned with `ids`.
+        idf (np.ndarray): The IDF weights the vectors were built with.
+        planes (np.ndarray): The `(tables, bits, dimensions)` random hyperplanes.
+    """
+
+    def __init__(
+        self,
+        ids,
+        vectors,
+        idf,
+        planes,
+        probes=1,
+        exact_threshold=0,
+        orders=None,
+        sorted_codes=None,
+    ):
+        self.ids = ids
+        self.vectors = vectors
+        self.idf = idf
+        self.planes = planes
+        self.probes = probes
+        self.exact_threshold = exact_threshold
+        self.weights = np.left_shift(1, np.arange(planes.shape[1], dtype=np.int64))
+
+        # Bucket tables loaded from artifacts are used as they are.
+        if orders is None or sorted_codes is None:
+            codes = self.codes(vectors)
+            orders = np.argsort(codes, axis=1, kind="stable")
+            sorted_codes = np.take_along_axis(codes, orders, axis=1)
+        self.orders = orders
+        self.sorted_codes = sorted_codes
+
+    @classmethod
+    def build(cls, ids, texts, options=None):
+        """
+        Vectorize `texts` and index them under `ids`.
+
+        Args:
+            ids (Sequence[int]): Book IDs in ascending order.
+            texts (list[str]): The text of each book, aligned with `ids`.
+            options (dict | None): Overrides for the SIMILARITY settings.
+
+        Returns:
+            LSHIndex: The new index.
+        """
+
+        options = {**similarity_settings(), **(options or {})}
+        vectors, idf = vectorize(texts, options["DIMENSIONS"])
+        rng = np.random.default_rng(options["SEED"])
+        planes = rng.standard_normal(
+            (options["TABLES"], options["BITS"], options["DIMENSIONS"])
+        ).astype(np.float32)
+        return cls(
+            np.asarray(ids, dtype=np.int64),
+            vectors,
+            idf,
+            planes,
+            probes=options["PROBES"],
+            exact_threshold=options["EXACT_THRESHOLD"],
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def codes(self, vectors):
+        """
+        Return the `(tables, len(vectors))` bucket codes of `vectors`.
+        """
+
+        signs = np.einsum("tbd,nd->tnb", self.planes, vectors) > 0
+        return signs.astype(np.int64) @ self.weights
+
+    def positions(self, ids):
+        """
+        Return the positions of `ids` in the index, dropping IDs that are not indexed.
+        """
+
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        found = positions < len(self.ids)
+        positions, ids = positions[found], ids[found]
+        return positions[self.ids[positions] == ids]
+
+    def candidates(self, vector):
+        """
+        Return the positions of the books sharing a (probed) bucket with `vector`.
+        """
+
+        found = []
+        for table, code in enumerate(self.codes(vector[None, :])[:, 0]):
+            probes = [code]
+            if self.probes:
+                probes.extend(code ^ self.weights)
+            column = self.sorted_codes[table]
+            for probe in probes:
+                start = np.searchsorted(column, probe, side="left")
+                end = np.searchsorted(column, probe, side="right")
+                found.append(self.orders[table, start:end])
+        return np.unique(np.concatenate(found))
+
+    def search(self, vector, k, exclude=(), exact=False):
+        """
+        Find the `k` indexed books most similar to `vector`.
+
+        Args:
+            vector (np.ndarray): A normalized query vector.
+            k (int): The number of neighbours to return.
+            exclude (Iterable[int]): Book IDs to leave out of the results.
+            exact (bool): Compare against every book instead of the LSH candidates.
+
+        Returns:
+            tuple: `(ids, scores)` arrays, most similar first.
+        """
+
+        if exact or len(self.ids) <= self.exact_threshold:
+            positions = np.arange(len(self.ids))
+        else:
+            positions = self.candidates(vector)
+
+        excluded = self.positions(list(exclude))
+        if len(excluded):
+            positions = positions[~np.isin(positions, excluded)]
+
+        scores = self.vectors[positions] @ vector
+        best = top_k(scores, k)
+        return self.ids[positions[best]], scores[best]
+
+    def vector_for(self, title, description):
+        """
+        Vectorize a book that is not in the index, with the index's IDF weights.
+        """
+
+        vectors, _ = vectorize(
+            [book_text(title, description)], self.vectors.shape[1], self.idf
+        )
+        return vectors[0]
+
+    def similar(self, book_id, k, exact=False):
+        """
+        Find the `k` books most similar to an indexed book, excluding the book itself.
+
+        Returns:
+            tuple | None: `(ids, scores)` arrays, or None if the book is not indexed.
+        """
+
+        position = self.positions([book_id])
+        if not len(position):
+            return None
+        return self.search(self.vectors[position[0]], k, exclude=[book_id], exact=exact)
+
+    def recommend(self, book_ids, k, exact=False):
+        """
+        Find the `k` books closest to the centroid of `book_ids`, excluding them.
+
+        Returns:
+            tuple: `(ids, scores)` arrays, most similar first.
+        """
+
+        positions = self.positions(book_ids)
+        if not len(positions):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        centroid = self.vectors[positions].mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        if norm > 0:
+            centroid /= norm
+        return self.search(centroid, k, exclude=book_ids, exact=exact)
+
+
+# The index shared with forked neighbour_lists workers.
+_worker_index = None
+
+
+def _neighbour_chunk(args):
+    positions, k = args
+    ids = np.full((len(positions), k), -1, dtype=np.int64)
+    scores = np.zeros((len(positions), k), dtype=np.float32)
+    for row, position in enumerate(positions):
+        found, found_scores = _worker_index.search(
+            _worker_index.vectors[position],
+            k,
+            exclude=[_worker_index.ids[position]],
+        )
+        ids[row, : len(found)] = found
+        scores[row, : len(found)] = found_scores
+    return ids, scores
+
+
+def neighbour_lists(index, k, positions=None, workers=1, chunk_size=1000):
+    """
+    Compute the top-`k` neighbours of many indexed books.
+
+    With `workers` > 1 the books are split into chunks and searched by forked
+    processes, which share the index's memory copy-on-write.
+
+    Args:
+        index (LSHIndex): The index to search.
+        k (int): Neighbours per book.
+        positions (np.ndarray | None): Index positions of the books; all books if None.
+        workers (int): The number of processes.
+        chunk_size (int): Books per task.
+
+    Returns:
+        tuple: `(ids, scores)` arrays of shape `(len(positions), k)`; missing neighbours are -1.
+    """
+
+    global _worker_index
+
+    if positions is None:
+        positions = np.arange(len(index))
+    tasks = [
+        (positions[start : start + chunk_size], k)
+        for start in range(0, len(positions), chunk_size)
+    ]
+    if not tasks:
+        return np.empty((0, k), dtype=np.int64), np.empty((0, k), dtype=np.float32)
+
+    _worker_index = index
+    try:
+        if workers > 1:
+            with multiprocessing.get_context("fork").Pool(workers) as pool:
+                results = pool.map(_neighbour_chunk, tasks)
+        else:
+            results = [_neighbour_chunk(task) for task in tasks]
+    finally:
+        _worker_index = None
+
+    return (
+        np.concatenate([ids for ids, _ in results]),
+        np.concatenate([scores for _, scores in results]),
+    )
+
+
+class LiveIndex:
+    """
+    An LSHIndex plus the books saved and deleted since it was built.
+
+    Saved books are vectorized with the base index's IDF weights into a
+    small delta that is searched exactly; their base entries, and those of
+    deleted books, are masked. Every change returns a new LiveIndex sharing
+    the base, so readers never wait for writers.
+
+    Attributes:
+        base (LSHIndex): The index built from the catalog.
+        delta_ids (np.ndarray): IDs of the books saved since, sorted ascending.
+        delta_vectors (np.ndarray): Their vectors, aligned with `delta_ids`.
+        hidden (frozenset): IDs whose base entries are masked.
+    """
+
+    def __init__(self, base, delta_ids=None, delta_vectors=None, hidden=frozenset()):
+        self.base = base
+        dimensions = base.vectors.shape[1]
+        self.delta_ids = np.empty(0, dtype=np.int64) if delta_ids is None else delta_ids
+        self.delta_vectors = (
+            np.empty((0, dimensions), dtype=np.float32)
+            if delta_vectors is None
+            else delta_vectors
+        )
+        self.hidden = hidden
+
+    @property
+    def changes(self):
+        """
+        The number of books that differ from the base index.
+        """
+
+        return len(self.hidden | set(self.delta_ids.tolist()))
+
+    def without(self, book_ids):
+        """
+        Return a copy with `book_ids` removed.
+        """
+
+        book_ids = np.asarray(list(book_ids), dtype=np.int64)
+        keep = ~np.isin(self.delta_ids, book_ids)
+        return LiveIndex(
+            self.base,
+            self.delta_ids[keep],
+            self.delta_vectors[keep],
+            self.hidden | frozenset(book_ids.tolist()),
+        )
+
+    def with_books(self, rows):
+        """
+        Return a copy with the books of `rows`, `(id, title, description)` tuples, added or replaced.
+        """
+
+        if not rows:
+            return self
+        ids = np.asarray([row[0] for row in rows], dtype=np.int64)
+        vectors, _ = vectorize(
+            [book_text(title, description) for _, title, description in rows],
+            self.base.vectors.shape[1],
+            self.base.idf,
+        )
+        ids, first = np.unique(ids[::-1], return_index=True)
+        vectors = vectors[::-1][first]
+        live = self.without(ids.tolist())
+        merged_ids = np.concatenate([live.delta_ids, ids])
+        order = np.argsort(merged_ids, kind="stable")
+        return LiveIndex(
+            self.base,
+            merged_ids[order],
+            np.concatenate([live.delta_vectors, vectors])[order],
+            live.hidden,
+        )
+
+    def vectors_of(self, book_ids):
+        """
+        Return the vectors of the indexed books among `book_ids`.
+        """
+
+        book_ids = np.asarray(list(book_ids), dtype=np.int64)
+        in_delta = np.isin(book_ids, self.delta_ids)
+        in_base = book_ids[
+            ~in_delta & ~np.isin(book_ids, np.fromiter(self.hidden, np.int64))
+        ]
+        return np.concatenate(
+            [
+                self.delta_vectors[np.searchsorted(self.delta_ids, book_ids[in_delta])],
+                self.base.vectors[self.base.positions(in_base)],
+            ]
+        )
+
+    def search(self, vector, k, exclude=(), exact=False):
+        """
+        Find the `k` live books most similar to `vector`, as LSHIndex.search does.
+        """
+
+        exclude = list(exclude)
+        ids, scores = self.base.search(
+            vector, k, exclude=[*exclude, *self.hidden], exact=exact
+        )
+        if len(self.delta_ids):
+            keep = ~np.isin(self.delta_ids, np.asarray(exclude, dtype=np.int64))
+            ids = np.concatenate([ids, self.delta_ids[keep]])
+            scores = np.concatenate([scores, self.delta_vectors[keep] @ vector])
+            best = top_k(scores, k)
+            ids, scores = ids[best], scores[best]
+        return ids, scores
+
+    def vector_for(self, title, description):
+        return self.base.vector_for(title, description)
+
+    def similar(self, book_id, k, exact=False):
+        """
+        Find the `k` books most similar to an indexed book, excluding the book itself.
+
+        Returns:
+            tuple | None: `(ids, scores)` arrays, or None if the book is not indexed.
+        """
+
+        vectors = self.vectors_of([book_id])
+        if not len(vectors):
+            return None
+        return self.search(vectors[0], k, exclude=[book_id], exact=exact)
+
+    def recommend(self, book_ids, k, exact=False):
+        """
+        Find the `k` books closest to the centroid of `book_ids`, excluding them.
+
+        Returns:
+            tuple: `(ids, scores)` arrays, most similar first.
+        """
+
+        vectors = self.vectors_of(book_ids)
+        if not len(vectors):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        centroid = vectors.mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        if norm > 0:
+            centroid /= norm
+        return self.search(centroid, k, exclude=book_ids, exact=exact)
+
+
+_index = None
+_index_lock = threading.Lock()
+# Changes applied while a background rebuild runs, replayed onto its result.
+_replay = None
+
+
+def build_index_from_db():
+    """
+    Build an LSHIndex over every book in the catalog.
+    """
+
+    from .models import Book
+
+    rows = Book.objects.order_by("id").values_list("id", "title", "description")
+    ids, texts = [], []
+    for book_id, title, description in rows.iterator(chunk_size=10000):
+        ids.append(book_id)
+        texts.append(book_text(title, description))
+    return LSHIndex.build(ids, texts)
+
+
+def get_index():
+    """
+    Return the similarity index.
+
+    The current version of the memory-mapped artifacts is used when one has
+    been built; otherwise the index is built in this process on first use
+    and kept current by `books_saved` and `books_deleted`.
+    """
+
+    from . import artifacts
+
+    bundle = artifacts.store.current()
+    if bundle is not None:
+        return bundle.index
+
+    global _index
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LiveIndex(build_index_from_db())
+            index = _index
+    return index
+
+
+def rebuild_index():
+    """
+    Rebuild the in-process index from the catalog and swap it in, replaying the changes made meanwhile.
+    """
+
+    global _index, _replay
+    try:
+        index = LiveIndex(build_index_from_db())
+    except Exception:
+        logger.exception("Rebuilding the similarity index failed")
+        with _index_lock:
+            _replay = None
+        return
+    finally:
+        connection.close()
+    with _index_lock:
+        for change, arg in _replay:
+            index = change(index, arg)
+        _index, _replay = index, None
+
+
+def _apply(change, arg):
+    """
+    Apply a change to the loaded index, starting a background rebuild once the
+    index has drifted from its base by REBUILD_AFTER books.
+    """
+
+    global _index, _replay
+    with _index_lock:
+        if _index is None:
+            return
+        _index = change(_index, arg)
+        if _replay is not None:
+            _replay.append((change, arg))
+        elif _index.changes >= similarity_settings()["REBUILD_AFTER"]:
+            _replay = []
+            threading.Thread(
+                target=rebuild_index, name="similarity-rebuild", daemon=True
+            ).start()
+
+
+def books_saved(books):
+    """
+    Add saved books to the in-process index, or remove them if soft-deleted.
+
+    Call once the write has committed.
+    """
+
+    deleted = [book.id for book in books if book.deleted_at is not None]
+    rows = [
+        (book.id, book.title, book.description)
+        for book in books
+        if book.deleted_at is None
+    ]
+    if deleted:
+        _apply(LiveIndex.without, deleted)
+    if rows:
+        _apply(LiveIndex.with_books, rows)
+
+
+def books_deleted(book_ids):
+    """
+    Remove deleted books from the in-process index. Call once the delete has committed.
+    """
+
+    _apply(LiveIndex.without, list(book_ids))
+
+
+def invalidate_index():
+    """
+    Drop the in-process index so it is rebuilt from the catalog on next use.
+    """
+
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def similar_books(book_id, k):
+    """
+    Return the `k` books most similar to `book_id`.
+
+    Precomputed neighbour lists from the current artifacts are used when they
+    cover the book; otherwise the index is searched. Books added after the
+    index was built are vectorized on the fly.
+
+    Returns:
+        tuple | None: `(ids, scores)` arrays, or None if the book does not exist.
+    """
+
+    from . import artifacts
+    from .models import Book
+
+    bundle = artifacts.store.current()
+    if bundle is not None and k <= bundle.neighbours.shape[1]:
+        found = bundle.neighbours_of(book_id, k)
+        if found is not None:
+            return found
+
+    index = get_index()
+    found = index.similar(book_id, k)
+    if found is not None:
+        return found
+
+    book = Book.objects.filter(id=book_id).values_list("title", "description").first()
+    if book is None:
+        return None
+    return index.search(index.vector_for(*book), k, exclude=[book_id])
@@ -0,0 +1,466 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from project.startup import lazy_import
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SNAPSHOT = {
+    "MAX_AGE": 300,
+}
+
+# Column name mapped to (numpy dtype, value used for missing data).
+COLUMNS = {
+    "ids": ("int64", 0),
+    "category": ("int8", -1),
+    "author": ("int64", 0),
+    "language": ("int16", -1),
+    "pages": ("int32", -1),
+    "year": ("int16", 0),
+    "alive": ("bool", False),
+    "title_offset": ("int64", 0),
+    "title_length": ("int32", 0),
+}
+
+
+class StringTable:
+    """
+    Append-only UTF-8 string storage: one byte buffer plus offsets kept by the caller.
+
+    Replaced strings leave garbage behind until the snapshot is rebuilt.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def add(self, value):
+        """
+        Store `value` and return its `(offset, length)` in bytes.
+        """
+
+        encoded = value.encode()
+        offset = len(self.data)
+        self.data += encoded
+        return offset, len(encoded)
+
+    def get(self, offset, length):
+        return self.data[offset : offset + length].decode()
+
+    @property
+    def nbytes(self):
+        return len(self.data)
+
+
+class CatalogSnapshot:
+    """
+    Compact, column-oriented copy of the catalog held in numpy arrays.
+
+    Each book is one row across fixed-width columns: id, category code,
+    author id, language code, pages and published year, plus the offset of
+    its title in a shared string table. Rows are kept in ascending id order
+    so lookups are a binary search, and deleted books are only marked dead.
+
+    Categories are coded by their position in Book.CATEGORY_CHOICES and
+    languages by their position in `languages`.
+    """
+
+    def __init__(self, capacity=1024):
+        from .models import Book
+
+        self.category_codes = [code for code, _ in Book.CATEGORY_CHOICES]
+        self.category_index = {code: i for i, code in enumerate(self.category_codes)}
+        self.languages = []
+        self.language_index = {}
+        self.titles = StringTable()
+        self.size = 0
+        self.built_at = time.monotonic()
+        self.columns = {
+            name: np.full(capacity, missing, dtype=dtype)
+            for name, (dtype, missing) in COLUMNS.items()
+        }
+
+    @classmethod
+    def from_db(cls):
+        """
+        Build a snapshot of every book, streaming rows from the database.
+        """
+
+        from .models import Book
+
+        rows = Book.objects.order_by("id").values_list(
+            "id",
+            "title",
+            "category",
+            "auther_id",
+            "language",
+            "pages",
+            "published_date",
+        )
+        snapshot = cls(capacity=max(rows.count(), 1024))
+        for row in rows.iterator(chunk_size=10000):
+            snapshot._append(*row)
+        return snapshot
+
+    def __len__(self):
+        return int(self.columns["alive"][: self.size].sum())
+
+    def column(self, name):
+        """
+        Return the filled part of a column.
+        """
+
+        return self.columns[name][: self.size]
+
+    def _grow(self):
+        capacity = len(self.columns["ids"]) * 2
+        for name, (dtype, missing) in COLUMNS.items():
+            grown = np.full(capacity, missing, dtype=dtype)
+            grown[: self.size] = self.columns[name][: self.size]
+            self.columns[name] = grown
+
+    def _language_code(self, language):
+        if not language:
+            return -1
+        code = self.language_index.get(language)
+        if code is None:
+            code = self.language_index[language] = len(self.languages)
+            self.languages.append(language)
+        return code
+
+    def _write(
+        self,
+        position,
+        book_id,
+        title,
+        category,
+        auther_id,
+        language,
+        pages,
+        published_date,
+    ):
+        columns = self.columns
+        columns["ids"][position] = book_id
+        columns["category"][position] = self.category_index.get(category, -1)
+        columns["author"][position] = auther_id
+        columns["language"][position] = self._language_code(language)
+        columns["pages"][position] = -1 if pages is None else pages
+        columns["year"][position] = published_date.year if published_date else 0
+        columns["alive"][position] = True
+        if position >= self.size or self.title(position) != title:
+            columns["title_offset"][position], columns["title_length"][position] = (
+                self.titles.add(title)
+            )
+
+    def _append(self, *row):
+        if self.size == len(self.columns["ids"]):
+            self._grow()
+        self._write(self.size, *row)
+        self.size += 1
+
+    def position(self, book_id):
+        """
+        Return the row of `book_id`, or None if it is not in the snapshot.
+        """
+
+        ids = self.column("ids")
+        position = int(np.searchsorted(ids, book_id))
+        if position < self.size and ids[position] == book_id:
+            return position
+        return None
+
+    def upsert(self, book):
+        """
+        Add or update a book in place.
+
+        Returns:
+            bool: False if the book could not be placed without a rebuild,
+            i.e. it is new and its id is lower than the highest id held.
+        """
+
+        # A date assigned as a string is only parsed when it is saved.
+        published_date = book._meta.get_field("published_date").to_python(
+            book.published_date
+        )
+        row = (
+            book.id,
+            book.title,
+            book.category,
+            book.auther_id,
+            book.language,
+            book.pages,
+            published_date,
+        )
+        position = self.position(book.id)
+        if position is not None:
+            self._write(position, *row)
+            return True
+        if self.size and book.id < self.columns["ids"][self.size - 1]:
+            return False
+        self._append(*row)
+        return True
+
+    def remove(self, book_id):
+        """
+        Mark a book as deleted.
+        """
+
+        position = self.position(book_id)
+        if position is not None:
+            self.columns["alive"][position] = False
+
+    def title(self, position):
+        return self.titles.get(
+            int(self.columns["title_offset"][position]),
+            int(self.columns["title_length"][position]),
+        )
+
+    def mask(
+        self,
+        category=None,
+        author=None,
+        language=None,
+        min_pages=None,
+        max_pages=None,
+        year_from=None,
+        year_to=None,
+    ):
+        """
+        Return a boolean row mask of the live books matching every given filter.
+
+        Args:
+            category (str | None): A Book category code.
+            author (int | None): An author id.
+            language (str | None): A language name.
+            min_pages, max_pages (int | None): Inclusive page count bounds.
+            year_from, year_to (int | None): Inclusive publication year bounds.
+
+        Returns:
+            np.ndarray: One boolean per row.
+        """
+
+        mask = self.column("alive").copy()
+        if category is not None:
+            mask &= self.column("category") == self.category_index.get(category, -2)
+        if author is not None:
+            mask &= self.column("author") == author
+        if language is not None:
+            mask &= self.column("language") == self.language_index.get(language, -2)
+        if min_pages is not None:
+            mask &= self.column("pages") >= min_pages
+        if max_pages is not None:
+            mask &= (self.column("pages") <= max_pages) & (self.column("pages") >= 0)
+        if year_from is not None:
+            mask &= self.column("year") >= year_from
+        if year_to is not None:
+            mask &= (self.column("year") <= year_to) & (self.column("year") > 0)
+        return mask
+
+    def facets(self, mask):
+        """
+        Count the books selected by `mask` per category and per language.
+
+        Returns:
+            dict: `{"total": int, "category": {code: count}, "language": {name: count}}`.
+        """
+
+        categories = np.bincount(
+            self.column("category")[mask] + 1, minlength=len(self.category_codes) + 1
+        )[1:]
+        languages = np.bincount(
+            self.column("language")[mask] + 1, minlength=len(self.languages) + 1
+        )[1:]
+        return {
+            "total": int(mask.sum()),
+            "category": {
+                code: int(count)
+                for code, count in zip(self.category_codes, categories)
+                if count
+            },
+            "language": {
+                name: int(count)
+                for name, count in zip(self.languages, languages)
+                if count
+            },
+        }
+
+    def recommend(self, favorite_ids, k, category_weight=1.0, author_weight=1.0):
+        """
+        Score every live book against the favorites and return the best `k` ids.
+
+        A book scores `category_weight` for each favorite in its category plus
+        `author_weight` for each favorite by its author. Favorites and books
+        scoring zero are never returned; ties go to the lower id.
+
+        Returns:
+            list: Book ids, best first.
+        """
+
+        positions = [self.position(book_id) for book_id in favorite_ids]
+        positions = np.array([p for p in positions if p is not None], dtype=np.int64)
+        if not len(positions):
+            return []
+
+        category = self.column("category")
+        author = self.column("author")
+        category_counts = np.bincount(
+            category[positions] + 1, minlength=len(self.category_codes) + 1
+        )
+        favorite_authors, author_counts = np.unique(
+            author[positions], return_counts=True
+        )
+
+        scores = category_weight * category_counts[category + 1].astype(np.float32)
+        matches = np.searchsorted(favorite_authors, author)
+        matches[matches == len(favorite_authors)] = 0
+        by_favorite_author = favorite_authors[matches] == author
+        scores[by_favorite_author] += (
+            author_weight * author_counts[matches[by_favorite_author]]
+        )
+
+        scores[~self.column("alive")] = 0
+        scores[positions] = 0
+        candidates = np.flatnonzero(scores > 0)
+        candidate_scores = scores[candidates]
+        if len(candidates) > k:
+            # Keep everything above the k-th best score, then fill up with the
+            # lowest rows (i.e. lowest ids) among the books tied at it.
+            threshold = np.partition(candidate_scores, len(candidates) - k)[
+                len(candidates) - k
+            ]
+            above = candidates[candidate_scores > threshold]
+            tied = candidates[candidate_scores == threshold][: k - len(above)]
+            candidates = np.concatenate([above, tied])
+        best = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return self.column("ids")[best].tolist()
+
+    @property
+    def nbytes(self):
+        """
+        The memory held by the columns and the string table.
+        """
+
+        return sum(array.nbytes for array in self.columns.values()) + self.titles.nbytes
+
+    def bytes_per_book(self):
+        """
+        Return the bytes used per stored row, counting only the filled part of the columns.
+        """
+
+        if not self.size:
+            return 0.0
+        used = sum(array.itemsize for array in self.columns.values()) * self.size
+        return (used + self.titles.nbytes) / self.size
+
+
+_snapshot = None
+# Books saved or deleted while a background rebuild runs, replayed onto its result.
+_replay = None
+
+# Guards in-place updates of the snapshot; hold it while reading several columns.
+lock = threading.RLock()
+
+
+def snapshot_settings():
+    """
+    Return settings.CATALOG_SNAPSHOT merged over the defaults.
+    """
+
+    return {**DEFAULT_SNAPSHOT, **getattr(settings, "CATALOG_SNAPSHOT", {})}
+
+
+def get_snapshot():
+    """
+    Return this process's catalog snapshot, building it on first use.
+
+    Signals keep the snapshot current for writes made by this process. Once
+    it is older than MAX_AGE, a rebuild picking up writes made by other
+    processes starts in a background thread, and the current snapshot is
+    served until the new one is swapped in.
+    """
+
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is None:
+        with lock:
+            if _snapshot is None:
+                _snapshot = CatalogSnapshot.from_db()
+            return _snapshot
+    if time.monotonic() - snapshot.built_at > snapshot_settings()["MAX_AGE"]:
+        start_rebuild()
+    return snapshot
+
+
+def start_rebuild():
+    """
+    Rebuild the snapshot in a background thread, unless a rebuild is already running.
+    """
+
+    global _replay
+    with lock:
+        if _replay is None:
+            _replay = []
+            threading.Thread(
+                target=rebuild_snapshot, name="snapshot-rebuild", daemon=True
+            ).start()
+
+
+def rebuild_snapshot():
+    """
+    Build a new snapshot from the catalog and swap it in, replaying the writes made meanwhile.
+    """
+
+    global _snapshot, _replay
+    try:
+        snapshot = CatalogSnapshot.from_db()
+    except Exception:
+        logger.exception("Rebuilding the catalog snapshot failed")
+        with lock:
+            _replay = None
+        return
+    finally:
+        connection.close()
+    with lock:
+        for change, arg in _replay:
+            change(snapshot, arg)
+        _snapshot, _replay = snapshot, None
+
+
+def _save(snapshot, book):
+    if not snapshot.upsert(book):
+        # Served as it is until the rebuild this triggers.
+        snapshot.built_at = float("-inf")
+
+
+def _delete(snapshot, book_id):
+    snapshot.remove(book_id)
+
+
+def _apply(change, arg):
+    with lock:
+        if _snapshot is None:
+            return
+        change(_snapshot, arg)
+        if _replay is not None:
+            _replay.append((change, arg))
+
+
+def book_saved(book):
+    """
+    Apply a saved book to the snapshot, if one is loaded.
+    """
+
+    _apply(_save, book)
+
+
+def book_deleted(book_id):
+    """
+    Remove a deleted book from the snapshot, if one is loaded.
+    """
+
+    _apply(_delete, book_id)
@@ -0,0 +1,11 @@
+'use strict';
+// Reload the changelist when an autocomplete sidebar filter changes.
+window.addEventListener('load', function() {
+    django.jQuery('select[data-filter-param]').on('change', function() {
+        const url = new URL(this.dataset.filterUrl, window.location.href);
+        if (this.value) {
+            url.searchParams.set(this.dataset.filterParam, this.value);
+        }
+        window.location.href = url.toString();
+    });
+});
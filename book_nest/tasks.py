@@ -0,0 +1,53 @@
+from project.tasks import task
+
+from . import deletion, neighbours
+from .models import Deletion
+
+
+@task
+def queue_neighbour_refresh(book_id, created):
+    """
+    Queue the precomputed neighbour lists affected by a change to a book's text.
+
+    The book's own list is recomputed, as are the lists it appears on. Lists
+    it should newly appear on are found when its own list is refreshed.
+
+    Args:
+        book_id (int): The ID of the saved book.
+        created (bool): Whether the book is new, i.e. on no list yet.
+    """
+
+    affected = [book_id]
+    if not created:
+        affected.extend(neighbours.reverse_neighbours([book_id]))
+    neighbours.enqueue(affected)
+
+
+@task
+def queue_neighbour_refresh_many(book_ids, created):
+    """
+    Queue the neighbour lists affected by books written in bulk.
+
+    Args:
+        book_ids (list[int]): The IDs of the books whose text was written.
+        created (bool): Whether the books are new.
+    """
+
+    affected = list(book_ids)
+    if not created:
+        affected.extend(neighbours.reverse_neighbours(book_ids))
+    neighbours.enqueue(affected)
+
+
+@task
+def purge_deletion(deletion_id):
+    """
+    Remove the rows of a soft-deleted book or author in bounded batches.
+
+    Args:
+        deletion_id (int): The ID of the Deletion to carry out.
+    """
+
+    record = Deletion.objects.filter(id=deletion_id, finished_at__isnull=True).first()
+    if record is not None:
+        deletion.purge(record)
@@ -1,3 +1,1476 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.filters import SearchFilter
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from project import limits, metrics, startup, tasks
+from project.db import PrimaryReplicaRouter, ReplicaPinningMiddleware, pinned_to_primary
+from project.middleware import (
+    CompressionMiddleware,
+    StatefulAuthenticationMiddleware,
+    StatefulCsrfViewMiddleware,
+    StatefulMessageMiddleware,
+    StatefulSessionMiddleware,
+)
+from project.renderers import FastJSONRenderer
+from project.singleflight import SingleFlight
+from . import cache as catalog_cache
+from . import (
+    artifacts,
+    deletion,
+    export,
+    neighbours,
+    recommendations,
+    similarity,
+    snapshot,
+    titles,
+)
+from .admin import CachedCountPaginator
+from .filters import CachedSearchFilter
+from .models import (
+    Auther,
+    Book,
+    BookNeighbour,
+    Deletion,
+    Favorite,
+    NeighbourRefresh,
+    TaskJob,
+)
+from .serializers import AutherSerializer, BookListSerializer, BookSerializer
+from .views import BookViewSet
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.token = pinned_to_primary.set(False)
+
+    def tearDown(self):
+        pinned_to_primary.reset(self.token)
+
+    def test_catalog_reads_go_to_replica(self):
+        self.assertEqual(self.router.db_for_read(Book), "replica")
+        self.assertEqual(self.router.db_for_read(Auther), "replica")
+
+    def test_favorites_and_users_stay_on_primary(self):
+        self.assertEqual(self.router.db_for_read(Favorite), "default")
+        self.assertEqual(self.router.db_for_read(User), "default")
+
+    def test_reads_are_pinned_to_primary_after_a_write(self):
+        self.assertEqual(self.router.db_for_write(Favorite), "default")
+        self.assertEqual(self.router.db_for_read(Book), "default")
+
+    def test_middleware_unpins_each_request(self):
+        self.router.db_for_write(Book)
+        seen = []
+        middleware = ReplicaPinningMiddleware(
+            lambda request: seen.append(self.router.db_for_read(Book))
+        )
+        middleware(None)
+        self.assertEqual(seen, ["replica"])
+        self.assertTrue(pinned_to_primary.get())
+
+    def test_migrations_only_run_on_primary(self):
+        self.assertTrue(self.router.allow_migrate("default", "book_nest"))
+        self.assertFalse(self.router.allow_migrate("replica", "book_nest"))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_primary(self):
+        self.assertEqual(self.router.db_for_read(Book), "default")
+
+
+class FavoriteWritePathTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="secret-pass")
+        auther = Auther.objects.create(name="Author")
+        cls.books = [
+            Book.objects.create(title=f"Book {i}", auther=auther, description="d")
+            for i in range(Favorite.MAX_PER_USER + 1)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_add_is_idempotent(self):
+        for _ in range(2):
+            response = self.client.post(
+                "/favorites/add_favorite/", {"book": self.books[0].id}
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Favorite.objects.filter(user=self.user).count(), 1)
+
+    def test_add_unknown_or_invalid_book(self):
+        response = self.client.post("/favorites/add_favorite/", {"book": 0})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post("/favorites/add_favorite/", {"book": "abc"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/favorites/add_favorite/", [self.books[0].id], format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_enforces_cap(self):
+        for book in self.books[: Favorite.MAX_PER_USER]:
+            self.assertEqual(
+                Favorite.objects.add(self.user.id, book.id), Favorite.ADDED
+            )
+        response = self.client.post(
+            "/favorites/add_favorite/", {"book": self.books[-1].id}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            Favorite.objects.filter(user=self.user).count(), Favorite.MAX_PER_USER
+        )
+
+    def test_remove(self):
+        Favorite.objects.add(self.user.id, self.books[0].id)
+        url = f"/favorites/{self.books[0].id}/remove_favorite/"
+        self.assertEqual(self.client.delete(url).status_code, 200)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+
+
+@override_settings(TASKS={"EAGER": True})
+class FavoriteConcurrencyTests(TransactionTestCase):
+    threads = 16
+
+    def setUp(self):
+        self.user = User.objects.create_user("reader", password="secret-pass")
+        auther = Auther.objects.create(name="Author")
+        self.books = [
+            Book.objects.create(title=f"Book {i}", auther=auther, description="d")
+            for i in range(Favorite.MAX_PER_USER * 2)
+        ]
+
+    def hammer(self, func, args):
+        def run(arg):
+            try:
+                return func(*arg)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            return list(pool.map(run, args))
+
+    def test_concurrent_adds_never_duplicate_or_exceed_cap(self):
+        args = [(self.user.id, book.id) for book in self.books] * 3
+        results = self.hammer(Favorite.objects.add, args)
+
+        self.assertEqual(results.count(Favorite.ADDED), Favorite.MAX_PER_USER)
+        self.assertEqual(
+            Favorite.objects.filter(user=self.user).count(), Favorite.MAX_PER_USER
+        )
+
+    def test_concurrent_removes_delete_once(self):
+        Favorite.objects.add(self.user.id, self.books[0].id)
+        results = self.hammer(
+            Favorite.objects.remove, [(self.user.id, self.books[0].id)] * 32
+        )
+
+        self.assertEqual(results.count(True), 1)
+        self.assertFalse(Favorite.objects.exists())
+
+
+@override_settings(TASKS={"EAGER": True})
+class LiveIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        auther = Auther.objects.create(name="Author")
+        cls.books = [
+            Book.objects.create(title=title, auther=auther, description=description)
+            for title, description in [
+                ("Dragon Keep", "dragons and castles"),
+                ("Dragon Fire", "dragons breathing fire"),
+                ("Deep Space", "spaceships between stars"),
+                ("Star Fleet", "spaceships and stars at war"),
+            ]
+        ]
+
+    def setUp(self):
+        similarity.invalidate_index()
+        self.addCleanup(similarity.invalidate_index)
+
+    def test_saved_book_is_searchable_without_rebuild(self):
+        index = similarity.get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(
+                title="Dragon Hoard", auther=self.books[0].auther, description="dragons"
+            )
+
+        live = similarity.get_index()
+        self.assertIs(live.base, index.base)
+        ids, _ = live.similar(self.books[0].id, 2)
+        self.assertIn(book.id, ids.tolist())
+        ids, _ = live.similar(book.id, 1)
+        self.assertIn(ids[0], [self.books[0].id, self.books[1].id])
+
+    def test_changed_and_deleted_books_are_masked(self):
+        similarity.get_index()
+        book = self.books[1]
+        book.description = "spaceships and stars"
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+            self.books[3].delete()
+
+        live = similarity.get_index()
+        ids, _ = live.similar(self.books[2].id, 3)
+        self.assertEqual(ids[0], book.id)
+        self.assertNotIn(self.books[3].id, ids.tolist())
+        self.assertEqual(list(ids).count(book.id), 1)
+
+    @override_settings(SIMILARITY={"REBUILD_AFTER": 1})
+    def test_rebuilds_in_background_after_enough_changes(self):
+        index = similarity.get_index()
+        with mock.patch.object(similarity.threading, "Thread") as thread:
+            similarity.books_deleted([self.books[0].id])
+        thread.return_value.start.assert_called_once()
+        self.assertIsNot(similarity.get_index(), index)
+
+        # Changes made while rebuilding are replayed onto the new index.
+        similarity.books_deleted([self.books[1].id])
+        with mock.patch.object(similarity, "connection"):
+            similarity.rebuild_index()
+        live = similarity.get_index()
+        self.assertIsNot(live.base, index.base)
+        self.assertEqual(live.hidden, {self.books[1].id})
+        self.assertIsNone(similarity._replay)
+
+
+@override_settings(TASKS={"EAGER": True})
+class CatalogSnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.auther = Auther.objects.create(name="Author")
+        cls.book = Book.objects.create(
+            title="Old Book", auther=cls.auther, description="d"
+        )
+
+    def setUp(self):
+        snapshot._snapshot = None
+        self.addCleanup(setattr, snapshot, "_snapshot", None)
+
+    def test_saved_book_with_a_date_string_is_applied(self):
+        catalog = snapshot.get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(
+                title="New Book",
+                auther=self.auther,
+                description="d",
+                published_date="2001-05-06",
+            )
+
+        position = catalog.position(book.id)
+        self.assertEqual(catalog.column("year")[position], 2001)
+        self.assertEqual(catalog.title(position), "New Book")
+
+    def test_expired_snapshot_is_served_while_rebuilt_in_background(self):
+        catalog = snapshot.get_snapshot()
+        catalog.built_at -= snapshot.snapshot_settings()["MAX_AGE"] + 1
+        with mock.patch.object(snapshot.threading, "Thread") as thread:
+            self.assertIs(snapshot.get_snapshot(), catalog)
+            self.assertIs(snapshot.get_snapshot(), catalog)
+        thread.return_value.start.assert_called_once()
+
+        # Writes made while rebuilding are replayed onto the new snapshot.
+        snapshot.book_deleted(self.book.id)
+        with mock.patch.object(snapshot, "connection"):
+            snapshot.rebuild_snapshot()
+        rebuilt = snapshot.get_snapshot()
+        self.assertIsNot(rebuilt, catalog)
+        self.assertFalse(rebuilt.column("alive")[rebuilt.position(self.book.id)])
+        self.assertIsNone(snapshot._replay)
+
+
+@override_settings(TASKS={"EAGER": True})
+class BookNeighbourTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        auther = Auther.objects.create(name="Author")
+        cls.books = [
+            Book.objects.create(title=f"Book {i}", auther=auther, description="d")
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        neighbours.forget_version()
+        self.addCleanup(neighbours.forget_version)
+
+    def ids(self, *books):
+        return np.asarray([[book.id for book in books]], dtype=np.int64)
+
+    def test_lists_stored_by_another_process_are_served_after_version_check(self):
+        first, second, third = self.books[:3]
+        with self.captureOnCommitCallbacks(execute=True):
+            neighbours.store([first.id], self.ids(second), np.ones((1, 1)))
+        self.assertEqual(neighbours.similar_books(first.id, 1)[0]["id"], second.id)
+
+        # Another process: the version row changes, this process's cache does not.
+        with mock.patch.object(neighbours.transaction, "on_commit"):
+            neighbours.store([first.id], self.ids(third), np.ones((1, 1)))
+        self.assertEqual(neighbours.similar_books(first.id, 1)[0]["id"], second.id)
+
+        with override_settings(BOOK_NEIGHBOURS={"VERSION_CHECK_INTERVAL": 0}):
+            self.assertEqual(neighbours.similar_books(first.id, 1)[0]["id"], third.id)
+
+    @override_settings(BOOK_NEIGHBOURS={"BATCH_SIZE": 2, "K": 1})
+    def test_rebuild_stores_batches_and_drops_unindexed_books(self):
+        stale = self.books[3]
+        neighbours.store([stale.id], self.ids(self.books[0]), np.ones((1, 1)))
+        index = similarity.LSHIndex.build(
+            [book.id for book in self.books[:3]], ["a b", "a c", "b c"]
+        )
+
+        with mock.patch.object(neighbours, "store", wraps=neighbours.store) as store:
+            self.assertEqual(neighbours.rebuild(index), 3)
+
+        self.assertEqual([len(call.args[0]) for call in store.call_args_list], [2, 1])
+        self.assertFalse(BookNeighbour.objects.filter(book=stale).exists())
+        self.assertEqual(
+            set(BookNeighbour.objects.values_list("book_id", flat=True)),
+            {book.id for book in self.books[:3]},
+        )
+
+
+calls = []
+
+
+@tasks.task(max_attempts=2)
+def flaky_task(value, failures):
+    calls.append(value)
+    if calls.count(value) <= failures:
+        raise RuntimeError(value)
+
+
+class BackgroundTaskTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.now = time.time()
+        self.runner = tasks.TaskRunner()
+        self.outbox = self.runner.get_outbox()
+        patcher = mock.patch.object(tasks, "runner", self.runner)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_job_is_stored_in_the_callers_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with transaction.atomic():
+                flaky_task.delay("kept", 0)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                flaky_task.delay("rolled back", 0)
+                raise RuntimeError
+
+        self.assertEqual(
+            list(TaskJob.objects.values_list("payload", flat=True)),
+            ['{"args": ["kept", 0], "kwargs": {}}'],
+        )
+        self.assertEqual(callbacks, [self.runner.wake])
+
+    def test_identical_pending_jobs_are_deduplicated(self):
+        flaky_task.delay("a", 0)
+        flaky_task.delay("a", 0)
+        flaky_task.delay("b", 0)
+
+        self.assertEqual(TaskJob.objects.count(), 2)
+        self.assertEqual(self.runner.counters["deduplicated"], 1)
+        self.assertEqual(self.runner.run_pending(), 2)
+        self.assertFalse(TaskJob.objects.exists())
+
+    def at(self, offset):
+        """
+        Freeze the clock of project.tasks `offset` seconds after the test started.
+        """
+
+        return mock.patch.object(tasks.time, "time", return_value=self.now + offset)
+
+    @override_settings(TASKS={"BACKOFF": 10.0})
+    def test_failed_job_is_retried_with_backoff_then_kept_as_failed(self):
+        with self.at(0):
+            flaky_task.delay("a", 5)
+        with self.at(0):
+            self.assertEqual(self.runner.run_pending(), 1)
+        job = TaskJob.objects.get()
+        self.assertEqual(
+            (job.status, job.attempts, job.run_at), ("pending", 1, self.now + 10)
+        )
+
+        with self.at(9):
+            self.assertEqual(self.runner.run_pending(), 0)
+        with self.at(10):
+            self.assertEqual(self.runner.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("failed", 2))
+        self.assertIn("RuntimeError", job.last_error)
+        self.assertEqual(self.runner.counters["retried"], 1)
+        self.assertEqual(self.runner.counters["failed"], 1)
+
+        self.assertEqual(self.outbox.requeue_failed(), 1)
+        self.assertEqual(self.runner.run_pending(), 1)
+        self.assertEqual(calls, ["a"] * 3)
+
+    def test_expired_lease_is_claimed_again(self):
+        with self.at(0):
+            flaky_task.delay("a", 0)
+            self.assertEqual(len(self.outbox.claim(1, lease=60)), 1)
+        with self.at(60):
+            self.assertEqual(self.outbox.claim(1, lease=60), [])
+        with self.at(61):
+            (job,) = self.outbox.claim(1, lease=60)
+        self.assertEqual(job[3], 2)
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="secret-pass")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_invalid_autocomplete_filter_value_is_not_a_server_error(self):
+        response = self.client.get("/admin/book_nest/book/?auther__id__exact=abc")
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("e=1", response.url)
+
+    def test_cached_count_of_an_empty_queryset(self):
+        books = Book.objects.order_by("id")
+        for queryset in (books.none(), books.filter(id__in=[])):
+            self.assertEqual(CachedCountPaginator(queryset, 10).count, 0)
+
+
+class SparseFieldsetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        auther = Auther.objects.create(name="Rowling", birth_date=date(1965, 7, 31))
+        Auther.objects.create(name="Anonymous")
+        Book.objects.create(
+            title="Dated",
+            auther=auther,
+            description="d",
+            published_date=date(1997, 6, 26),
+            pages=223,
+        )
+        Book.objects.create(title="Undated", auther=auther)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def serialized(self, serializer_class, queryset, **fieldset):
+        rows = [serializer_class(obj, **fieldset).data for obj in queryset]
+        return json.loads(JSONRenderer().render(rows))
+
+    def test_fast_list_matches_the_serializer(self):
+        books = Book.objects.select_related("auther")
+        for params, fieldset in [
+            ({}, {}),
+            (
+                {"fields": "title,auther_name,published_date"},
+                {"fields": ["title", "auther_name", "published_date"]},
+            ),
+            ({"omit": "description,auther"}, {"omit": ["description", "auther"]}),
+            (
+                {"fields": "title,pages,auther", "omit": "pages"},
+                {"fields": ["title", "pages", "auther"], "omit": ["pages"]},
+            ),
+        ]:
+            with self.subTest(params=params):
+                response = self.client.get("/books/", params)
+                self.assertEqual(response.status_code, 200)
+                self.assertCountEqual(
+                    response.json(), self.serialized(BookSerializer, books, **fieldset)
+                )
+
+        response = self.client.get("/authers/", {"fields": "name,birth_date"})
+        self.assertCountEqual(
+            response.json(),
+            self.serialized(
+                AutherSerializer, Auther.objects.all(), fields=["name", "birth_date"]
+            ),
+        )
+
+    def test_unknown_fields_are_rejected(self):
+        for params in ({"fields": "title,isbn"}, {"omit": "isbn"}):
+            with self.subTest(params=params):
+                response = self.client.get("/books/", params)
+                self.assertEqual(response.status_code, 400)
+                (name,) = params
+                self.assertIn("isbn", response.json()[name][0])
+
+
+class CompressionMiddlewareTests(SimpleTestCase):
+    large = json.dumps([{"title": f"Book {i}"} for i in range(200)]).encode()
+
+    def respond(self, content, content_type="application/json", **headers):
+        response = HttpResponse(content, content_type=content_type)
+        middleware = CompressionMiddleware(lambda request: response)
+        return middleware(RequestFactory().get("/books/", headers=headers))
+
+    def test_large_json_is_encoded_as_accepted(self):
+        for accept, encoding, decompress in [
+            ("gzip, deflate", "gzip", gzip.decompress),
+            ("deflate", "deflate", zlib.decompress),
+            ("gzip;q=0.5, deflate", "deflate", zlib.decompress),
+        ]:
+            with self.subTest(accept=accept):
+                response = self.respond(self.large, accept_encoding=accept)
+                self.assertEqual(response["Content-Encoding"], encoding)
+                self.assertEqual(decompress(response.content), self.large)
+                self.assertEqual(response["Content-Length"], str(len(response.content)))
+                self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_large_json_without_accepted_encoding_is_left_alone(self):
+        for accept in ("", "br", "gzip;q=0, deflate;q=0"):
+            with self.subTest(accept=accept):
+                response = self.respond(self.large, accept_encoding=accept)
+                self.assertFalse(response.has_header("Content-Encoding"))
+                self.assertEqual(response.content, self.large)
+                self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_small_and_non_json_responses_pass_through(self):
+        for content, content_type in [
+            (b'{"title": "Book"}', "application/json"),
+            (b"<p>" * 1000, "text/html"),
+        ]:
+            with self.subTest(content_type=content_type):
+                response = self.respond(content, content_type, accept_encoding="gzip")
+                self.assertFalse(response.has_header("Content-Encoding"))
+                self.assertFalse(response.has_header("Vary"))
+                self.assertEqual(response.content, content)
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    data = [
+        {
+            "price": Decimal("12.50"),
+            "published_date": date(1997, 6, 26),
+            "updated_at": datetime(2024, 1, 2, 3, 4, 5, 678000),
+            "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+            "title": "Line\u2028break",
+        }
+    ]
+
+    def test_output_matches_json_renderer(self):
+        expected = JSONRenderer().render(self.data)
+        for use_orjson in (True, False):
+            with (
+                self.subTest(use_orjson=use_orjson),
+                override_settings(FAST_JSON_RENDERER={"USE_ORJSON": use_orjson}),
+            ):
+                self.assertEqual(FastJSONRenderer().render(self.data), expected)
+
+
+class StatefulMiddlewareTests(SimpleTestCase):
+    def run_middleware(self, path):
+        request = RequestFactory().post(path)
+        seen = {}
+
+        def view(request):
+            seen.update(
+                session=hasattr(request, "session"),
+                user=hasattr(request, "user"),
+                messages=hasattr(request, "_messages"),
+            )
+            return HttpResponse()
+
+        handler = StatefulSessionMiddleware(
+            StatefulAuthenticationMiddleware(StatefulMessageMiddleware(view))
+        )
+        handler(request)
+        csrf = StatefulCsrfViewMiddleware(view).process_view(request, view, (), {})
+        return seen, csrf
+
+    def test_api_requests_skip_session_csrf_and_messages(self):
+        seen, csrf = self.run_middleware("/books/")
+        self.assertEqual(seen, {"session": False, "user": False, "messages": False})
+        self.assertIsNone(csrf)
+
+    def test_admin_requests_keep_session_csrf_and_messages(self):
+        seen, csrf = self.run_middleware("/admin/book_nest/book/")
+        self.assertEqual(seen, {"session": True, "user": True, "messages": True})
+        self.assertEqual(csrf.status_code, 403)
+
+
+@override_settings(
+    RECOMMENDATIONS={
+        "BACKEND": "score",
+        "LIMIT": 5,
+        "CATEGORY_WEIGHT": 1.0,
+        "AUTHOR_WEIGHT": 2.0,
+        "POPULARITY_WEIGHT": 0.1,
+    }
+)
+class ScoreRecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="secret-pass")
+        other = User.objects.create_user("other", password="secret-pass")
+        a, b, c = (Auther.objects.create(name=name) for name in "ABC")
+
+        def book(title, category, auther):
+            return Book.objects.create(title=title, category=category, auther=auther)
+
+        favorites = [book("Fav 1", "HOR", a), book("Fav 2", "HOR", b)]
+        # Two horror favorites: 2.0. Written first, so it wins the tie on id.
+        book("Zeta horror", "HOR", c)
+        # One favorite by the same author: 2.0.
+        book("Alpha by A", "SF", a)
+        # 2.0 plus 0.1 for the other user's favorite.
+        popular = book("Popular horror", "HOR", c)
+        # 4.0, but deleted.
+        deleted = book("Deleted horror by A", "HOR", a)
+        book("Unrelated", "SF", c)
+
+        for favorite in favorites:
+            Favorite.objects.add(cls.user.id, favorite.id)
+        Favorite.objects.add(other.id, popular.id)
+        Book.objects.filter(id=deleted.id).update(deleted_at=timezone.now())
+        cls.favorites = list(
+            Favorite.objects.filter(user=cls.user).values_list(
+                "book__id", "book__category", "book__auther"
+            )
+        )
+
+    def test_ranking_excludes_favorites_and_deleted_books(self):
+        self.assertEqual(
+            recommendations.recommend_by_score(self.favorites, 5),
+            ["Popular horror", "Zeta horror", "Alpha by A"],
+        )
+        self.assertEqual(
+            recommendations.recommend_by_score(self.favorites, 2),
+            ["Popular horror", "Zeta horror"],
+        )
+
+    def test_score_mode_of_the_endpoint(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get("/favorites/recommendations/", {"mode": "score"})
+        self.assertEqual(
+            response.json()["recommendations"],
+            ["Popular horror", "Zeta horror", "Alpha by A"],
+        )
+
+
+class ArtifactStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(
+            override_settings(
+                RECOMMENDER_ARTIFACTS={"DIR": self.directory, "CHECK_INTERVAL": 60}
+            )
+        )
+        self.now = 1000.0
+        self.enterContext(
+            mock.patch.object(artifacts.time, "monotonic", lambda: self.now)
+        )
+
+    def write(self, ids, texts):
+        index = similarity.LSHIndex.build(ids, texts)
+        neighbours, scores = similarity.neighbour_lists(index, 2)
+        with (
+            mock.patch.object(artifacts.os, "rename", wraps=os.rename) as rename,
+            mock.patch.object(artifacts.os, "replace", wraps=os.replace) as replace,
+        ):
+            version = artifacts.write_version(index, neighbours, scores)
+
+        # Written under a hidden staging name, then renamed into place.
+        ((staging, target), _) = rename.call_args
+        self.assertEqual(Path(staging).name, f".{version}.tmp")
+        self.assertEqual(Path(target), self.directory / version)
+        # CURRENT is swapped in one rename over the old pointer.
+        ((pointer, current), _) = replace.call_args
+        self.assertTrue(Path(pointer).name.startswith(".CURRENT."))
+        self.assertEqual(Path(current), self.directory / "CURRENT")
+        self.assertEqual(artifacts.current_version(), version)
+        self.assertFalse(list(self.directory.glob(".*")))
+        return version
+
+    def test_publishing_a_version_swaps_the_store_and_prunes_the_old_one(self):
+        store = artifacts.ArtifactStore()
+        self.assertIsNone(store.current())
+
+        first = self.write([1, 2], ["dragons and castles", "dragons breathing fire"])
+        self.now += 60
+        old = store.current()
+        self.assertEqual(old.version, first)
+        self.assertIsNone(old.neighbours_of(3, 1))
+
+        second = self.write(
+            [1, 2, 3],
+            ["dragons and castles", "dragons breathing fire", "stars at war"],
+        )
+        # Still the first version until the next check.
+        self.now += 59
+        self.assertIs(store.current(), old)
+        self.now += 1
+        new = store.current()
+        self.assertEqual(new.version, second)
+        self.assertIsNotNone(new.neighbours_of(3, 1))
+
+        self.assertEqual(artifacts.prune(1), [first])
+        self.assertEqual(artifacts.versions(), [second])
+        # A worker still holding the old mapping keeps reading it.
+        self.assertIsNotNone(old.neighbours_of(1, 1))
+        # The current version is never pruned.
+        self.assertEqual(artifacts.prune(0), [])
+
+
+class StartupTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.dict(startup._lazy_modules))
+        self.enterContext(mock.patch.object(startup, "_steps", []))
+
+    def test_lazy_import_defers_the_import_to_the_first_attribute_access(self):
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        (directory / "lazy_probe.py").write_text("LOADED = True\n")
+        self.enterContext(mock.patch.object(sys, "path", [str(directory), *sys.path]))
+        self.enterContext(mock.patch.dict(sys.modules))
+
+        module = startup.lazy_import("lazy_probe")
+        self.assertIs(startup.lazy_import("lazy_probe"), module)
+        self.assertNotIn("lazy_probe", sys.modules)
+        self.assertIn("not loaded", repr(module))
+        self.assertIsNone(module.import_seconds)
+
+        self.assertTrue(module.LOADED)
+        self.assertIn("lazy_probe", sys.modules)
+        self.assertIsNotNone(module.import_seconds)
+        self.assertIs(startup.lazy_modules()["lazy_probe"], module)
+
+    def test_warm_up_hooks_run_only_when_enabled(self):
+        hook = mock.Mock()
+        startup.register_warm_up("hook", hook)
+        startup.register_warm_up("hook", hook)
+        startup.register_warm_up("failing", mock.Mock(side_effect=ValueError("cold")))
+
+        with override_settings(STARTUP={"WARM_UP": False}):
+            self.assertIsNone(startup.warm_up_if_enabled())
+        hook.assert_not_called()
+
+        with (
+            override_settings(STARTUP={"WARM_UP": True}),
+            self.assertLogs("project.startup", "ERROR"),
+        ):
+            results = startup.warm_up_if_enabled()
+        hook.assert_called_once_with()
+        self.assertEqual(
+            [(name, error) for name, _, error in results],
+            [("hook", None), ("failing", "ValueError: cold")],
+        )
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight()
+
+    def run_concurrently(self, count, func):
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            futures = [pool.submit(func) for _ in range(count)]
+            return [future.result() for future in futures]
+
+    def test_concurrent_misses_are_coalesced_into_one_computation(self):
+        computed = []
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            computed.append(1)
+            started.set()
+            release.wait(5)
+            return "value"
+
+        def get():
+            return self.flight.get("key", compute, 60)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            leader = pool.submit(get)
+            started.wait(5)
+            with ThreadPoolExecutor(max_workers=8) as waiters:
+                results = [waiters.submit(get) for _ in range(8)]
+                # Let every waiter reach the in-flight call before it finishes.
+                time.sleep(0.1)
+                release.set()
+                results = [result.result() for result in results]
+            self.assertEqual(leader.result(), "value")
+
+        self.assertEqual(results, ["value"] * 8)
+        self.assertEqual(len(computed), 1)
+        self.assertEqual(self.flight.counters["coalesced"], 8)
+        self.assertEqual(self.flight.get("key", compute, 60), "value")
+        self.assertEqual(self.flight.counters["hits"], 1)
+
+    def test_expired_value_is_served_while_it_is_recomputed(self):
+        cache.set("key", ("old", time.time() - 1), 60)
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            started.set()
+            release.wait(5)
+            return "new"
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            leader = pool.submit(self.flight.get, "key", compute, 60)
+            started.wait(5)
+            self.assertEqual(self.flight.get("key", compute, 60), "old")
+            release.set()
+            self.assertEqual(leader.result(), "new")
+
+        self.assertEqual(self.flight.counters["stale"], 1)
+        self.assertEqual(cache.get("key")[0], "new")
+
+    def test_errors_reach_every_waiting_caller(self):
+        started, release = threading.Event(), threading.Event()
+
+        def compute():
+            started.set()
+            release.wait(5)
+            raise ValueError("broken")
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            leader = pool.submit(self.flight.get, "key", compute, 60)
+            started.wait(5)
+            waiter = pool.submit(self.flight.get, "key", compute, 60)
+            time.sleep(0.1)
+            release.set()
+            for future in (leader, waiter):
+                with self.assertRaises(ValueError):
+                    future.result()
+        self.assertIsNone(cache.get("key"))
+
+
+@override_settings(DATABASE_REPLICAS=["replica"])
+class BatchReplicaTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("reader", password="secret-pass")
+        self.book = Book.objects.create(
+            title="Book", auther=Auther.objects.create(name="Author")
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, items):
+        # Replica reads are served by the primary, but recorded.
+        with mock.patch("project.db.random.choice", return_value="default") as choice:
+            response = self.client.post("/batch/", items, format="json")
+        self.assertEqual(response.status_code, 200)
+        return [result["status"] for result in response.data], choice.call_count
+
+    def test_reads_before_any_write_use_a_replica(self):
+        statuses, replica_reads = self.batch(
+            [{"path": f"/books/{self.book.id}/"}, {"path": "/authers/"}]
+        )
+        self.assertEqual(statuses, [200, 200])
+        self.assertGreater(replica_reads, 0)
+
+    def test_reads_after_a_write_use_the_primary(self):
+        statuses, replica_reads = self.batch(
+            [
+                {
+                    "method": "POST",
+                    "path": "/favorites/add_favorite/",
+                    "body": {"book": self.book.id},
+                },
+                {"path": f"/books/{self.book.id}/"},
+                {"path": "/authers/"},
+            ]
+        )
+        self.assertEqual(statuses, [200, 200, 200])
+        self.assertEqual(replica_reads, 0)
+        # The pin does not outlive the batch on the pool threads.
+        _, replica_reads = self.batch([{"path": f"/books/{self.book.id}/"}])
+        self.assertGreater(replica_reads, 0)
+
+
+class MetricsTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(
+            override_settings(
+                METRICS={"DIRECTORY": self.directory, "TOKEN": "scrape-token"}
+            )
+        )
+
+    def write(self, pid, requests):
+        data = {
+            "requests": [["BookViewSet.list", "GET", "200", requests]],
+            "latency": [],
+            "queries": [],
+            "gauges": {"http_requests_in_flight": 1},
+            "counters": {"background_tasks_total": {"completed": requests}},
+        }
+        (self.directory / f"metrics.{pid}.json").write_text(json.dumps(data))
+
+    def test_only_started_registries_flush_on_requests(self):
+        registry = metrics.Registry()
+        registry._flushed_at = float("-inf")
+        registry.maybe_flush()
+        self.assertEqual(list(self.directory.iterdir()), [])
+        with mock.patch("project.metrics.atexit.register"):
+            registry.start()
+        registry.maybe_flush()
+        self.assertTrue((self.directory / f"metrics.{os.getpid()}.json").exists())
+
+    def test_files_of_exited_processes_are_folded_together(self):
+        self.write(1001, 2)
+        self.write(1002, 3)
+        self.write(1003, 4)
+        with mock.patch(
+            "project.metrics.process_alive", side_effect=lambda pid: pid == 1003
+        ):
+            for _ in range(2):
+                requests, _, gauges, counters = metrics.collect(self.directory)
+                self.assertEqual(requests[("BookViewSet.list", "GET", "200")], 9)
+                self.assertEqual(counters["background_tasks_total"]["completed"], 9)
+                self.assertEqual(gauges["http_requests_in_flight"], 1)
+        self.assertEqual(
+            sorted(path.name for path in self.directory.glob("*.json")),
+            ["metrics.1003.json", "metrics.exited.json"],
+        )
+
+    def test_metrics_require_an_allowed_address_or_the_token(self):
+        client = Client(REMOTE_ADDR="203.0.113.5")
+        self.assertEqual(client.get("/metrics").status_code, 403)
+        response = client.get("/metrics", HTTP_AUTHORIZATION="Bearer wrong")
+        self.assertEqual(response.status_code, 403)
+        response = client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Client().get("/metrics").status_code, 200)
+
+    def test_batch_sub_request_queries_are_counted(self):
+        user = User.objects.create_user("reader", password="secret-pass")
+        book = Book.objects.create(
+            title="Book", auther=Auther.objects.create(name="Author")
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        key = ("BatchAPIView.post", "POST")
+
+        def queries():
+            histogram = metrics.registry.snapshot().queries.get(key)
+            return histogram[1] if histogram else 0
+
+        before = queries()
+        response = client.post(
+            "/batch/", [{"path": f"/books/{book.id}/"}] * 3, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(queries() - before, 3)
+
+
+@override_settings(TASKS={"EAGER": True})
+class BookBulkWriteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", password="secret-pass")
+        cls.auther = Auther.objects.create(name="Author")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def items(self, count, prefix="Bulk"):
+        return [
+            {"title": f"{prefix} {i}", "auther": self.auther.id, "description": "d"}
+            for i in range(count)
+        ]
+
+    def queries(self, method, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format="json")
+        self.assertLess(response.status_code, 300, response.data)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_the_number_of_books(self):
+        few = self.queries("post", "/books/", self.items(2, "Few"))
+        many = self.queries("post", "/books/", self.items(40, "Many"))
+        self.assertEqual(few, many)
+
+        books = list(Book.objects.order_by("id"))
+        few = self.queries(
+            "patch",
+            "/books/bulk_update/",
+            [{"id": book.id, "pages": 10} for book in books[:2]],
+        )
+        many = self.queries(
+            "patch",
+            "/books/bulk_update/",
+            [{"id": book.id, "pages": 20} for book in books],
+        )
+        self.assertEqual(few, many)
+        self.assertEqual(Book.objects.filter(pages=20).count(), 42)
+
+    def test_changed_books_are_applied_to_the_similarity_index_on_commit(self):
+        with (
+            mock.patch.object(similarity, "books_saved") as books_saved,
+            mock.patch.object(similarity, "invalidate_index") as invalidate,
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            self.client.post("/books/", self.items(2), format="json")
+            books = list(Book.objects.order_by("id"))
+            self.client.patch(
+                "/books/bulk_update/",
+                [
+                    {"id": books[0].id, "title": "Renamed"},
+                    {"id": books[1].id, "pages": 10},
+                ],
+                format="json",
+            )
+        invalidate.assert_not_called()
+        saved = [[book.id for book in call.args[0]] for call in books_saved.mock_calls]
+        self.assertEqual(saved, [[books[0].id, books[1].id], [books[0].id]])
+
+    def test_title_created_concurrently_is_a_validation_error(self):
+        prefetch = BookListSerializer.prefetch
+
+        def prefetch_then_insert(serializer, items):
+            prefetch(serializer, items)
+            Book.objects.create(title="Bulk 1", auther=self.auther)
+
+        with mock.patch.object(
+            BookListSerializer,
+            "prefetch",
+            autospec=True,
+            side_effect=prefetch_then_insert,
+        ):
+            response = self.client.post("/books/", self.items(2), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Book.objects.filter(title__startswith="Bulk").count(), 1)
+
+
+@override_settings(TASKS={"EAGER": True}, DELETION={"BATCH_SIZE": 2, "PAUSE": 0})
+class SoftDeleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="secret-pass")
+        cls.auther = Auther.objects.create(name="Author")
+        cls.books = [
+            Book.objects.create(title=f"Book {i}", auther=cls.auther, description="d")
+            for i in range(3)
+        ]
+        cls.other = Book.objects.create(
+            title="Other", auther=Auther.objects.create(name="Other"), description="d"
+        )
+        for book in cls.books:
+            Favorite.objects.add(cls.user.id, book.id)
+        BookNeighbour.objects.create(
+            book=cls.other, neighbour=cls.books[0], rank=0, score=1.0
+        )
+
+    def test_soft_delete_hides_the_books_and_purges_them_after_commit(self):
+        ids = [book.id for book in self.books]
+        with mock.patch.object(similarity, "books_deleted") as books_deleted:
+            with self.captureOnCommitCallbacks() as callbacks:
+                deletion.soft_delete(self.auther)
+            self.assertFalse(Book.objects.filter(id__in=ids).exists())
+            self.assertEqual(Book.all_objects.filter(id__in=ids).count(), 3)
+            books_deleted.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+        books_deleted.assert_called_once_with(ids)
+
+        record = Deletion.objects.get()
+        self.assertIsNotNone(record.finished_at)
+        self.assertEqual((record.books_purged, record.favorites_purged), (3, 3))
+        self.assertFalse(Book.all_objects.filter(id__in=ids).exists())
+        self.assertFalse(Auther.all_objects.filter(id=self.auther.id).exists())
+        self.assertFalse(BookNeighbour.objects.exists())
+        self.assertTrue(NeighbourRefresh.objects.filter(book_id=self.other.id).exists())
+
+    def test_interrupted_purge_resumes_with_exact_counters(self):
+        with self.captureOnCommitCallbacks():
+            record = deletion.soft_delete(self.auther)
+
+        def interrupt(record):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            deletion.purge(record, progress=interrupt)
+        record.refresh_from_db()
+        self.assertEqual((record.books_purged, record.favorites_purged), (2, 2))
+
+        deletion.purge(record)
+        record.refresh_from_db()
+        self.assertEqual((record.books_purged, record.favorites_purged), (3, 3))
+
+    def test_favorites_of_deleted_books_do_not_count_towards_the_cap(self):
+        extra = [
+            Book.objects.create(title=f"Extra {i}", auther=self.other.auther)
+            for i in range(Favorite.MAX_PER_USER - 2)
+        ]
+        for book in extra:
+            Favorite.objects.add(self.user.id, book.id)
+        self.assertEqual(
+            Favorite.objects.add(self.user.id, self.other.id), Favorite.LIMIT_REACHED
+        )
+
+        with self.captureOnCommitCallbacks():
+            deletion.soft_delete(self.books[0])
+        self.assertEqual(
+            Favorite.objects.add(self.user.id, self.other.id), Favorite.ADDED
+        )
+
+    @override_settings(BOOK_NEIGHBOURS={"VERSION_CHECK_INTERVAL": 0})
+    def test_soft_deleted_book_leaves_cached_neighbour_lists(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        kept = Book.objects.create(title="Kept", auther=self.other.auther)
+        BookNeighbour.objects.create(book=self.other, neighbour=kept, rank=1, score=0.5)
+        url = f"/books/{self.other.id}/similar/"
+        similar = self.client.get(url).json()["similar"]
+        self.assertEqual([book["id"] for book in similar], [self.books[0].id, kept.id])
+
+        # The purge has not run: the rows are still there, only hidden.
+        with self.captureOnCommitCallbacks():
+            deletion.soft_delete(self.books[0])
+        similar = self.client.get(url).json()["similar"]
+        self.assertEqual([book["id"] for book in similar], [kept.id])
+
+    def test_admin_deletes_are_soft_deletes(self):
+        admin = User.objects.create_superuser("admin", password="secret-pass")
+        self.client.force_login(admin)
+        book, *others = self.books
+        with self.captureOnCommitCallbacks():
+            response = self.client.post(
+                f"/admin/book_nest/book/{book.id}/delete/", {"post": "yes"}
+            )
+            self.assertEqual(response.status_code, 302)
+            response = self.client.post(
+                "/admin/book_nest/book/",
+                {
+                    "action": "delete_selected",
+                    "_selected_action": [others[0].id],
+                    "post": "yes",
+                },
+            )
+            self.assertEqual(response.status_code, 302)
+            response = self.client.post(
+                "/admin/book_nest/auther/",
+                {
+                    "action": "delete_in_batches",
+                    "_selected_action": [self.other.auther_id],
+                },
+            )
+            self.assertEqual(response.status_code, 302)
+
+        deleted = [book.id, others[0].id, self.other.id]
+        self.assertFalse(Book.objects.filter(id__in=deleted).exists())
+        self.assertEqual(Book.all_objects.filter(id__in=deleted).count(), 3)
+        self.assertTrue(Book.objects.filter(id=others[1].id).exists())
+        self.assertEqual(
+            sorted(Deletion.objects.values_list("model", "object_id")),
+            sorted(
+                [
+                    ("auther", self.other.auther_id),
+                    ("book", book.id),
+                    ("book", others[0].id),
+                ]
+            ),
+        )
+
+
+class CachedSearchFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        auther = Auther.objects.create(name="Rowling")
+        cls.matching = [
+            Book.objects.create(title=f"Harry Potter {i}", auther=auther)
+            for i in range(2)
+        ]
+        Book.objects.create(title="Potions", auther=auther)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        catalog_cache.forget_version()
+        self.addCleanup(catalog_cache.forget_version)
+        search = SearchFilter.filter_queryset
+        patcher = mock.patch.object(
+            SearchFilter, "filter_queryset", autospec=True, side_effect=search
+        )
+        self.searches = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, terms):
+        request = Request(APIRequestFactory().get("/books/", {"search": terms}))
+        queryset = CachedSearchFilter().filter_queryset(
+            request, Book.objects.all(), BookViewSet()
+        )
+        return [book.id for book in queryset]
+
+    def test_equivalent_searches_share_one_entry(self):
+        expected = [book.id for book in self.matching]
+        for terms in ("Harry  Potter", "potter HARRY", "harry,potter,harry"):
+            self.assertEqual(self.search(terms), expected)
+        self.assertEqual(self.searches.call_count, 1)
+
+        self.search("potter")
+        self.assertEqual(self.searches.call_count, 2)
+
+    def test_catalog_write_invalidates_the_entry(self):
+        self.search("harry potter")
+        version = catalog_cache.catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(
+                title="Harry Potter 2", auther=self.matching[0].auther
+            )
+        # The version lives in the database, not in the per-process cache.
+        cache.clear()
+        self.assertGreater(catalog_cache.catalog_version(), version)
+        self.assertIn(book.id, self.search("harry potter"))
+        self.assertEqual(self.searches.call_count, 2)
+
+    def test_writes_by_other_processes_invalidate_after_version_check(self):
+        self.search("harry potter")
+        version = catalog_cache.catalog_version()
+        # Another process: the version row changes, this process is not told.
+        with mock.patch.object(catalog_cache.transaction, "on_commit"):
+            book = Book.objects.create(
+                title="Harry Potter 2", auther=self.matching[0].auther
+            )
+        self.assertNotIn(book.id, self.search("harry potter"))
+
+        with override_settings(CATALOG_CACHE={"VERSION_CHECK_INTERVAL": 0}):
+            self.assertGreater(catalog_cache.catalog_version(), version)
+            self.assertIn(book.id, self.search("harry potter"))
+
+    @override_settings(CATALOG_CACHE={"SEARCH_MAX_IDS": 1})
+    def test_broad_searches_are_not_cached(self):
+        for _ in range(2):
+            self.assertEqual(len(self.search("harry")), 2)
+        # One computation remembering the search as too broad, then one search per call.
+        self.assertEqual(self.searches.call_count, 3)
+
+
+class LoadSheddingTests(TransactionTestCase):
+    def setUp(self):
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.path = directory / "limits.sqlite3"
+        self.state = limits.get_state(self.path, 0.05)
+
+    def limits(self, **options):
+        return override_settings(
+            LIMITS={**settings.LIMITS, "ENABLED": True, "STATE": self.path, **options}
+        )
+
+    def test_client_out_of_tokens_gets_429(self):
+        with self.limits(RATE={"CAPACITY": 2, "REFILL_RATE": 0.5}):
+            client = Client()
+            statuses = [client.get("/authers/").status_code for _ in range(3)]
+            response = client.get("/authers/")
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "2")
+
+    def test_route_at_its_concurrency_limit_gets_503(self):
+        route = {"MAX_CONCURRENCY": 1, "ADJUST_INTERVAL": 60}
+        with self.limits(RATE=None, ROUTES={"AutherViewSet.list": route}):
+            client = Client()
+            self.assertTrue(self.state.acquire("AutherViewSet.list", 1))
+            response = client.get("/authers/")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "1")
+
+            self.state.release("AutherViewSet.list", 0.0, {"SMOOTHING": 1.0, **route})
+            self.assertEqual(client.get("/authers/").status_code, 200)
+        self.assertEqual(self.state.snapshot()[0]["in_flight"], 0)
+
+    def test_limit_shrinks_while_slow_and_grows_back(self):
+        options = {
+            "MIN_CONCURRENCY": 1,
+            "MAX_CONCURRENCY": 4,
+            "TARGET_LATENCY": 0.1,
+            "ADJUST_INTERVAL": 0,
+            "BACKOFF": 0.5,
+            "SMOOTHING": 1.0,
+        }
+        limits_seen = []
+        for elapsed in (1.0, 1.0, 1.0, 0.0, 0.0, 0.0, 0.0):
+            self.assertTrue(self.state.acquire("route", 4))
+            self.state.release("route", elapsed, options)
+            limits_seen.append(self.state.snapshot()[0]["concurrency"])
+        self.assertEqual(limits_seen, [2.0, 1.0, 1.0, 2.0, 3.0, 4.0, 4.0])
+
+    def test_requests_are_rejected_once_contention_persists(self):
+        locked = sqlite3.OperationalError("database is locked")
+        with self.limits(FAIL_OPEN_PERIOD=60):
+            client = Client()
+            with (
+                mock.patch.object(limits.LimiterState, "take", side_effect=locked),
+                self.assertLogs("project.limits", "WARNING"),
+            ):
+                self.assertEqual(client.get("/authers/").status_code, 200)
+                self.state.failing_since -= 60
+                response = client.get("/authers/")
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response["Retry-After"], "1")
+            self.assertEqual(client.get("/authers/").status_code, 200)
+        self.assertIsNone(self.state.failing_since)
+
+    def test_batch_sub_requests_are_charged_separately(self):
+        token = AccessToken.for_user(User.objects.create_user("reader"))
+        client = APIClient(HTTP_AUTHORIZATION=f"Bearer {token}")
+        # The batch request itself takes one token, its sub-requests one each.
+        with self.limits(RATE={"CAPACITY": 3, "REFILL_RATE": 0.01}):
+            response = client.post(
+                "/batch/", [{"path": "/authers/"}] * 4, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        results = sorted(response.data, key=lambda result: result["status"])
+        self.assertEqual([result["status"] for result in results], [200, 200, 429, 429])
+        self.assertEqual(results[-1]["retry_after"], 100)
+
+
+class TitleLookupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.auther = Auther.objects.create(name="Author")
+        cls.book = Book.objects.create(title="The Hobbit", auther=cls.auther)
+
+    def setUp(self):
+        titles._map = None
+        self.addCleanup(setattr, titles, "_map", None)
+
+    def test_exact_title_written_by_another_process_wins_over_the_map(self):
+        self.assertEqual(titles.lookup("the hobbit"), self.book)
+        # Created elsewhere: this process's map is not told about it.
+        other = Book.objects.create(title="THE HOBBIT", auther=self.auther)
+        self.assertEqual(titles.get_map().ids["the hobbit"], (self.book.id,))
+
+        self.assertEqual(titles.lookup("THE HOBBIT"), other)
+        self.assertEqual(titles.lookup("The Hobbit"), self.book)
+        self.assertEqual(titles.lookup("the HOBBIT"), self.book)
+
+    def test_titles_growing_when_casefolded_fit(self):
+        book = Book.objects.create(
+            title="Straße " + "ß" * 93, auther=self.auther, description="d"
+        )
+        self.assertEqual(len(book.title_normalized), 194)
+        book.full_clean(validate_unique=False)
+        self.assertEqual(titles.lookup(book.title.upper()), book)
+
+
+class ColumnExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader", password="secret-pass")
+        cls.authers = [
+            Auther.objects.create(
+                name="Tolkien", nationality="British", birth_date=date(1892, 1, 3)
+            ),
+            Auther.objects.create(name="Ende"),
+        ]
+        cls.books = [
+            Book.objects.create(
+                title="The Hobbit",
+                auther=cls.authers[0],
+                category="FAN",
+                language="English",
+                pages=310,
+                published_date=date(1937, 9, 21),
+            ),
+            Book.objects.create(
+                title="Die unendliche Geschichte", auther=cls.authers[1]
+            ),
+            Book.objects.create(title="Momo — 🕰", auther=cls.authers[1]),
+        ]
+        hidden = Book.objects.create(title="Hidden", auther=cls.authers[1])
+        for book in [*cls.books, hidden]:
+            Favorite.objects.add(cls.user.id, book.id)
+        Book.objects.filter(id=hidden.id).update(deleted_at=timezone.now())
+
+    def export(self, *options):
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        call_command(
+            "export_columns",
+            "--output",
+            str(directory / "export"),
+            "--chunk-size",
+            "2",
+            *options,
+            stdout=io.StringIO(),
+        )
+        return directory / "export"
+
+    def check_round_trip(self, directory):
+        books, manifest = export.load(directory, "books")
+        entry = manifest["tables"]["books"]
+        self.assertEqual(entry["rows"], 3)
+        self.assertEqual(books["id"].tolist(), [book.id for book in self.books])
+        self.assertEqual(
+            [books["title"][i] for i in range(len(books["title"]))],
+            [book.title for book in self.books],
+        )
+        categories = entry["columns"]["category"]["dictionary"]
+        self.assertEqual(
+            [categories[code] for code in books["category"]],
+            [book.category for book in self.books],
+        )
+        self.assertEqual(books["language"].tolist(), [0, -1, -1])
+        self.assertEqual(books["pages"].tolist(), [310, -1, -1])
+        self.assertEqual(str(books["published_date"][0]), "1937-09-21")
+        self.assertTrue(np.isnat(books["published_date"][1]))
+
+        authers, _ = export.load(directory, "authers")
+        self.assertEqual([authers["name"][i] for i in range(2)], ["Tolkien", "Ende"])
+        self.assertEqual(str(authers["birth_date"][0]), "1892-01-03")
+
+        favorites, _ = export.load(directory, "favorites")
+        self.assertEqual(favorites["user_id"].tolist(), [self.user.id] * 3)
+        self.assertEqual(
+            sorted(favorites["book_id"].tolist()), [book.id for book in self.books]
+        )
+        return books, manifest
+
+    def test_uncompressed_export_is_memory_mapped(self):
+        books, manifest = self.check_round_trip(self.export())
+        self.assertFalse(manifest["compressed"])
+        self.assertIsInstance(books["id"], np.memmap)
+
+    def test_compressed_export_round_trips(self):
+        directory = self.export("--compress")
+        self.assertEqual(
+            sorted(path.name for path in directory.iterdir()),
+            ["authers.npz", "books.npz", "favorites.npz", "manifest.json"],
+        )
+        _, manifest = self.check_round_trip(directory)
+        self.assertTrue(manifest["compressed"])
@@ -0,0 +1,137 @@
+import threading
+
+from .models import Book, normalize_title
+
+
+class TitleMap:
+    """
+    In-process map of normalized title to the ids of the books with that title.
+
+    Titles are unique, but only case-sensitively, so a normalized title
+    usually maps to one id and occasionally to several. Signals apply this
+    process's writes; writes from other processes are caught when a looked up
+    book turns out to be missing or renamed.
+    """
+
+    def __init__(self, pairs):
+        self.ids = {}
+        self.titles = {}
+        for title, book_id in pairs:
+            self.add(book_id, title)
+
+    @classmethod
+    def from_db(cls):
+        rows = Book.objects.order_by("id").values_list("title_normalized", "id")
+        return cls(rows.iterator(chunk_size=10000))
+
+    def add(self, book_id, title):
+        self.ids[title] = tuple(sorted({*self.ids.get(title, ()), book_id}))
+        self.titles[book_id] = title
+
+    def remove(self, book_id):
+        title = self.titles.pop(book_id, None)
+        if title is None:
+            return
+        ids = tuple(other for other in self.ids.get(title, ()) if other != book_id)
+        if ids:
+            self.ids[title] = ids
+        else:
+            self.ids.pop(title, None)
+
+    def set(self, title, ids):
+        """
+        Replace the ids of `title` with those found in the database.
+        """
+
+        for book_id in self.ids.get(title, ()):
+            self.titles.pop(book_id, None)
+        self.ids.pop(title, None)
+        for book_id in ids:
+            self.remove(book_id)
+            self.add(book_id, title)
+
+
+_map = None
+
+# Guards updates of the map; lookups read it without locking.
+lock = threading.RLock()
+
+
+def get_map():
+    """
+    Return this process's title map, loading it from the catalog on first use.
+    """
+
+    global _map
+    if _map is None:
+        with lock:
+            if _map is None:
+                _map = TitleMap.from_db()
+    return _map
+
+
+def pick(books, title):
+    """
+    Return the book whose title is exactly `title`, or else the oldest one.
+    """
+
+    for book in books:
+        if book.title == title:
+            return book
+    return min(books, key=lambda book: book.id, default=None)
+
+
+def lookup(title, queryset=None):
+    """
+    Return the live book titled `title`, ignoring case, or None.
+
+    The ids come from the in-memory map and the rows from a primary key
+    query. Unless one of them has exactly `title`, which no other book can
+    have, the indexed `title_normalized` column is queried instead, so books
+    written by other processes are found, and the map corrected.
+
+    Args:
+        title (str): The title to find.
+        queryset (QuerySet | None): The books to load the result from, e.g.
+            with `select_related()`; defaults to `Book.objects`.
+    """
+
+    queryset = Book.objects.all() if queryset is None else queryset
+    normalized = normalize_title(title)
+    ids = get_map().ids.get(normalized)
+    if ids:
+        books = [
+            book
+            for book in queryset.filter(id__in=ids)
+            if book.title_normalized == normalized
+        ]
+        exact = [book for book in books if book.title == title]
+        if exact and len(books) == len(ids):
+            return exact[0]
+
+    books = list(queryset.filter(title_normalized=normalized).order_by("id"))
+    with lock:
+        get_map().set(normalized, [book.id for book in books])
+    return pick(books, title)
+
+
+def book_saved(book):
+    """
+    Apply a saved book to the map, if one is loaded.
+    """
+
+    with lock:
+        if _map is not None:
+            _map.remove(book.id)
+            if book.deleted_at is None:
+                _map.add(book.id, normalize_title(book.title))
+
+
+def book_deleted(book_id):
+    """
+    Remove a deleted book from the map, if one is loaded.
+    """
+
+    with lock:
+        if _map is not None:
+            _map.remove(book_id)
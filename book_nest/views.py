@@ -1,6 +1,14 @@
+from django.conf import settings
+from django.db import transaction
 from rest_framework import viewsets
 from .models import *
 from .serializers import *
+from .filters import CachedSearchFilter
+from .mixins import SparseFieldsetMixin
+from . import recommendations as recommenders
+from . import titles as title_lookup
+from . import cache, deletion, neighbours, similarity, snapshot
+from project.singleflight import single_flight
 from rest_framework.filters import SearchFilter
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
@@ -9,18 +17,36 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing, creating, updating, and deleting books.
 
     This viewset provides standard CRUD operations for books. It requires that the user be a superuser
     for creating, updating, or deleting books. Users can search for books by title, author name, description, or category.
+    Read requests accept `?fields=` and `?omit=` to return only some of the book fields.
     """
 
     queryset = Book.objects.all()
     serializer_class = BookSerializer
-    filter_backends = [SearchFilter]
+    filter_backends = [CachedSearchFilter]
     search_fields = ["title", "auther__name", "description", "category"]
+    # The most books one create or bulk_update request may write.
+    bulk_max_items = 10000
+
+    def list(self, request, *args, **kwargs):
+        """
+        List books, caching each distinct query for CATALOG_CACHE["BOOK_LIST_TIMEOUT"] seconds.
+
+        Concurrent requests for an expired page are coalesced, so only one of
+        them queries the database.
+        """
+
+        data = single_flight.get(
+            cache.book_list_key(request.query_params),
+            lambda: super(BookViewSet, self).list(request, *args, **kwargs).data,
+            cache.catalog_cache_settings()["BOOK_LIST_TIMEOUT"],
+        )
+        return Response(data)
 
     def create(self, request, *args, **kwargs):
         """
@@ -38,8 +64,67 @@ class BookViewSet(viewsets.ModelViewSet):
 
         if not request.user.is_superuser:
             raise PermissionDenied("You do not have permission to perform this action.")
+        if isinstance(request.data, list):
+            return self.bulk_write(request.data)
         return super().create(request, *args, **kwargs)
 
+    @action(detail=False, methods=["patch"])
+    def bulk_update(self, request):
+        """
+        PATCH action to update many books at once.
+
+        The body is a list of partial books, each with the `id` of the book it
+        changes, e.g. `[{"id": 1, "pages": 320}, {"id": 2, "category": "HOR"}]`.
+
+        Returns:
+            - The updated books, in the order of the request.
+            - A list of per-item errors, empty for valid items, if any item is invalid; nothing is saved then.
+        """
+
+        if not request.user.is_superuser:
+            raise PermissionDenied("You do not have permission to perform this action.")
+        if not isinstance(request.data, list):
+            return Response({"error": "Expected a list of books"}, status=400)
+
+        ids = set()
+        for item in request.data:
+            try:
+                ids.add(int(item.get("id")))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        books = Book.objects.select_related("auther").in_bulk(ids)
+        return self.bulk_write(request.data, books)
+
+    def bulk_write(self, data, books=None):
+        """
+        Create, or update if `books` is given, the books of a list payload in one transaction.
+
+        BookListSerializer validates the whole list with a fixed number of
+        queries, so a request of thousands of books runs a handful of them.
+
+        Args:
+            data (list): The books from the request body.
+            books (dict | None): The books to update, by id.
+
+        Returns:
+            Response: The written books, or the per-item errors with status 400.
+        """
+
+        serializer = self.get_serializer(
+            books,
+            data=data,
+            many=True,
+            partial=books is not None,
+            max_length=self.bulk_max_items,
+        )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            serializer.save()
+        return Response(
+            serializer.data,
+            status=status.HTTP_201_CREATED if books is None else status.HTTP_200_OK,
+        )
+
     def update(self, request, *args, **kwargs):
         """
         Update an existing book instance.
@@ -69,20 +154,141 @@ class BookViewSet(viewsets.ModelViewSet):
             request (Request): The HTTP request object for deleting the book.
 
         Returns:
-            Response: The response object with status 204 No Content upon successful deletion.
+            Response: Status 202 Accepted with the ID of the Deletion tracking the purge.
+            The book is hidden at once; its favorites are removed in the background.
         """
 
         if not request.user.is_superuser:
             raise PermissionDenied("You do not have permission to perform this action.")
-        return super().destroy(request, *args, **kwargs)
+        record = deletion.soft_delete(self.get_object())
+        return Response(
+            {"message": "Book deleted", "deletion": record.id},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"by-title/(?P<title>.+)",
+        url_name="by-title",
+    )
+    def by_title(self, request, title=None):
+        """
+        GET action to retrieve a book by its title, ignoring case.
+
+        The book id is found in an in-memory title map, falling back to the
+        indexed `title_normalized` column. If titles differ only by case, the
+        exact match wins, then the oldest book. Accepts `?fields=` and `?omit=`.
+
+        Returns:
+            - The book.
+            - An error message if no book has this title.
+        """
+
+        book = title_lookup.lookup(title, Book.objects.select_related("auther"))
+        if book is None:
+            return Response({"error": "Book not found"}, status=404)
+        return Response(self.get_serializer(book).data)
+
+    @action(detail=True, methods=["get"])
+    def similar(self, request, pk=None):
+        """
+        GET action to retrieve the books most similar to this one.
+
+        Similarity is the cosine similarity of the books' title/description
+        vectors. The precomputed neighbour table is used when it covers the
+        book; otherwise the approximate nearest-neighbour index is searched.
+
+        Query Parameters:
+            - limit (int): The number of similar books to return, 1-50. Defaults to 5.
+
+        Returns:
+            - A list of similar books with their IDs, titles and similarity scores.
+            - An error message if the book does not exist.
+        """
+
+        try:
+            book_id = int(pk)
+            limit = min(max(int(request.query_params.get("limit", 5)), 1), 50)
+        except ValueError:
+            return Response({"error": "Invalid book ID or limit"}, status=400)
+
+        precomputed = neighbours.similar_books(book_id, limit)
+        if precomputed is not None:
+            return Response({"similar": precomputed})
+
+        found = similarity.similar_books(book_id, limit)
+        if found is None:
+            return Response({"error": "Book not found"}, status=404)
+
+        ids, scores = found
+        titles = dict(
+            Book.objects.filter(id__in=ids.tolist()).values_list("id", "title")
+        )
+        return Response(
+            {
+                "similar": [
+                    {
+                        "id": neighbour_id,
+                        "title": titles[neighbour_id],
+                        "score": round(score, 4),
+                    }
+                    for neighbour_id, score in zip(ids.tolist(), scores.tolist())
+                    if neighbour_id in titles
+                ]
+            }
+        )
+
+    @action(detail=False, methods=["get"])
+    def facets(self, request):
+        """
+        GET action to count books per category and language.
+
+        The counts are computed with vectorized masks over the in-process
+        catalog snapshot rather than with database queries.
+
+        Query Parameters:
+            - category (str): Only count books in this category.
+            - auther (int): Only count books by this author.
+            - language (str): Only count books in this language.
+            - min_pages, max_pages (int): Page count bounds, inclusive.
+            - published_from, published_to (int): Publication year bounds, inclusive.
+
+        Returns:
+            - The total number of matching books and their counts per category and language.
+            - An error message if a numeric filter is not a number.
+        """
+
+        params = request.query_params
+        filters = {
+            "category": params.get("category"),
+            "language": params.get("language"),
+        }
+        numeric = {
+            "author": "auther",
+            "min_pages": "min_pages",
+            "max_pages": "max_pages",
+            "year_from": "published_from",
+            "year_to": "published_to",
+        }
+        try:
+            for name, param in numeric.items():
+                filters[name] = int(params[param]) if param in params else None
+        except ValueError:
+            return Response({"error": f"{param} must be an integer"}, status=400)
 
+        catalog = snapshot.get_snapshot()
+        with snapshot.lock:
+            return Response(catalog.facets(catalog.mask(**filters)))
 
-class AutherViewSet(viewsets.ModelViewSet):
+
+class AutherViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     A viewset for viewing, creating, updating, and deleting authors.
 
     This viewset provides standard CRUD operations for authors. It requires that the user be a superuser
     for creating, updating, or deleting authors. Users can search for authors by name or biography.
+    Read requests accept `?fields=` and `?omit=` to return only some of the author fields.
     """
 
     queryset = Auther.objects.all()
@@ -137,15 +343,21 @@ class AutherViewSet(viewsets.ModelViewSet):
             request (Request): The HTTP request object for deleting the author.
 
         Returns:
-            Response: The response object with status 204 No Content upon successful deletion.
+            Response: Status 202 Accepted with the ID of the Deletion tracking the purge.
+            The author and their books are hidden at once; the books and
+            their favorites are removed in the background.
         """
 
         if not request.user.is_superuser:
             raise PermissionDenied("You do not have permission to perform this action.")
-        return super().destroy(request, *args, **kwargs)
+        record = deletion.soft_delete(self.get_object())
+        return Response(
+            {"message": "Author deleted", "deletion": record.id},
+            status=status.HTTP_202_ACCEPTED,
+        )
 
 
-class FavoriteBookViewSet(viewsets.ModelViewSet):
+class FavoriteBookViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     """
     ViewSet to manage user's favorite books.
 
@@ -164,43 +376,45 @@ class FavoriteBookViewSet(viewsets.ModelViewSet):
         Overrides the default queryset to return only the favorite books for the authenticated user.
         """
 
-        return Favorite.objects.filter(user=self.request.user)
+        return Favorite.objects.filter(
+            user=self.request.user, book__deleted_at__isnull=True
+        )
 
     @action(detail=False, methods=["post"])
     def add_favorite(self, request):
         """
         POST action to add a book to the user's favorites list.
 
+        Adding a book that is already a favorite succeeds without creating a
+        duplicate, so the request can safely be retried.
+
         Parameters:
             - book_id (int): The ID of the book to be added to the favorites.
 
         Returns:
-            - A success message if the book is added successfully.
-            - An error message if the book does not exist.
+            - A success message if the book is added or already in the favorites.
+            - An error message if the book does not exist or the favorites list is full.
         """
-        book_id = request.data.get("book")
-        user = request.user
-
-        # Debugging output to verify book_id
-        print(f"book_id received: {book_id}")
 
+        if not isinstance(request.data, dict):
+            return Response({"error": "Expected an object with a book ID"}, status=400)
         try:
-            book = Book.objects.get(id=book_id)
-            user_id = User.objects.get(id=user.id)
-            # Check if the book is already in the user's favorites
-            if Favorite.objects.filter(user=user_id, book=book).exists():
-                return Response(
-                    {"message": "Book is already in your favorites."}, status=400
-                )
-
-            # Add the book to the favorites if it's not already there
-            Favorite.objects.create(user=user_id, book=book)
-            return Response({"message": "Book added to favorites"})
+            book_id = int(request.data.get("book"))
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid book ID format"}, status=400)
 
-        except Book.DoesNotExist:
+        result = Favorite.objects.add(request.user.id, book_id)
+
+        if result == Favorite.ADDED:
+            return Response({"message": "Book added to favorites"})
+        if result == Favorite.ALREADY_FAVORITE:
+            return Response({"message": "Book is already in your favorites."})
+        if result == Favorite.BOOK_NOT_FOUND:
             return Response({"error": "Book not found"}, status=404)
-        except ValueError:
-            return Response({"error": "Invalid book ID format"}, status=400)
+        return Response(
+            {"error": f"You can have at most {Favorite.MAX_PER_USER} favorite books."},
+            status=400,
+        )
 
     @action(detail=True, methods=["delete"])
     def remove_favorite(self, request, pk=None):
@@ -215,39 +429,55 @@ class FavoriteBookViewSet(viewsets.ModelViewSet):
             - An error message if the favorite book does not exist.
         """
 
-        user = request.user
         try:
-            favorite = Favorite.objects.get(user=user, book_id=pk)
-            favorite.delete()
+            book_id = int(pk)
+        except (TypeError, ValueError):
+            return Response({"error": "Invalid book ID format"}, status=400)
+
+        if Favorite.objects.remove(request.user.id, book_id):
             return Response({"message": "Book removed from favorites"})
-        except Favorite.DoesNotExist:
-            return Response({"error": "Favorite book not found"}, status=404)
+        return Response({"error": "Favorite book not found"}, status=404)
 
     @action(detail=False, methods=["get"])
     def recommendations(self, request):
         """
         GET action to retrieve book recommendations based on the user's favorite books.
 
-        Recommendations are based on the categories and authors of the books in the user's favorites list.
+        Recommendations are based on the books in the user's favorites list. The `ann` mode ranks
+        books by description similarity; the `category` mode matches the favorites' categories.
+
+        Query Parameters:
+            - mode (str): The recommendation backend. Defaults to RECOMMENDATIONS["BACKEND"].
 
         Returns:
             - A list of up to 5 recommended book titles.
             - An error message if no favorite books are found.
         """
 
+        mode = request.query_params.get("mode")
+        if mode is not None and mode not in recommenders.BACKENDS:
+            return Response(
+                {
+                    "error": f"Unknown mode, expected one of: {', '.join(recommenders.BACKENDS)}"
+                },
+                status=400,
+            )
+
         user = request.user
-        favorites = Favorite.objects.filter(user=user).values_list(
-            "book__id", "book__category", "book__auther"
+        favorites = list(
+            Favorite.objects.filter(
+                user=user, book__deleted_at__isnull=True
+            ).values_list("book__id", "book__category", "book__auther")
         )
 
-        if not favorites.exists():
+        if not favorites:
             return Response({"message": "No favorite books found."}, status=404)
 
-        categories = [fav[1] for fav in favorites]
-        authors = [fav[2] for fav in favorites]
-        favorite_ids = [fav[0] for fav in favorites]
-        recommended_books = Book.objects.filter(category__in=categories).exclude(
-            id__in=favorite_ids
-        )[:5]
-
-        return Response({"recommendations": [book.title for book in recommended_books]})
+        mode = mode or settings.RECOMMENDATIONS["BACKEND"]
+        limit = settings.RECOMMENDATIONS["LIMIT"]
+        recommendations = single_flight.get(
+            cache.recommendations_key(favorites, mode, limit),
+            lambda: recommenders.recommend(favorites, mode=mode, limit=limit),
+            cache.catalog_cache_settings()["RECOMMENDATIONS_TIMEOUT"],
+        )
+        return Response({"recommendations": recommendations})
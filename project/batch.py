@@ -0,0 +1,226 @@
+import contextvars
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from project.limits import client_key, get_limiter
+from project.metrics import count_queries, view_label
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH = {
+    "MAX_REQUESTS": 20,
+    "WORKERS": 4,
+}
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+METHODS = SAFE_METHODS + ("POST", "PUT", "PATCH", "DELETE")
+
+# META entries describing the outer request's body and target, rebuilt for each sub-request.
+REQUEST_META = (
+    "wsgi.input",
+    "CONTENT_TYPE",
+    "CONTENT_LENGTH",
+    "PATH_INFO",
+    "SCRIPT_NAME",
+    "QUERY_STRING",
+    "REQUEST_METHOD",
+    "HTTP_ACCEPT",
+    "HTTP_ACCEPT_ENCODING",
+)
+
+
+def batch_settings():
+    """
+    Return settings.BATCH merged over the defaults.
+    """
+
+    return {**DEFAULT_BATCH, **getattr(settings, "BATCH", {})}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the worker pool shared by every batch request.
+
+    Each worker holds at most one database connection, so BATCH["WORKERS"]
+    bounds the connections batches use, however many run at once.
+    """
+
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=batch_settings()["WORKERS"],
+                    thread_name_prefix="batch",
+                )
+    return _pool
+
+
+def error(code, message):
+    return {"status": code, "body": {"error": message}}
+
+
+class BatchAPIView(APIView):
+    """
+    Run several API requests in one round trip.
+
+    The body is a list of sub-requests, e.g.
+    `[{"method": "GET", "path": "/books/"}, {"method": "POST", "path": "/favorites/add_favorite/", "body": {"book": 1}}]`;
+    `method` defaults to GET. Each one is dispatched in-process to the view
+    its path resolves to, authenticated as the caller, and the response is a
+    list of `{"status": ..., "body": ...}` in the same order.
+
+    Consecutive GET, HEAD and OPTIONS sub-requests run concurrently; any
+    other method waits for the previous sub-requests and runs alone, so
+    later reads see its effects. Sub-requests skip the middleware, but each
+    one is charged to the caller's rate limit and takes a concurrency slot
+    of its route like a request of its own (see project.limits); one that is
+    shed gets its 429 or 503 status and a `retry_after` in seconds.
+    """
+
+    def post(self, request):
+        items = request.data
+        options = batch_settings()
+        if not isinstance(items, list):
+            return Response(
+                {"error": "Expected a list of sub-requests"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > options["MAX_REQUESTS"]:
+            return Response(
+                {"error": f"At most {options['MAX_REQUESTS']} sub-requests per batch"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Authenticated once, here, rather than concurrently by the workers.
+        caller = (request.user, request.auth, request.META)
+        self.limiter = get_limiter()
+        self.client = client_key(request)
+        results = [None] * len(items)
+        pending = []
+
+        def wait():
+            for index, future in pending:
+                results[index] = future.result()
+            pending.clear()
+
+        for index, item in enumerate(items):
+            method = (
+                str(item.get("method", "GET")).upper() if isinstance(item, dict) else ""
+            )
+            if method in SAFE_METHODS:
+                # Run in a copy of this context, so the sub-request keeps the
+                # replica pin of earlier writes and counts towards its metrics.
+                context = contextvars.copy_context()
+                future = get_pool().submit(context.run, self.run, caller, item)
+                pending.append((index, future))
+            else:
+                wait()
+                results[index] = self.dispatch_item(caller, item)
+        wait()
+        return Response(results)
+
+    def run(self, caller, item):
+        """
+        Dispatch a sub-request on a pool thread, managing its database connection like a request.
+        """
+
+        close_old_connections()
+        try:
+            with count_queries():
+                return self.dispatch_item(caller, item)
+        finally:
+            close_old_connections()
+
+    def dispatch_item(self, caller, item):
+        """
+        Dispatch one sub-request to its view.
+
+        Args:
+            caller (tuple): The `(user, auth, META)` of the batch request.
+            item (dict): The sub-request.
+
+        Returns:
+            dict: The `status` and `body` of the response, and its `retry_after` if it has one.
+        """
+
+        if not isinstance(item, dict) or not isinstance(item.get("path"), str):
+            return error(400, "Each sub-request needs a path")
+        method = str(item.get("method", "GET")).upper()
+        if method not in METHODS:
+            return error(405, f"Method {method} is not allowed")
+
+        url = urlsplit(item["path"])
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            return error(404, "Not found")
+        view_class = getattr(match.func, "cls", None)
+        if view_class is None or issubclass(view_class, BatchAPIView):
+            return error(400, f"{url.path} cannot be called in a batch")
+
+        body = b""
+        if item.get("body") is not None:
+            body = json.dumps(item["body"]).encode()
+        environ = {
+            key: value for key, value in caller[2].items() if key not in REQUEST_META
+        }
+        environ.update(
+            {
+                "wsgi.input": io.BytesIO(body),
+                "CONTENT_TYPE": "application/json",
+                "CONTENT_LENGTH": str(len(body)),
+                "PATH_INFO": url.path,
+                "QUERY_STRING": url.query,
+                "REQUEST_METHOD": method,
+                "HTTP_ACCEPT": "application/json",
+            }
+        )
+        sub_request = WSGIRequest(environ)
+        # Reuse the caller's authentication instead of authenticating again.
+        sub_request._force_auth_user, sub_request._force_auth_token = caller[:2]
+        sub_request.resolver_match = match
+
+        response = slot = None
+        if self.limiter is not None:
+            response, slot = self.limiter.admit(view_label(sub_request), self.client)
+        try:
+            if response is None:
+                response = match.func(sub_request, *match.args, **match.kwargs)
+        except Exception:
+            logger.exception("Batch sub-request %s %s failed", method, item["path"])
+            return error(500, "Internal server error")
+        finally:
+            if slot is not None:
+                self.limiter.release(slot)
+
+        if isinstance(response, Response):
+            data = response.data
+        elif response.content:
+            try:
+                data = json.loads(response.content)
+            except ValueError:
+                data = response.content.decode(response.charset, "replace")
+        else:
+            data = None
+        result = {"status": response.status_code, "body": data}
+        if response.has_header("Retry-After"):
+            result["retry_after"] = int(response["Retry-After"])
+        return result
@@ -0,0 +1,114 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+# Pragmas that may be set from settings.SQLITE_PRAGMAS, in the order they are applied.
+SUPPORTED_PRAGMAS = (
+    "journal_mode",
+    "synchronous",
+    "busy_timeout",
+    "cache_size",
+    "mmap_size",
+)
+
+
+def pragma_statements(pragmas):
+    """
+    Build the PRAGMA statements for a mapping of pragma names to values.
+
+    Args:
+        pragmas (dict): Pragma name mapped to its value, e.g. {"journal_mode": "WAL"}.
+
+    Returns:
+        list: The SQL statements, in the order of SUPPORTED_PRAGMAS.
+
+    Raises:
+        ValueError: If a pragma is not supported or its value is not a plain word or integer.
+    """
+
+    unknown = set(pragmas) - set(SUPPORTED_PRAGMAS)
+    if unknown:
+        raise ValueError(f"Unsupported SQLite pragma(s): {', '.join(sorted(unknown))}")
+
+    statements = []
+    for name in SUPPORTED_PRAGMAS:
+        if name not in pragmas:
+            continue
+        value = str(pragmas[name])
+        if not value.lstrip("-").isalnum():
+            raise ValueError(f"Invalid value for SQLite pragma {name}: {value!r}")
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Apply settings.SQLITE_PRAGMAS to every new SQLite connection.
+
+    Connected to the `connection_created` signal in `BookNestConfig.ready`.
+    """
+
+    if connection.vendor != "sqlite":
+        return
+
+    pragmas = getattr(settings, "SQLITE_PRAGMAS", {})
+    if not pragmas:
+        return
+
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(pragmas):
+            cursor.execute(statement)
+
+
+# Set once the current request (or thread, outside requests) has written to the primary.
+pinned_to_primary = ContextVar("pinned_to_primary", default=False)
+
+
+class PrimaryReplicaRouter:
+    """
+    Send catalog reads to a replica and everything else to the primary.
+
+    Reads of the models listed in settings.REPLICATED_MODELS go to a random
+    alias from settings.DATABASE_REPLICAS. Once anything is written, later
+    reads in the same request are pinned to the primary so the request sees
+    its own writes. Migrations only run on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if (
+            not replicas
+            or pinned_to_primary.get()
+            or model._meta.label_lower not in settings.REPLICATED_MODELS
+        ):
+            return "default"
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pinned_to_primary.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold copies of the primary, so objects from any alias can be related.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+class ReplicaPinningMiddleware:
+    """
+    Start every request unpinned so replica reads are only skipped after a write.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = pinned_to_primary.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            pinned_to_primary.reset(token)
@@ -0,0 +1,464 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from project.metrics import process_alive, view_label
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    "ENABLED": True,
+    # Per view label (see project.metrics.view_label): MAX_CONCURRENCY,
+    # MIN_CONCURRENCY, TARGET_LATENCY (seconds) and COST (tokens per request).
+    "ROUTES": {},
+    # Token bucket of each client; None disables rate limiting.
+    "RATE": {"CAPACITY": 100, "REFILL_RATE": 5.0},
+    "TARGET_LATENCY": 0.5,
+    "ADJUST_INTERVAL": 1.0,
+    "BACKOFF": 0.9,
+    "SMOOTHING": 0.2,
+    "RETRY_AFTER": 1,
+    "LOCK_TIMEOUT": 0.05,
+    "FAIL_OPEN_PERIOD": 2.0,
+    "PRUNE_INTERVAL": 60,
+    "EXEMPT_PATHS": ["/metrics", "/admin/"],
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS routes (
+    route TEXT PRIMARY KEY,
+    concurrency REAL NOT NULL,
+    latency REAL,
+    adjusted_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slots (
+    route TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    in_flight INTEGER NOT NULL,
+    PRIMARY KEY (route, pid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS buckets (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def limits_settings():
+    """
+    Return settings.LIMITS merged over the defaults.
+    """
+
+    options = {**DEFAULT_LIMITS, **getattr(settings, "LIMITS", {})}
+    options.setdefault("STATE", Path(settings.BASE_DIR) / "limits.sqlite3")
+    return options
+
+
+class LimiterState:
+    """
+    Concurrency slots and token buckets in a SQLite file shared by every process.
+
+    Each process counts its own in-flight requests per route, so the slots
+    of a process that died are discarded rather than leaked. The state is
+    disposable: it is written without fsync and can be deleted at any time.
+    """
+
+    def __init__(self, path, lock_timeout):
+        self.path = str(path)
+        self.lock_timeout = lock_timeout
+        self._local = threading.local()
+        self._created = False
+        self._create_lock = threading.Lock()
+        # When the state last became unavailable, or None while it works.
+        self.failing_since = None
+        self.pruned_at = time.monotonic()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path,
+                timeout=self.lock_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            with self._create_lock:
+                if not self._created:
+                    connection.executescript(SCHEMA)
+                    # A previous process may have had our pid.
+                    connection.execute(
+                        "DELETE FROM slots WHERE pid = ?", (os.getpid(),)
+                    )
+                    self._created = True
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def take(self, client, cost, capacity, refill_rate):
+        """
+        Take `cost` tokens from the bucket of `client`.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds until they are available.
+        """
+
+        now = time.time()
+        params = {
+            "client": client,
+            "cost": min(cost, capacity),
+            "capacity": capacity,
+            "rate": refill_rate,
+            "now": now,
+        }
+        refilled = "MIN(:capacity, tokens + (:now - updated_at) * :rate)"
+        cursor = self.connection.execute(
+            "INSERT INTO buckets (client, tokens, updated_at) "
+            "VALUES (:client, :capacity - :cost, :now) "
+            f"ON CONFLICT (client) DO UPDATE SET tokens = {refilled} - :cost, "
+            f"updated_at = :now WHERE {refilled} >= :cost",
+            params,
+        )
+        if cursor.rowcount == 1:
+            return 0.0
+        row = self.connection.execute(
+            f"SELECT {refilled} FROM buckets WHERE client = :client", params
+        ).fetchone()
+        return (params["cost"] - row[0]) / refill_rate if row else 0.0
+
+    def prune_buckets(self, capacity, refill_rate):
+        """
+        Drop the buckets that have refilled completely; a missing bucket is a full one.
+        """
+
+        self.connection.execute(
+            "DELETE FROM buckets WHERE updated_at < ?",
+            (time.time() - capacity / refill_rate,),
+        )
+
+    def in_flight(self, connection, route):
+        return connection.execute(
+            "SELECT COALESCE(SUM(in_flight), 0) FROM slots WHERE route = ?", (route,)
+        ).fetchone()[0]
+
+    def acquire(self, route, maximum):
+        """
+        Take a concurrency slot of `route` if fewer requests than its current limit are running.
+
+        Returns:
+            bool: Whether the slot was taken.
+        """
+
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT concurrency FROM routes WHERE route = ?", (route,)
+            ).fetchone()
+            if row is None:
+                connection.execute(
+                    "INSERT INTO routes (route, concurrency, adjusted_at) "
+                    "VALUES (?, ?, ?)",
+                    (route, maximum, time.time()),
+                )
+                limit = maximum
+            else:
+                limit = max(1, min(maximum, int(row[0])))
+
+            if self.in_flight(connection, route) >= limit:
+                pids = connection.execute(
+                    "SELECT pid FROM slots WHERE route = ? AND in_flight > 0", (route,)
+                ).fetchall()
+                dead = [pid for (pid,) in pids if not process_alive(pid)]
+                if not dead:
+                    return False
+                connection.executemany(
+                    "DELETE FROM slots WHERE pid = ?", [(pid,) for pid in dead]
+                )
+                if self.in_flight(connection, route) >= limit:
+                    return False
+
+            connection.execute(
+                "INSERT INTO slots (route, pid, in_flight) VALUES (?, ?, 1) "
+                "ON CONFLICT (route, pid) DO UPDATE SET in_flight = in_flight + 1",
+                (route, os.getpid()),
+            )
+        return True
+
+    def release(self, route, elapsed, options):
+        """
+        Give back a slot of `route` and adapt its limit to the latency just observed.
+
+        The limit follows an AIMD rule at most once per ADJUST_INTERVAL: it is
+        multiplied by BACKOFF while the smoothed latency exceeds the route's
+        target, and grows by one slot otherwise, within
+        [MIN_CONCURRENCY, MAX_CONCURRENCY].
+        """
+
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE slots SET in_flight = MAX(in_flight - 1, 0) "
+                "WHERE route = ? AND pid = ?",
+                (route, os.getpid()),
+            )
+            row = connection.execute(
+                "SELECT concurrency, latency, adjusted_at FROM routes WHERE route = ?",
+                (route,),
+            ).fetchone()
+            if row is None:
+                return
+            concurrency, latency, adjusted_at = row
+            if latency is None:
+                latency = elapsed
+            else:
+                latency += options["SMOOTHING"] * (elapsed - latency)
+            if now - adjusted_at >= options["ADJUST_INTERVAL"]:
+                if latency > options["TARGET_LATENCY"]:
+                    concurrency *= options["BACKOFF"]
+                else:
+                    concurrency += 1
+                concurrency = max(
+                    options["MIN_CONCURRENCY"],
+                    min(options["MAX_CONCURRENCY"], concurrency),
+                )
+                adjusted_at = now
+            connection.execute(
+                "UPDATE routes SET concurrency = ?, latency = ?, adjusted_at = ? "
+                "WHERE route = ?",
+                (concurrency, latency, adjusted_at, route),
+            )
+
+    def snapshot(self):
+        """
+        Return the current limit, smoothed latency and in-flight count of every route.
+        """
+
+        connection = self.connection
+        return [
+            {
+                "route": route,
+                "concurrency": concurrency,
+                "latency": latency,
+                "in_flight": self.in_flight(connection, route),
+            }
+            for route, concurrency, latency in connection.execute(
+                "SELECT route, concurrency, latency FROM routes ORDER BY route"
+            )
+        ]
+
+
+_states = {}
+_states_lock = threading.Lock()
+
+
+def get_state(path, lock_timeout):
+    """
+    Return the LimiterState of `path` shared by everything in this process.
+
+    A single instance per process matters: it discards the slots left under
+    this pid by a previous process when it first connects.
+    """
+
+    with _states_lock:
+        state = _states.get(str(path))
+        if state is None:
+            state = _states[str(path)] = LimiterState(path, lock_timeout)
+        return state
+
+
+def client_key(request):
+    """
+    Return the identity a request is rate limited under.
+
+    Session users and valid JWT access tokens identify a user. Anything else,
+    including basic auth (whose password check is too costly to run here),
+    falls back to the client address.
+    """
+
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    scheme, _, token = request.META.get("HTTP_AUTHORIZATION", "").partition(" ")
+    if scheme in jwt_settings.AUTH_HEADER_TYPES and token:
+        try:
+            return f"user:{AccessToken(token)[jwt_settings.USER_ID_CLAIM]}"
+        except (TokenError, KeyError):
+            pass
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def shed(status, message, retry_after):
+    response = JsonResponse({"error": message}, status=status)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+class Limiter:
+    """
+    The token buckets and concurrency limits of `LIMITS`, checked one request at a time.
+
+    Used by LoadSheddingMiddleware, and by the batch view for each of its
+    sub-requests. If the state cannot be locked within LOCK_TIMEOUT seconds
+    the request is let through, unless the state has been unavailable for
+    FAIL_OPEN_PERIOD seconds; requests then get 503 until it recovers.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.routes = {
+            label: {
+                "MIN_CONCURRENCY": 1,
+                "TARGET_LATENCY": options["TARGET_LATENCY"],
+                "COST": 1,
+                **{
+                    name: options[name]
+                    for name in ("ADJUST_INTERVAL", "BACKOFF", "SMOOTHING")
+                },
+                **route,
+            }
+            for label, route in options["ROUTES"].items()
+        }
+        self.state = get_state(options["STATE"], options["LOCK_TIMEOUT"])
+
+    def admit(self, label, client):
+        """
+        Charge a request of the route `label` to `client` and take its concurrency slot.
+
+        Returns:
+            tuple: The 429 or 503 response to send instead, or None; and the
+            slot to pass to `release` once the request is done, or None.
+        """
+
+        state = self.state
+        try:
+            response, slot = self.check(label, client)
+        except sqlite3.Error as error:
+            now = time.monotonic()
+            if state.failing_since is None:
+                state.failing_since = now
+            if now - state.failing_since < self.options["FAIL_OPEN_PERIOD"]:
+                logger.warning(
+                    "Load shedding state unavailable, letting %s through: %s",
+                    label,
+                    error,
+                )
+                return None, None
+            logger.warning(
+                "Load shedding state unavailable, rejecting %s: %s", label, error
+            )
+            return self.busy(), None
+        state.failing_since = None
+        return response, slot
+
+    def check(self, label, client):
+        route = self.routes.get(label)
+        rate = self.options["RATE"]
+        if rate:
+            wait = self.state.take(
+                client,
+                route["COST"] if route else 1,
+                rate["CAPACITY"],
+                rate["REFILL_RATE"],
+            )
+            if wait:
+                return shed(429, "Too many requests", wait), None
+            self.maybe_prune(rate)
+        if route and route.get("MAX_CONCURRENCY"):
+            if not self.state.acquire(label, route["MAX_CONCURRENCY"]):
+                return self.busy(), None
+            return None, (label, time.perf_counter())
+        return None, None
+
+    def busy(self):
+        return shed(503, "Server busy, try again later", self.options["RETRY_AFTER"])
+
+    def release(self, slot):
+        route, start = slot
+        try:
+            self.state.release(route, time.perf_counter() - start, self.routes[route])
+        except sqlite3.Error as error:
+            logger.warning("Could not release a slot of %s: %s", route, error)
+
+    def maybe_prune(self, rate):
+        if time.monotonic() - self.state.pruned_at >= self.options["PRUNE_INTERVAL"]:
+            self.state.pruned_at = time.monotonic()
+            self.state.prune_buckets(rate["CAPACITY"], rate["REFILL_RATE"])
+
+
+def get_limiter():
+    """
+    Return a Limiter for the current settings, or None if limits are disabled.
+    """
+
+    options = limits_settings()
+    return Limiter(options) if options["ENABLED"] else None
+
+
+class LoadSheddingMiddleware:
+    """
+    Reject excess requests at once instead of letting them queue for a worker.
+
+    Every client has a token bucket of `LIMITS["RATE"]["CAPACITY"]` tokens,
+    refilled at REFILL_RATE per second; a request costs its route's COST
+    (1 by default), and a client out of tokens gets 429. Routes listed in
+    `LIMITS["ROUTES"]` with a MAX_CONCURRENCY also have a concurrency limit
+    shared by every worker, which shrinks while the route is slower than its
+    TARGET_LATENCY and grows back once it recovers; requests over the limit
+    get 503. Both responses carry Retry-After.
+
+    The state lives in the SQLite file `LIMITS["STATE"]`; see Limiter for
+    what happens when it is unavailable.
+
+    Settings:
+        LIMITS (dict): ENABLED, ROUTES, RATE, TARGET_LATENCY, ADJUST_INTERVAL,
+            BACKOFF, SMOOTHING, RETRY_AFTER, LOCK_TIMEOUT, FAIL_OPEN_PERIOD,
+            PRUNE_INTERVAL, EXEMPT_PATHS and STATE.
+    """
+
+    def __init__(self, get_response):
+        self.limiter = get_limiter()
+        if self.limiter is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.exempt_paths = tuple(self.limiter.options["EXEMPT_PATHS"])
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            slot = getattr(request, "_load_shedding_slot", None)
+            if slot is not None:
+                self.limiter.release(slot)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.path_info.startswith(self.exempt_paths):
+            return None
+        response, request._load_shedding_slot = self.limiter.admit(
+            view_label(request), client_key(request)
+        )
+        return response
@@ -0,0 +1,534 @@
+import atexit
+import hmac
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from project.singleflight import single_flight
+from project.tasks import runner
+
+# File locks are only available on POSIX systems.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+DEFAULT_METRICS = {
+    "ENABLED": True,
+    "FLUSH_INTERVAL": 5,
+    "LATENCY_BUCKETS": (
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+    ),
+    "QUERY_BUCKETS": (0, 1, 2, 5, 10, 20, 50, 100),
+    "ALLOWED_IPS": ("127.0.0.1", "::1"),
+    "TOKEN": "",
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_settings():
+    """
+    Return settings.METRICS merged over the defaults.
+    """
+
+    options = {**DEFAULT_METRICS, **getattr(settings, "METRICS", {})}
+    options.setdefault("DIRECTORY", Path(settings.BASE_DIR) / "metrics")
+    return options
+
+
+def view_label(request):
+    """
+    Return the view and action that handled a request, e.g. "BookViewSet.list".
+
+    Requests that matched no URL are labelled "unmatched"; non-DRF views use
+    their URL name.
+    """
+
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    view_class = getattr(match.func, "cls", None)
+    if view_class is None:
+        return match.view_name
+    method = request.method.lower()
+    actions = getattr(match.func, "actions", None)
+    action = actions.get(method, method) if actions else method
+    return f"{view_class.__name__}.{action}"
+
+
+class Recorder:
+    """
+    The metrics of one thread; only that thread writes to it, so no lock is needed.
+    """
+
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.latency = {}
+        self.queries = {}
+        self.started = 0
+        self.finished = 0
+
+    @staticmethod
+    def observe(histograms, key, buckets, value):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+        histogram[0][bisect_left(buckets, value)] += 1
+        histogram[1] += value
+
+    def merge_into(self, totals):
+        for key, count in list(self.requests.items()):
+            totals.requests[key] += count
+        for name in ("latency", "queries"):
+            merged = getattr(totals, name)
+            for key, (counts, total) in list(getattr(self, name).items()):
+                if key in merged:
+                    merged[key][0] = [a + b for a, b in zip(merged[key][0], counts)]
+                    merged[key][1] += total
+                else:
+                    merged[key] = [list(counts), total]
+        totals.started += self.started
+        totals.finished += self.finished
+
+
+class Registry:
+    """
+    The request metrics of this process, collected per thread and flushed to a shared directory.
+
+    Each thread records into its own Recorder, so the request path takes no
+    lock. Once `start` is called, at most every FLUSH_INTERVAL seconds (and
+    at exit) the recorders are summed and written to
+    `<DIRECTORY>/metrics.<pid>.json`; the /metrics endpoint adds up the files
+    of every process, so all the workers of a server report together.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._recorders = []
+        self._retired = Recorder()
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self.started = False
+
+    def start(self):
+        """
+        Flush periodically and at exit. Called by project.wsgi and project.asgi,
+        so management commands and tests leave no files behind.
+        """
+
+        if not self.started:
+            self.started = True
+            atexit.register(self.flush)
+
+    def recorder(self):
+        recorder = getattr(self._local, "recorder", None)
+        if recorder is None:
+            recorder = self._local.recorder = Recorder()
+            with self._lock:
+                self._recorders.append((threading.current_thread(), recorder))
+        return recorder
+
+    def snapshot(self):
+        """
+        Sum the recorders of every thread, folding those of finished threads into one.
+        """
+
+        with self._lock:
+            alive = []
+            for thread, recorder in self._recorders:
+                if thread.is_alive():
+                    alive.append((thread, recorder))
+                else:
+                    recorder.merge_into(self._retired)
+            self._recorders = alive
+            totals = Recorder()
+            self._retired.merge_into(totals)
+            for _, recorder in alive:
+                recorder.merge_into(totals)
+        return totals
+
+    def maybe_flush(self):
+        interval = metrics_settings()["FLUSH_INTERVAL"]
+        if self.started and time.monotonic() - self._flushed_at >= interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write this process's metrics to its file in the shared directory.
+        """
+
+        self._flushed_at = time.monotonic()
+        totals = self.snapshot()
+        data = {
+            "requests": [[*key, count] for key, count in totals.requests.items()],
+            "latency": [[*key, *value] for key, value in totals.latency.items()],
+            "queries": [[*key, *value] for key, value in totals.queries.items()],
+            "gauges": process_gauges(totals),
+            "counters": process_counters(),
+        }
+        directory = Path(metrics_settings()["DIRECTORY"])
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"metrics.{os.getpid()}.json"
+        temporary = path.with_suffix(f".tmp{threading.get_ident()}")
+        temporary.write_text(json.dumps(data))
+        os.replace(temporary, path)
+
+
+registry = Registry()
+
+# The query counter of the request being handled, if it is measured.
+current_queries = ContextVar("current_queries", default=None)
+
+
+class QueryCounter:
+    """
+    Count the database queries of one request, on every thread working on it.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the queries run by this thread towards the current request, if any.
+
+    Used by the middleware and by threads running part of a request, such as
+    the sub-requests of a batch, run in a copy of the request's context.
+    """
+
+    counter = current_queries.get()
+    with ExitStack() as stack:
+        if counter is not None:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+        yield
+
+
+def process_gauges(totals):
+    """
+    Return the gauges of this process; they are only reported while it runs.
+    """
+
+    return {
+        "http_requests_in_flight": totals.started - totals.finished,
+        "background_tasks_in_flight": runner.running,
+    }
+
+
+def process_counters():
+    """
+    Return the counters kept by other modules, as `{metric: {label value: count}}`.
+    """
+
+    cache = single_flight.stats()
+    return {
+        "cache_lookups_total": {
+            "hit": cache["hits"],
+            "stale": cache["stale"],
+            "coalesced": cache["coalesced"] + cache["cross_process"],
+            "miss": cache["computed"],
+        },
+        "background_tasks_total": {
+            name: runner.counters[name]
+            for name in ("enqueued", "deduplicated", "completed", "retried", "failed")
+        },
+    }
+
+
+class MetricsMiddleware:
+    """
+    Record the count, latency and number of database queries of every request.
+
+    Requests are labelled with the DRF view and action that handled them
+    (see `view_label`), the method and, for the count, the status code.
+
+    Settings:
+        METRICS["ENABLED"] (bool): False removes the middleware.
+        METRICS["LATENCY_BUCKETS"], METRICS["QUERY_BUCKETS"]: Histogram bucket bounds.
+    """
+
+    def __init__(self, get_response):
+        options = metrics_settings()
+        if not options["ENABLED"]:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.latency_buckets = tuple(options["LATENCY_BUCKETS"])
+        self.query_buckets = tuple(options["QUERY_BUCKETS"])
+
+    def __call__(self, request):
+        recorder = registry.recorder()
+        recorder.started += 1
+        queries = QueryCounter()
+        token = current_queries.set(queries)
+
+        start = time.perf_counter()
+        try:
+            with count_queries():
+                response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+            recorder.finished += 1
+        elapsed = time.perf_counter() - start
+
+        key = (view_label(request), request.method)
+        recorder.requests[(*key, str(response.status_code))] += 1
+        recorder.observe(recorder.latency, key, self.latency_buckets, elapsed)
+        recorder.observe(recorder.queries, key, self.query_buckets, queries.count)
+        registry.maybe_flush()
+        return response
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def empty_totals():
+    return {
+        "requests": defaultdict(int),
+        "latency": {},
+        "queries": {},
+        "counters": defaultdict(lambda: defaultdict(int)),
+    }
+
+
+def add_up(totals, data):
+    """
+    Add the counters and histograms of one metrics file to `totals`.
+    """
+
+    for view, method, status, count in data["requests"]:
+        totals["requests"][(view, method, status)] += count
+    for name in ("latency", "queries"):
+        merged = totals[name]
+        for view, method, counts, total in data[name]:
+            key = (view, method)
+            if key in merged:
+                merged[key][0] = [a + b for a, b in zip(merged[key][0], counts)]
+                merged[key][1] += total
+            else:
+                merged[key] = [counts, total]
+    for metric, values in data["counters"].items():
+        for label, count in values.items():
+            totals["counters"][metric][label] += count
+
+
+def retire_exited(directory):
+    """
+    Fold the files of processes that have exited into `metrics.exited.json`.
+
+    Their counters and histograms keep counting towards the totals, without
+    one file per process ever started piling up. Every collector may do
+    this, so it runs under a file lock; without file locks the files stay.
+    """
+
+    directory = Path(directory)
+    exited = []
+    for path in directory.glob("metrics.*.json"):
+        pid = path.name.split(".")[1]
+        if pid.isdigit() and not process_alive(int(pid)):
+            exited.append(path)
+    if fcntl is None or not exited:
+        return
+
+    with open(directory / "metrics.lock", "a+b") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        target = directory / "metrics.exited.json"
+        totals = empty_totals()
+        if target.exists():
+            add_up(totals, json.loads(target.read_text()))
+        retired = []
+        for path in exited:
+            try:
+                add_up(totals, json.loads(path.read_text()))
+            except FileNotFoundError:
+                continue  # Retired by another process meanwhile.
+            except ValueError:
+                pass  # Unreadable; dropped.
+            retired.append(path)
+        if not retired:
+            return
+        data = {
+            "requests": [[*key, count] for key, count in totals["requests"].items()],
+            "latency": [[*key, *value] for key, value in totals["latency"].items()],
+            "queries": [[*key, *value] for key, value in totals["queries"].items()],
+            "gauges": {},
+            "counters": totals["counters"],
+        }
+        temporary = target.with_suffix(f".tmp{os.getpid()}")
+        temporary.write_text(json.dumps(data))
+        os.replace(temporary, target)
+        for path in retired:
+            path.unlink()
+
+
+def collect(directory):
+    """
+    Add up the metrics files of every process in `directory`.
+
+    Counters and histograms include processes that have exited, so they
+    never go backwards; gauges only include running processes.
+    """
+
+    retire_exited(directory)
+    totals = empty_totals()
+    gauges = defaultdict(int)
+    for path in Path(directory).glob("metrics.*.json"):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        add_up(totals, data)
+        pid = path.name.split(".")[1]
+        if pid.isdigit() and process_alive(int(pid)):
+            for metric, value in data["gauges"].items():
+                gauges[metric] += value
+    histograms = {"latency": totals["latency"], "queries": totals["queries"]}
+    return totals["requests"], histograms, gauges, totals["counters"]
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_histogram(lines, name, help_text, histograms, buckets):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for (view, method), (counts, total) in sorted(histograms.items()):
+        labels = f'view="{escape(view)}",method="{method}"'
+        cumulative = 0
+        for bound, count in zip([*buckets, "+Inf"], counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {total}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+
+
+def render(directory):
+    """
+    Render the metrics of every process in the Prometheus text format.
+    """
+
+    options = metrics_settings()
+    requests, histograms, gauges, counters = collect(directory)
+    lines = [
+        "# HELP http_requests_total Requests by view, method and status code.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (view, method, status), count in sorted(requests.items()):
+        lines.append(
+            f'http_requests_total{{view="{escape(view)}",method="{method}",'
+            f'status="{status}"}} {count}'
+        )
+    render_histogram(
+        lines,
+        "http_request_duration_seconds",
+        "Request latency by view and method.",
+        histograms["latency"],
+        options["LATENCY_BUCKETS"],
+    )
+    render_histogram(
+        lines,
+        "http_request_db_queries",
+        "Database queries per request by view and method.",
+        histograms["queries"],
+        options["QUERY_BUCKETS"],
+    )
+
+    lookups = counters["cache_lookups_total"]
+    lines += [
+        "# HELP cache_lookups_total Lookups of the single-flight catalog cache by result.",
+        "# TYPE cache_lookups_total counter",
+        *(
+            f'cache_lookups_total{{cache="catalog",result="{result}"}} {count}'
+            for result, count in sorted(lookups.items())
+        ),
+        "# HELP cache_hit_ratio Share of catalog cache lookups served without computing.",
+        "# TYPE cache_hit_ratio gauge",
+        f'cache_hit_ratio{{cache="catalog"}} '
+        f"{1 - lookups['miss'] / max(sum(lookups.values()), 1)}",
+        "# HELP background_tasks_total Background task events by outcome.",
+        "# TYPE background_tasks_total counter",
+        *(
+            f'background_tasks_total{{event="{event}"}} {count}'
+            for event, count in sorted(counters["background_tasks_total"].items())
+        ),
+    ]
+    for metric, help_text in (
+        ("http_requests_in_flight", "Requests being handled by running workers."),
+        (
+            "background_tasks_in_flight",
+            "Background tasks being run by running workers.",
+        ),
+    ):
+        lines += [
+            f"# HELP {metric} {help_text}",
+            f"# TYPE {metric} gauge",
+            f"{metric} {gauges[metric]}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def allowed(request, options):
+    """
+    Whether `request` comes from one of ALLOWED_IPS or carries TOKEN as a bearer token.
+    """
+
+    if request.META.get("REMOTE_ADDR") in options["ALLOWED_IPS"]:
+        return True
+    header = request.META.get("HTTP_AUTHORIZATION", "")
+    return bool(options["TOKEN"]) and hmac.compare_digest(
+        header.encode(), f"Bearer {options['TOKEN']}".encode()
+    )
+
+
+def metrics_view(request):
+    """
+    Serve the metrics of every worker process in the Prometheus text format.
+
+    Only clients from METRICS["ALLOWED_IPS"], or sending
+    `Authorization: Bearer <METRICS["TOKEN"]>`, are served; others get a 403.
+    """
+
+    options = metrics_settings()
+    if not allowed(request, options):
+        return HttpResponseForbidden()
+    registry.flush()
+    return HttpResponse(
+        render(metrics_settings()["DIRECTORY"]), content_type=CONTENT_TYPE
+    )
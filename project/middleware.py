@@ -0,0 +1,203 @@
+import zlib
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.cache import patch_vary_headers
+
+
+# zlib window sizes selecting the gzip and zlib ("deflate" in HTTP) container formats.
+ENCODING_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+DEFAULT_COMPRESSION = {
+    "MIN_LENGTH": 1024,
+    "LEVEL": 6,
+    "CONTENT_TYPES": ["application/json"],
+}
+
+DEFAULT_STATELESS_API = {
+    "ENABLED": True,
+    "STATEFUL_PATHS": ["/admin/"],
+}
+
+
+def parse_accept_encoding(header):
+    """
+    Parse an Accept-Encoding header into a mapping of coding to quality value.
+
+    Args:
+        header (str): The raw header value, e.g. "gzip;q=1.0, deflate;q=0.5".
+
+    Returns:
+        dict: The quality value of each listed coding, lowercased.
+    """
+
+    codings = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding] = quality
+    return codings
+
+
+def choose_encoding(header):
+    """
+    Pick the best supported content coding the client accepts.
+
+    gzip wins ties because it is the most widely supported coding.
+
+    Args:
+        header (str): The raw Accept-Encoding header value.
+
+    Returns:
+        str | None: "gzip", "deflate", or None if neither is acceptable.
+    """
+
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for coding in ENCODING_WBITS:
+        quality = codings.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(content, encoding, level):
+    """
+    Compress `content` with the given content coding.
+
+    Args:
+        content (bytes): The response body.
+        encoding (str): "gzip" or "deflate".
+        level (int): The zlib compression level, 1-9.
+
+    Returns:
+        bytes: The compressed body.
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, ENCODING_WBITS[encoding])
+    return compressor.compress(content) + compressor.flush()
+
+
+class CompressionMiddleware:
+    """
+    Compress large API responses with gzip or deflate, based on Accept-Encoding.
+
+    Only non-streaming responses whose content type is listed in
+    `RESPONSE_COMPRESSION["CONTENT_TYPES"]` and whose body is at least
+    `RESPONSE_COMPRESSION["MIN_LENGTH"]` bytes are compressed. HTML is left
+    alone by default so pages carrying CSRF tokens are not exposed to
+    compression side-channel attacks.
+
+    Settings:
+        RESPONSE_COMPRESSION (dict): Overrides for MIN_LENGTH, LEVEL and CONTENT_TYPES.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = {
+            **DEFAULT_COMPRESSION,
+            **getattr(settings, "RESPONSE_COMPRESSION", {}),
+        }
+        self.min_length = options["MIN_LENGTH"]
+        self.level = options["LEVEL"]
+        self.content_types = tuple(options["CONTENT_TYPES"])
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.streaming or response.has_header("Content-Encoding"):
+            return response
+
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in self.content_types:
+            return response
+
+        if len(response.content) < self.min_length:
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        compressed = compress(response.content, encoding, self.level)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(compressed))
+        response.headers["Content-Encoding"] = encoding
+
+        # A strong ETag no longer matches the encoded representation.
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        return response
+
+
+class StatefulPathsMixin:
+    """
+    Run a middleware only for requests to the stateful parts of the site.
+
+    API clients authenticate with JWT or basic auth on every request, so
+    loading and saving sessions, storing messages and CSRF checks are wasted
+    work for them. Requests whose path starts with one of
+    `STATELESS_API["STATEFUL_PATHS"]` (the admin by default) go through the
+    middleware as usual; all others skip it.
+
+    Mix into a subclass of the middleware, so checks such as the admin's
+    still recognize it.
+
+    Settings:
+        STATELESS_API["ENABLED"] (bool): False runs the middleware for every request.
+        STATELESS_API["STATEFUL_PATHS"] (list): Path prefixes that keep the middleware.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        options = {**DEFAULT_STATELESS_API, **getattr(settings, "STATELESS_API", {})}
+        self.enabled = options["ENABLED"]
+        self.stateful_paths = tuple(options["STATEFUL_PATHS"])
+
+    def is_stateful(self, request):
+        return not self.enabled or request.path_info.startswith(self.stateful_paths)
+
+    def __call__(self, request):
+        if self.is_stateful(request):
+            return super().__call__(request)
+        return self.get_response(request)
+
+
+class StatefulSessionMiddleware(StatefulPathsMixin, SessionMiddleware):
+    pass
+
+
+class StatefulCsrfViewMiddleware(StatefulPathsMixin, CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if self.is_stateful(request):
+            return super().process_view(
+                request, callback, callback_args, callback_kwargs
+            )
+        return None
+
+
+class StatefulAuthenticationMiddleware(StatefulPathsMixin, AuthenticationMiddleware):
+    pass
+
+
+class StatefulMessageMiddleware(StatefulPathsMixin, MessageMiddleware):
+    pass
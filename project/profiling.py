@@ -0,0 +1,243 @@
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import random
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.text import slugify
+
+
+DEFAULT_PROFILING = {
+    "ENABLED": False,
+    "SAMPLE_RATE": 0.0,
+    "HEADER": "X-Profile",
+    "TOKEN_MAX_AGE": 3600,
+    "DUMP_INTERVAL": 60,
+}
+
+SIGNING_SALT = "project.profiling"
+
+
+def profiling_settings():
+    """
+    Return settings.PROFILING merged over the defaults.
+    """
+
+    options = {**DEFAULT_PROFILING, **getattr(settings, "PROFILING", {})}
+    options.setdefault("OUTPUT_DIR", Path(settings.BASE_DIR) / "profiles")
+    return options
+
+
+def make_token():
+    """
+    Return a signed value for the profiling header, valid for TOKEN_MAX_AGE seconds.
+    """
+
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign("profile")
+
+
+def check_token(token):
+    try:
+        signing.TimestampSigner(salt=SIGNING_SALT).unsign(
+            token, max_age=profiling_settings()["TOKEN_MAX_AGE"]
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def route_name(request):
+    """
+    Return the route a request is aggregated under, e.g. "GET book_nest:book-list".
+    """
+
+    match = getattr(request, "resolver_match", None)
+    return f"{request.method} {match.view_name if match else request.path_info}"
+
+
+class ProfileStore:
+    """
+    Per-route cProfile statistics of this process, periodically written to disk.
+
+    Each route is dumped to `<OUTPUT_DIR>/<route>.<pid>.prof` in pstats
+    format, and `<OUTPUT_DIR>/profiles.<pid>.json` maps the routes to their
+    files and sample counts. `profile_report` merges the files of every
+    process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {}
+        self.samples = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self._dirty = set()
+        self._dumped_at = time.monotonic()
+
+    def add(self, route, profiler, elapsed):
+        stats = pstats.Stats(profiler)
+        with self._lock:
+            if route in self.stats:
+                self.stats[route].add(stats)
+            else:
+                self.stats[route] = stats
+            self.samples[route] += 1
+            self.seconds[route] += elapsed
+            self._dirty.add(route)
+        if time.monotonic() - self._dumped_at >= profiling_settings()["DUMP_INTERVAL"]:
+            self.dump()
+
+    def dump(self):
+        """
+        Write the routes sampled since the last dump, and the index of this process.
+        """
+
+        directory = Path(profiling_settings()["OUTPUT_DIR"])
+        pid = os.getpid()
+        with self._lock:
+            self._dumped_at = time.monotonic()
+            if not self._dirty:
+                return
+            directory.mkdir(parents=True, exist_ok=True)
+            index = {}
+            for route, stats in self.stats.items():
+                filename = f"{slugify(route)}.{pid}.prof"
+                if route in self._dirty:
+                    stats.dump_stats(directory / filename)
+                index[route] = {
+                    "file": filename,
+                    "samples": self.samples[route],
+                    "seconds": self.seconds[route],
+                }
+            self._dirty.clear()
+            (directory / f"profiles.{pid}.json").write_text(json.dumps(index))
+
+
+store = ProfileStore()
+atexit.register(store.dump)
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sample of requests with cProfile and aggregate the stats per route.
+
+    A request is profiled with probability `PROFILING["SAMPLE_RATE"]`, or
+    when it carries the `PROFILING["HEADER"]` header with a value from
+    `python manage.py profile_report --token`. Other requests only pay for
+    a random number and a header lookup. When PROFILING["ENABLED"] is
+    false the middleware is not loaded at all.
+
+    Settings:
+        PROFILING (dict): ENABLED, SAMPLE_RATE, HEADER, TOKEN_MAX_AGE,
+            DUMP_INTERVAL (seconds between dumps) and OUTPUT_DIR.
+    """
+
+    def __init__(self, get_response):
+        options = profiling_settings()
+        if not options["ENABLED"]:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = options["SAMPLE_RATE"]
+        self.header = "HTTP_" + options["HEADER"].upper().replace("-", "_")
+
+    def should_profile(self, request):
+        if random.random() < self.sample_rate:
+            return True
+        token = request.META.get(self.header)
+        return token is not None and check_token(token)
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows only one per process).
+            return self.get_response(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        store.add(route_name(request), profiler, time.perf_counter() - start)
+        return response
+
+
+def collapsed_stacks(stats, min_seconds=1e-5, max_depth=64):
+    """
+    Convert pstats data to collapsed stacks, the input format of flame graph tools.
+
+    cProfile only records caller/callee pairs, not whole stacks, so each
+    function's time is split across its callers in proportion to the time
+    each of them spent in it. The stacks are an approximation.
+
+    Args:
+        stats (pstats.Stats): The profile.
+        min_seconds (float): Stack branches below this cumulative time are dropped.
+        max_depth (int): Stacks are cut at this depth.
+
+    Returns:
+        dict: Microseconds of self time per stack, keyed by `"a;b;c"`.
+    """
+
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+
+    def label(func):
+        filename, line, name = func
+        if filename == "~":
+            return name.replace(";", ",")
+        return f"{Path(filename).name}:{line}({name})".replace(";", ",")
+
+    lines = defaultdict(float)
+
+    def walk(func, stack, share):
+        _, _, self_time, cumulative, _ = stats.stats[func]
+        stack = stack + (label(func),)
+        lines[";".join(stack)] += self_time * share * 1e6
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_cumulative in callees[func].items():
+            callee_cumulative = stats.stats[callee][3]
+            callee_share = (
+                share * edge_cumulative / callee_cumulative if callee_cumulative else 0
+            )
+            if (
+                label(callee) not in stack
+                and callee_share * callee_cumulative >= min_seconds
+            ):
+                walk(callee, stack, callee_share)
+
+    # Functions nobody called are roots. The outermost frame of a recursive
+    # call chain has callers too, so the costliest function not reachable from
+    # a root becomes one as well, until every function is covered.
+    roots = [func for func, value in stats.stats.items() if not value[4]]
+    reached = set()
+    pending = list(roots)
+    while True:
+        while pending:
+            func = pending.pop()
+            if func not in reached:
+                reached.add(func)
+                pending.extend(callees[func])
+        unreached = [func for func in stats.stats if func not in reached]
+        if not unreached:
+            break
+        root = max(unreached, key=lambda func: stats.stats[func][3])
+        roots.append(root)
+        pending.append(root)
+
+    for root in roots:
+        walk(root, (), 1.0)
+    return {stack: round(micros) for stack, micros in lines.items() if round(micros)}
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -48,14 +49,27 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "project.metrics.MetricsMiddleware",
+    # Not loaded unless PROFILING["ENABLED"].
+    "project.profiling.ProfilingMiddleware",
+    "project.middleware.CompressionMiddleware",
+    "project.db.ReplicaPinningMiddleware",
+    # Sessions, CSRF, session auth and messages only run for STATELESS_API["STATEFUL_PATHS"].
+    "project.middleware.StatefulSessionMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
+    "project.middleware.StatefulCsrfViewMiddleware",
+    "project.middleware.StatefulAuthenticationMiddleware",
+    "project.middleware.StatefulMessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "project.limits.LoadSheddingMiddleware",
 ]
 
+# The API authenticates with JWT/basic auth, so only the admin needs session state.
+STATELESS_API = {
+    "ENABLED": True,
+    "STATEFUL_PATHS": ["/admin/"],
+}
+
 ROOT_URLCONF = "project.urls"
 
 REST_FRAMEWORK = {
@@ -64,6 +78,181 @@ REST_FRAMEWORK = {
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ],
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
+    "DEFAULT_RENDERER_CLASSES": [
+        "project.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+}
+
+RECOMMENDATIONS = {
+    # "ann" ranks books by description similarity, "category" matches favorite categories,
+    # "snapshot" scores category and author overlap over the in-memory catalog snapshot,
+    # "score" ranks category, author and popularity in a single SQL query.
+    "BACKEND": "category",
+    "LIMIT": 5,
+    "CATEGORY_WEIGHT": 1.0,
+    "AUTHOR_WEIGHT": 2.0,
+    "POPULARITY_WEIGHT": 0.1,
+}
+
+# In-process, column-oriented copy of the catalog (see book_nest.snapshot). It is
+# kept current by Book signals and rebuilt in the background after MAX_AGE seconds.
+CATALOG_SNAPSHOT = {
+    "MAX_AGE": 300,
+}
+
+# Approximate nearest-neighbour index over book descriptions (see book_nest.similarity).
+# More TABLES/PROBES or fewer BITS raise recall@k; `manage.py benchmark_similarity`
+# reports recall and latency for the current values. Book writes update the index
+# in place; once REBUILD_AFTER books changed, it is rebuilt in a background thread.
+SIMILARITY = {
+    "DIMENSIONS": 128,
+    "TABLES": 12,
+    "BITS": 10,
+    "PROBES": 1,
+    "SEED": 42,
+    "EXACT_THRESHOLD": 5000,
+    "REBUILD_AFTER": 1000,
+}
+
+# Versioned, memory-mapped recommender model files written by
+# `manage.py build_recommender_artifacts`; workers check CURRENT every CHECK_INTERVAL seconds.
+RECOMMENDER_ARTIFACTS = {
+    "DIR": BASE_DIR / "artifacts" / "recommender",
+    "CHECK_INTERVAL": 5,
+    "NEIGHBOURS": 10,
+    "KEEP": 3,
+}
+
+# Precomputed "similar books" lists, written by `manage.py build_book_neighbours`.
+# Workers cache them under a version kept in the database, which they re-read
+# every VERSION_CHECK_INTERVAL seconds to see lists written by other processes.
+BOOK_NEIGHBOURS = {
+    "K": 20,
+    "CACHE_TIMEOUT": 300,
+    "BATCH_SIZE": 1000,
+    "VERSION_CHECK_INTERVAL": 5,
+}
+
+# Cached /books/ pages, search results and recommendations, keyed by a catalog
+# version that book and author writes bump (see book_nest.cache). The version is
+# kept in the database and re-read every VERSION_CHECK_INTERVAL seconds, so
+# writes by any worker invalidate every worker's entries. Searches matching
+# more than SEARCH_MAX_IDS books are not cached.
+CATALOG_CACHE = {
+    "BOOK_LIST_TIMEOUT": 60,
+    "RECOMMENDATIONS_TIMEOUT": 300,
+    "SEARCH_TIMEOUT": 300,
+    "SEARCH_MAX_IDS": 5000,
+    "VERSION_CHECK_INTERVAL": 5,
+}
+
+# Request coalescing for those caches (project.singleflight). Expired values are
+# served for STALE_TIMEOUT more seconds while one caller recomputes them.
+# CROSS_PROCESS_LOCK only helps with a cache backend shared between processes.
+SINGLE_FLIGHT = {
+    "STALE_TIMEOUT": 300,
+    "WAIT_TIMEOUT": 10,
+    "CROSS_PROCESS_LOCK": False,
+    "LOCK_DIR": BASE_DIR / "locks",
+}
+
+# /batch/ runs up to MAX_REQUESTS sub-requests per call; reads run concurrently
+# on a pool of WORKERS threads shared by all batches (see project.batch).
+BATCH = {
+    "MAX_REQUESTS": 20,
+    "WORKERS": 4,
+}
+
+# Sampling request profiler (see project.profiling). Profiles SAMPLE_RATE of the
+# requests, plus those sending the HEADER value printed by
+# `python manage.py profile_report --token`, and aggregates them per route.
+PROFILING = {
+    "ENABLED": os.environ.get("DJANGO_PROFILING") == "1",
+    "SAMPLE_RATE": float(os.environ.get("DJANGO_PROFILING_SAMPLE_RATE", "0.01")),
+    "HEADER": "X-Profile",
+    "DUMP_INTERVAL": 60,
+    "OUTPUT_DIR": BASE_DIR / "profiles",
+}
+
+# Prometheus metrics served at /metrics (see project.metrics). Every server
+# worker process writes its totals to DIRECTORY, which must be shared by the
+# workers of a server and emptied when it is deployed. Only ALLOWED_IPS, or
+# scrapers sending "Authorization: Bearer <TOKEN>", may read them.
+METRICS = {
+    "ENABLED": True,
+    "FLUSH_INTERVAL": 5,
+    "DIRECTORY": BASE_DIR / "metrics",
+    "ALLOWED_IPS": ["127.0.0.1", "::1"],
+    "TOKEN": os.environ.get("DJANGO_METRICS_TOKEN", ""),
+}
+
+# Rate limits and load shedding (see project.limits). Each client gets a token
+# bucket; the ROUTES below, keyed by view and action, also get a concurrency
+# limit shared by every worker that adapts to their latency (seconds). Batch
+# sub-requests are charged like separate requests. STATE must be shared by the
+# workers of a server; if it stays locked for FAIL_OPEN_PERIOD seconds,
+# requests get 503 until it recovers. Tests run without limits (see
+# project.test_runner).
+LIMITS = {
+    "ENABLED": os.environ.get("DJANGO_LIMITS", "1") == "1",
+    "RATE": {"CAPACITY": 100, "REFILL_RATE": 5.0},
+    "ROUTES": {
+        "FavoriteBookViewSet.recommendations": {
+            "MAX_CONCURRENCY": 4,
+            "TARGET_LATENCY": 0.5,
+            "COST": 5,
+        },
+        "BookViewSet.list": {"MAX_CONCURRENCY": 8, "TARGET_LATENCY": 0.25},
+        # Password hashing makes logins slow by design.
+        "LoginAPIView.post": {"MAX_CONCURRENCY": 2, "TARGET_LATENCY": 1.0, "COST": 5},
+        "TokenObtainPairView.post": {
+            "MAX_CONCURRENCY": 2,
+            "TARGET_LATENCY": 1.0,
+            "COST": 5,
+        },
+    },
+    "FAIL_OPEN_PERIOD": 2.0,
+    "EXEMPT_PATHS": ["/metrics", "/admin/"],
+    "STATE": BASE_DIR / "limits.sqlite3",
+}
+
+# Worker startup (see project.startup). WARM_UP builds the URL configuration,
+# similarity index, catalog snapshot and recommender artifacts when
+# project.wsgi is loaded; run gunicorn with --preload so this happens once, in
+# the master, before the workers are forked.
+STARTUP = {
+    "WARM_UP": os.environ.get("DJANGO_WARM_UP") == "1",
+}
+
+# Deleted books and authors are hidden at once and purged in the background,
+# BATCH_SIZE rows per transaction with a PAUSE (seconds) in between.
+DELETION = {
+    "BATCH_SIZE": 500,
+    "PAUSE": 0.05,
+}
+
+# In-process background tasks (project.tasks). Jobs are written to an outbox table
+# in the transaction that queues them and kept until they succeed; EAGER runs
+# them inline after commit instead.
+TASKS = {
+    "EAGER": os.environ.get("DJANGO_TASKS_EAGER") == "1",
+    "WORKERS": 4,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF": 2.0,
+    "POLL_INTERVAL": 1.0,
+}
+
+# Uses orjson for API responses when it is installed.
+FAST_JSON_RENDERER = {
+    "USE_ORJSON": True,
+}
+
+# gzip/deflate compression of large JSON responses (see project.middleware).
+RESPONSE_COMPRESSION = {
+    "MIN_LENGTH": 1024,
+    "LEVEL": 6,
+    "CONTENT_TYPES": ["application/json"],
 }
 
 SIMPLE_JWT = {
@@ -96,13 +285,69 @@ WSGI_APPLICATION = "project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Select a profile with the DJANGO_DATABASE_PROFILE environment variable.
+# "performance" turns on WAL, relaxed fsyncs, memory-mapped reads and persistent
+# connections; the pragmas are applied by project.db.apply_sqlite_pragmas.
+DATABASE_PROFILES = {
+    "default": {
+        "CONN_MAX_AGE": 0,
+        "CONN_HEALTH_CHECKS": False,
+        "OPTIONS": {},
+        "PRAGMAS": {},
+    },
+    "performance": {
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        # Take the write lock when a transaction starts instead of failing to upgrade later.
+        "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+        "PRAGMAS": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "busy_timeout": 5000,
+            "cache_size": -64000,  # KiB, i.e. 64 MB per connection
+            "mmap_size": 268435456,  # 256 MB
+        },
+    },
+}
+
+DATABASE_PROFILE = os.environ.get("DJANGO_DATABASE_PROFILE", "default")
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": DATABASE_PROFILES[DATABASE_PROFILE]["CONN_MAX_AGE"],
+        "CONN_HEALTH_CHECKS": DATABASE_PROFILES[DATABASE_PROFILE]["CONN_HEALTH_CHECKS"],
+        "OPTIONS": DATABASE_PROFILES[DATABASE_PROFILE]["OPTIONS"],
+        # A file rather than shared-cache memory, so threaded tests see real SQLite locking.
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
+SQLITE_PRAGMAS = DATABASE_PROFILES[DATABASE_PROFILE]["PRAGMAS"]
+
+# Comma separated replica aliases, e.g. DJANGO_DATABASE_REPLICAS=replica. Locally each
+# replica is a second SQLite file kept in sync with `manage.py sync_sqlite_replicas`.
+DATABASE_REPLICAS = [
+    alias
+    for alias in os.environ.get("DJANGO_DATABASE_REPLICAS", "").split(",")
+    if alias
+]
+
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / f"db_{alias}.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    }
+
+# Models whose reads may be served by a replica; everything else stays on the primary.
+REPLICATED_MODELS = ["book_nest.book", "book_nest.auther"]
+
+DATABASE_ROUTERS = ["project.db.PrimaryReplicaRouter"]
+
+TEST_RUNNER = "project.test_runner.TestRunner"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+# File locks are only available on POSIX systems.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINGLE_FLIGHT = {
+    "STALE_TIMEOUT": 300,
+    "WAIT_TIMEOUT": 10,
+    "CROSS_PROCESS_LOCK": False,
+    "LOCK_STRIPES": 64,
+}
+
+
+def single_flight_settings():
+    """
+    Return settings.SINGLE_FLIGHT merged over the defaults.
+    """
+
+    options = {**DEFAULT_SINGLE_FLIGHT, **getattr(settings, "SINGLE_FLIGHT", {})}
+    options.setdefault("LOCK_DIR", Path(settings.BASE_DIR) / "locks")
+    return options
+
+
+class Call:
+    """
+    A computation in flight, shared by every thread asking for the same key.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class FileLock:
+    """
+    Cross-process lock on one of `LOCK_STRIPES` files, picked by hashing the key.
+
+    Striping bounds the number of lock files; unrelated keys that share a
+    stripe only serialize their (rare) concurrent misses.
+    """
+
+    def __init__(self, key, directory, stripes):
+        stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) % stripes
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.handle = open(directory / f"single-flight-{stripe}.lock", "a+b")
+
+    def acquire(self, timeout=0):
+        """
+        Try to take the lock, waiting up to `timeout` seconds.
+
+        Returns:
+            bool: Whether the lock was taken.
+        """
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(self.handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.02)
+
+    def close(self):
+        self.handle.close()
+
+    def release(self):
+        fcntl.flock(self.handle, fcntl.LOCK_UN)
+        self.close()
+
+
+class SingleFlight:
+    """
+    Cache-aside with request coalescing: at most one computation per key at a time.
+
+    Values are kept in the Django cache together with their expiry time, and
+    stay there for STALE_TIMEOUT seconds after expiring. On a miss the first
+    caller computes the value; concurrent callers in the process either get
+    the stale value right away, if there is one, or wait for the result.
+
+    With CROSS_PROCESS_LOCK, the computing caller also takes a file lock, so
+    that other processes sharing the cache backend wait for it (or serve the
+    stale value) and then read its result instead of recomputing.
+
+    Attributes:
+        counters (dict): Per-process counts of cache hits, computations,
+            callers that waited for another computation, stale values served
+            and values another process computed.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ("hits", "computed", "coalesced", "stale", "cross_process"), 0
+        )
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        """
+        Return the counters plus the computations avoided and the share of requests they represent.
+        """
+
+        with self._lock:
+            counters = dict(self.counters)
+        avoided = counters["coalesced"] + counters["stale"] + counters["cross_process"]
+        misses = avoided + counters["computed"]
+        return {
+            **counters,
+            "avoided": avoided,
+            "avoided_ratio": avoided / misses if misses else 0.0,
+            "in_flight": len(self._calls),
+        }
+
+    def _fresh(self, entry):
+        return entry is not None and entry[1] > time.time()
+
+    def get(self, key, compute, timeout):
+        """
+        Return the cached value of `key`, computing it with `compute()` at most once at a time.
+
+        Args:
+            key (str): The cache key.
+            compute (callable): Builds the value; exceptions propagate to every waiting caller.
+            timeout (int): Seconds the value stays fresh.
+
+        Returns:
+            The cached or computed value.
+        """
+
+        entry = cache.get(key)
+        if self._fresh(entry):
+            self._count("hits")
+            return entry[0]
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+
+        options = single_flight_settings()
+        if not leader:
+            if entry is not None:
+                self._count("stale")
+                return entry[0]
+            if not call.done.wait(options["WAIT_TIMEOUT"]):
+                logger.warning("Gave up waiting for %s, computing it again", key)
+                return compute()
+            self._count("coalesced")
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = self._lead(key, compute, timeout, entry, options)
+            return call.value
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _lead(self, key, compute, timeout, entry, options):
+        lock = None
+        if options["CROSS_PROCESS_LOCK"] and fcntl is not None:
+            lock = FileLock(key, options["LOCK_DIR"], options["LOCK_STRIPES"])
+            if not lock.acquire():
+                # Another process is computing it: serve the stale value or wait for its result.
+                if entry is not None:
+                    lock.close()
+                    self._count("stale")
+                    return entry[0]
+                if not lock.acquire(options["WAIT_TIMEOUT"]):
+                    lock.close()
+                    lock = None
+                else:
+                    entry = cache.get(key)
+                    if self._fresh(entry):
+                        lock.release()
+                        self._count("cross_process")
+                        return entry[0]
+
+        try:
+            value = compute()
+            cache.set(
+                key, (value, time.time() + timeout), timeout + options["STALE_TIMEOUT"]
+            )
+            self._count("computed")
+            return value
+        finally:
+            if lock is not None:
+                lock.release()
+
+
+single_flight = SingleFlight()
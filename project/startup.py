@@ -0,0 +1,150 @@
+import importlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STARTUP = {
+    "WARM_UP": False,
+}
+
+
+def startup_settings():
+    """
+    Return settings.STARTUP merged over the defaults.
+    """
+
+    return {**DEFAULT_STARTUP, **getattr(settings, "STARTUP", {})}
+
+
+class LazyModule:
+    """
+    Stand-in for a module that imports it on first attribute access.
+
+    `np = lazy_import("numpy")` at the top of a module keeps `np.zeros(...)`
+    working while deferring the import, and its cost, until a request
+    actually needs it. Unlike importlib.util.LazyLoader, the first access is
+    safe from several threads at once.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+        self.import_seconds = None
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    self.import_seconds = time.perf_counter() - start
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+_lazy_modules = {}
+_lazy_lock = threading.Lock()
+
+
+def lazy_import(name):
+    """
+    Return a LazyModule for `name`, shared by every module importing it lazily.
+    """
+
+    with _lazy_lock:
+        module = _lazy_modules.get(name)
+        if module is None:
+            module = _lazy_modules[name] = LazyModule(name)
+        return module
+
+
+def lazy_modules():
+    """
+    Return the lazily imported modules, by name.
+    """
+
+    return dict(_lazy_modules)
+
+
+def import_urlconf():
+    """
+    Import the URL configuration, and with it every view, which Django otherwise defers to the first request.
+    """
+
+    get_resolver().url_patterns
+
+
+_steps = [("url configuration", import_urlconf)]
+
+
+def register_warm_up(name, func):
+    """
+    Add a step to the warm-up, e.g. from an AppConfig.ready() method.
+
+    Steps run in registration order and must not start threads or leave
+    files open that a forked worker could not share.
+
+    Args:
+        name (str): Shown in logs and in `python manage.py startup_report`.
+        func (callable): Called without arguments.
+    """
+
+    if all(step_name != name for step_name, _ in _steps):
+        _steps.append((name, func))
+
+
+def warm_up():
+    """
+    Run every registered warm-up step, timing each one.
+
+    A failing step is logged and skipped: a cold cache only costs the first
+    requests some time. Database connections are closed afterwards, so that
+    worker processes forked from this one do not share them.
+
+    Returns:
+        list: `(name, seconds, error)` per step; `error` is None on success.
+    """
+
+    results = []
+    for name, func in _steps:
+        start = time.perf_counter()
+        error = None
+        try:
+            func()
+        except Exception as exc:
+            logger.exception("Warm-up step %r failed", name)
+            error = f"{type(exc).__name__}: {exc}"
+        seconds = time.perf_counter() - start
+        logger.info("Warm-up step %r took %.3fs", name, seconds)
+        results.append((name, seconds, error))
+    connections.close_all()
+    return results
+
+
+def warm_up_if_enabled():
+    """
+    Run the warm-up if STARTUP["WARM_UP"] is set.
+
+    Called by project.wsgi once the application is loaded. With gunicorn's
+    `--preload` this happens in the master, before the workers are forked,
+    so they start with the caches already built and share their memory.
+    """
+
+    if startup_settings()["WARM_UP"]:
+        return warm_up()
+    return None
@@ -0,0 +1,402 @@
+import atexit
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TASKS = {
+    "EAGER": False,
+    "WORKERS": 4,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF": 2.0,
+    "MAX_BACKOFF": 300.0,
+    "POLL_INTERVAL": 1.0,
+    "LEASE": 300.0,
+    "DATABASE": "default",
+}
+
+PENDING = "pending"
+RUNNING = "running"
+FAILED = "failed"
+
+
+def task_settings():
+    """
+    Return settings.TASKS merged over the defaults.
+    """
+
+    return {**DEFAULT_TASKS, **getattr(settings, "TASKS", {})}
+
+
+class Outbox:
+    """
+    Transactional job storage in the book_nest TaskJob table of the main database.
+
+    A job is a task name plus JSON arguments. It is inserted through the
+    caller's connection, inside the caller's transaction, so it is committed
+    together with the writes that queued it or not at all. Jobs are deleted
+    once they succeed, so the table only holds pending, running and failed
+    work. At most one pending job exists per deduplication key; enqueueing it
+    again while it waits is a no-op. Running jobs whose lease expired, e.g.
+    because their process died, are claimed again.
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.table = apps.get_model("book_nest", "TaskJob")._meta.db_table
+
+    def execute(self, sql, params=()):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql.format(table=self.table), params)
+            return cursor.rowcount, cursor.fetchall() if cursor.description else []
+
+    def add(self, name, payload, key, max_attempts):
+        """
+        Store a job unless an identical one is already pending.
+
+        Returns:
+            bool: False if the job was deduplicated.
+        """
+
+        now = time.time()
+        rowcount, _ = self.execute(
+            "INSERT INTO {table} (name, payload, key, status, attempts, max_attempts, "
+            "run_at, created_at) VALUES (%s, %s, %s, %s, 0, %s, %s, %s) "
+            f"ON CONFLICT (key) WHERE status = '{PENDING}' DO NOTHING",
+            (name, payload, key, PENDING, max_attempts, now, now),
+        )
+        return rowcount == 1
+
+    def claim(self, limit, lease):
+        """
+        Mark up to `limit` due jobs as running and return them.
+
+        Returns:
+            list: `(id, name, payload, attempts, max_attempts)` rows.
+        """
+
+        now = time.time()
+        _, rows = self.execute(
+            f"UPDATE {{table}} SET status = '{RUNNING}', claimed_at = %s, "
+            "attempts = attempts + 1 "
+            "WHERE id IN ("
+            "  SELECT id FROM {table} "
+            f"  WHERE (status = '{PENDING}' AND run_at <= %s) "
+            f"     OR (status = '{RUNNING}' AND claimed_at < %s) "
+            "  ORDER BY run_at LIMIT %s"
+            ") RETURNING id, name, payload, attempts, max_attempts",
+            (now, now, now - lease, limit),
+        )
+        return rows
+
+    def complete(self, job_id):
+        self.execute("DELETE FROM {table} WHERE id = %s", (job_id,))
+
+    def retry(self, job_id, delay, error):
+        """
+        Schedule a failed job to run again after `delay` seconds.
+
+        If an identical job was queued meanwhile, this one is dropped instead.
+        """
+
+        try:
+            with transaction.atomic(using=self.using):
+                self.execute(
+                    f"UPDATE {{table}} SET status = '{PENDING}', run_at = %s, "
+                    "claimed_at = NULL, last_error = %s WHERE id = %s",
+                    (time.time() + delay, error, job_id),
+                )
+        except IntegrityError:
+            self.complete(job_id)
+
+    def fail(self, job_id, error):
+        self.execute(
+            f"UPDATE {{table}} SET status = '{FAILED}', last_error = %s WHERE id = %s",
+            (error, job_id),
+        )
+
+    def requeue_failed(self):
+        """
+        Give every failed job a fresh set of attempts.
+
+        Returns:
+            int: The number of jobs requeued.
+        """
+
+        rowcount, _ = self.execute(
+            f"UPDATE OR IGNORE {{table}} SET status = '{PENDING}', attempts = 0, "
+            f"run_at = %s WHERE status = '{FAILED}'",
+            (time.time(),),
+        )
+        return rowcount
+
+    def depth(self):
+        """
+        Return the number of jobs per status.
+        """
+
+        counts = dict.fromkeys((PENDING, RUNNING, FAILED), 0)
+        _, rows = self.execute("SELECT status, COUNT(*) FROM {table} GROUP BY status")
+        counts.update(rows)
+        return counts
+
+
+class TaskRunner:
+    """
+    In-process background worker draining the outbox with a bounded thread pool.
+
+    A dispatcher thread claims due jobs only while a worker is free, so the
+    pool never holds more than TASKS["WORKERS"] jobs. Jobs that raise are
+    retried with exponential backoff up to their maximum number of attempts,
+    then kept as failed. The runner starts on the first enqueue.
+    """
+
+    def __init__(self):
+        self.outbox = None
+        self.counters = dict.fromkeys(
+            ("enqueued", "deduplicated", "completed", "retried", "failed"), 0
+        )
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pool = None
+        self._dispatcher = None
+        self._running = 0
+        self._stopping = False
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    @property
+    def running(self):
+        """
+        The number of jobs this process is running.
+        """
+
+        return self._running
+
+    def get_outbox(self):
+        if self.outbox is None:
+            with self._lock:
+                if self.outbox is None:
+                    self.outbox = Outbox(task_settings()["DATABASE"])
+        return self.outbox
+
+    def start(self):
+        """
+        Start the dispatcher and the worker pool, if not started yet.
+        """
+
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+            self._stopping = False
+            self._pool = ThreadPoolExecutor(
+                max_workers=task_settings()["WORKERS"], thread_name_prefix="task"
+            )
+            self._dispatcher = threading.Thread(
+                target=self._dispatch, name="task-dispatcher", daemon=True
+            )
+            self._dispatcher.start()
+
+    def stop(self, wait=True):
+        """
+        Stop claiming jobs and wait for the running ones; pending jobs stay in the outbox.
+        """
+
+        with self._lock:
+            dispatcher, pool = self._dispatcher, self._pool
+            self._dispatcher = self._pool = None
+            self._stopping = True
+        self._wake.set()
+        if dispatcher is not None:
+            dispatcher.join()
+            pool.shutdown(wait=wait)
+
+    def enqueue(self, name, args, kwargs, max_attempts):
+        """
+        Store a job in the outbox, in the current transaction, and wake the dispatcher once it commits.
+        """
+
+        payload = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True)
+        key = hashlib.sha1(f"{name}:{payload}".encode()).hexdigest()
+        outbox = self.get_outbox()
+        if outbox.add(name, payload, key, max_attempts):
+            self._count("enqueued")
+        else:
+            self._count("deduplicated")
+        transaction.on_commit(self.wake, using=outbox.using)
+
+    def wake(self):
+        """
+        Start the runner if needed and make the dispatcher claim due jobs now.
+        """
+
+        self.start()
+        self._wake.set()
+
+    def _dispatch(self):
+        options = task_settings()
+        outbox = self.get_outbox()
+        pool = self._pool
+        while not self._stopping:
+            # Cleared before claiming, so a wake-up sent meanwhile is not lost.
+            self._wake.clear()
+            free = options["WORKERS"] - self._running
+            if free > 0:
+                try:
+                    jobs = outbox.claim(free, options["LEASE"])
+                except DatabaseError:
+                    logger.exception("Could not claim background tasks")
+                    jobs = []
+                for job in jobs:
+                    with self._lock:
+                        self._running += 1
+                    pool.submit(self._execute_in_pool, *job)
+            self._wake.wait(options["POLL_INTERVAL"])
+
+    def _execute_in_pool(self, *job):
+        try:
+            self._execute(*job)
+        finally:
+            connections.close_all()
+
+    def _execute(self, job_id, name, payload, attempts, max_attempts):
+        outbox = self.get_outbox()
+        try:
+            data = json.loads(payload)
+            call(name, *data["args"], **data["kwargs"])
+        except Exception as error:
+            options = task_settings()
+            if attempts < max_attempts:
+                delay = min(options["BACKOFF"] ** attempts, options["MAX_BACKOFF"])
+                logger.warning(
+                    "Task %s failed (attempt %s), retrying in %.0fs: %r",
+                    name,
+                    attempts,
+                    delay,
+                    error,
+                )
+                outbox.retry(job_id, delay, repr(error))
+                self._count("retried")
+            else:
+                logger.exception("Task %s failed after %s attempts", name, attempts)
+                outbox.fail(job_id, repr(error))
+                self._count("failed")
+        else:
+            outbox.complete(job_id)
+            self._count("completed")
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._wake.set()
+
+    def run_pending(self):
+        """
+        Run every due job in the calling thread until none is left.
+
+        Returns:
+            int: The number of jobs run.
+        """
+
+        options = task_settings()
+        outbox = self.get_outbox()
+        count = 0
+        while jobs := outbox.claim(1, options["LEASE"]):
+            with self._lock:
+                self._running += 1
+            self._execute(*jobs[0])
+            count += 1
+        return count
+
+    def stats(self):
+        """
+        Return the queue depth per status, the running jobs and this process's counters.
+        """
+
+        return {
+            "outbox": self.get_outbox().depth(),
+            "in_process": self.running,
+            **self.counters,
+        }
+
+
+runner = TaskRunner()
+atexit.register(runner.stop)
+
+_registry = {}
+
+
+def call(name, *args, **kwargs):
+    """
+    Run the task registered as `name`, importing its module if needed.
+    """
+
+    func = _registry.get(name)
+    if func is None:
+        func = import_string(name).func
+    return func(*args, **kwargs)
+
+
+class Task:
+    """
+    A function that can be run in the background with `.delay()`.
+
+    Attributes:
+        name (str): The dotted path of the function, used to find it when a job runs.
+        func (callable): The wrapped function; calling the task calls it directly.
+        max_attempts (int | None): Overrides TASKS["MAX_ATTEMPTS"].
+    """
+
+    def __init__(self, func, max_attempts=None):
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.max_attempts = max_attempts
+        self.__doc__ = func.__doc__
+        _registry[self.name] = func
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """
+        Run the task in the background once the current transaction commits.
+
+        The job is written to the outbox in the current transaction, so it
+        survives a crash right after the commit and is dropped on rollback.
+        The arguments must be JSON serializable. A job identical to one still
+        pending is dropped. With TASKS["EAGER"] the task runs inline instead.
+        """
+
+        options = task_settings()
+        if options["EAGER"]:
+            transaction.on_commit(lambda: self.func(*args, **kwargs))
+            return
+        max_attempts = self.max_attempts or options["MAX_ATTEMPTS"]
+        runner.enqueue(self.name, list(args), kwargs, max_attempts)
+
+
+def task(func=None, *, max_attempts=None):
+    """
+    Decorator registering a function as a background task.
+
+    Example:
+        @task
+        def send_welcome_email(user_id): ...
+
+        send_welcome_email.delay(user.id)
+    """
+
+    if func is None:
+        return lambda func: Task(func, max_attempts)
+    return Task(func, max_attempts)
@@ -0,0 +1,32 @@
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Run the tests with rate limits and load shedding turned off.
+
+    Their state file is moved to a temporary directory, so the tests that
+    turn them on again never write next to the project's database.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.limits_directory = tempfile.TemporaryDirectory()
+        self.limits = override_settings(
+            LIMITS={
+                **settings.LIMITS,
+                "ENABLED": False,
+                "STATE": Path(self.limits_directory.name) / "limits.sqlite3",
+            }
+        )
+        self.limits.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.limits.disable()
+        self.limits_directory.cleanup()
+        super().teardown_test_environment(**kwargs)
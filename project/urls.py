@@ -17,6 +17,8 @@ Including another URLconf
 
 from django.contrib import admin
 from django.urls import path, include
+from project.batch import BatchAPIView
+from project.metrics import metrics_view
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -28,4 +30,6 @@ urlpatterns = [
     path("", include("book_nest.urls", namespace="book_nest")),
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("batch/", BatchAPIView.as_view(), name="batch"),
+    path("metrics", metrics_view, name="metrics"),
 ]
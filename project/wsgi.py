@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
 
 application = get_wsgi_application()
+
+# Only server processes write metrics files.
+from project.metrics import registry  # noqa: E402
+
+registry.start()
+
+# Build caches once, in the gunicorn master when started with --preload.
+from project.startup import warm_up_if_enabled  # noqa: E402
+
+warm_up_if_enabled()
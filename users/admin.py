@@ -9,6 +9,8 @@ class UserProfileAdmin(admin.ModelAdmin):
     """
 
     list_display = ["user"]
+    list_select_related = ["user"]
+    show_full_result_count = False
 
 
 admin.site.register(UserProfile, UserProfileAdmin)
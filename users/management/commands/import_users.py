@@ -0,0 +1,243 @@
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from users.models import UserProfile
+
+
+FIELDS = ("email", "first_name", "last_name", "password", "date_joined")
+
+# Batches retried after an IntegrityError from users created concurrently.
+MAX_RETRIES = 3
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users from a CSV or JSON Lines file with pre-hashed passwords, "
+        "inserting users and their profiles in batches"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            help=(
+                "CSV file with a header row, or .jsonl file with one object per line. "
+                f"Columns: {', '.join(FIELDS)}; only email is required."
+            ),
+        )
+        parser.add_argument("--format", choices=["csv", "jsonl"])
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--rejects",
+            help="Write the rejected rows with the reason to this CSV file.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Validate the file without writing anything.",
+        )
+
+    def read_rows(self, path, file_format):
+        """
+        Yield every record of the file as a dict, without loading it whole.
+        """
+
+        with open(path, newline="", encoding="utf-8") as handle:
+            if file_format == "csv":
+                for row in csv.DictReader(handle):
+                    row.pop(None, None)  # Values beyond the header.
+                    yield row
+                return
+            for line, text in enumerate(handle, start=1):
+                if text.strip():
+                    try:
+                        yield json.loads(text)
+                    except json.JSONDecodeError:
+                        yield {"__error__": f"invalid JSON on line {line}"}
+
+    def build_user(self, row):
+        """
+        Validate one record and build its unsaved User.
+
+        Returns:
+            tuple: `(user, None)`, or `(None, reason)` if the row is rejected.
+        """
+
+        if not isinstance(row, dict):
+            return None, "not an object"
+        if "__error__" in row:
+            return None, row["__error__"]
+        for field in FIELDS:
+            if row.get(field) is not None and not isinstance(row[field], str):
+                return None, f"{field} is not a string"
+
+        email = (row.get("email") or "").strip().lower()
+        try:
+            validate_email(email)
+        except ValidationError:
+            return None, "invalid email"
+
+        password = row.get("password") or ""
+        if password:
+            try:
+                identify_hasher(password)
+            except ValueError:
+                return None, "password is not a Django password hash"
+        else:
+            # Users without a password have to reset it before logging in.
+            password = make_password(None)
+
+        user = User(
+            username=email,
+            email=email,
+            first_name=(row.get("first_name") or "").strip()[:150],
+            last_name=(row.get("last_name") or "").strip()[:150],
+            password=password,
+        )
+        if row.get("date_joined"):
+            date_joined = parse_datetime(row["date_joined"])
+            if date_joined is None:
+                return None, "invalid date_joined"
+            if timezone.is_naive(date_joined):
+                date_joined = timezone.make_aware(date_joined)
+            user.date_joined = date_joined
+        return user, None
+
+    def registered(self, emails=None):
+        """
+        Return the lowercased usernames and emails of the existing users, or of those matching `emails`.
+        """
+
+        users = User.objects.annotate(
+            username_lower=Lower("username"), email_lower=Lower("email")
+        )
+        if emails is not None:
+            users = users.filter(
+                Q(username_lower__in=emails) | Q(email_lower__in=emails)
+            )
+        found = set()
+        for username, email in users.values_list(
+            "username_lower", "email_lower"
+        ).iterator(chunk_size=10000):
+            found.update((username, email))
+        return found
+
+    def insert(self, users, existing):
+        """
+        Insert a batch of users and their profiles in one transaction.
+
+        `bulk_create` sends no `post_save` signal, so the profiles are
+        created here rather than one by one by `create_user_profile`. If a
+        user was created concurrently, the batch is checked against the
+        database again and retried, up to MAX_RETRIES times.
+
+        Args:
+            users (list): The users to insert, with lowercase emails.
+            existing (set): The lowercased usernames and emails already
+                registered; updated with the inserted users.
+
+        Returns:
+            list: The users that already existed and were skipped.
+        """
+
+        for attempt in range(MAX_RETRIES + 1):
+            skipped = [user for user in users if user.email in existing]
+            fresh = [user for user in users if user.email not in existing]
+            try:
+                with transaction.atomic():
+                    User.objects.bulk_create(fresh)
+                    UserProfile.objects.bulk_create(
+                        [UserProfile(user_id=user.id) for user in fresh]
+                    )
+                break
+            except IntegrityError:
+                if attempt == MAX_RETRIES:
+                    raise
+                existing.update(self.registered([user.email for user in users]))
+        existing.update(user.email for user in fresh)
+        return skipped
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"{path} does not exist")
+        file_format = options["format"] or (
+            "jsonl" if path.suffix in (".jsonl", ".ndjson") else "csv"
+        )
+
+        rejects_file = rejects = None
+        if options["rejects"]:
+            rejects_file = open(options["rejects"], "w", newline="", encoding="utf-8")
+            rejects = csv.writer(rejects_file)
+            rejects.writerow(["record", "email", "reason"])
+
+        counts = {"imported": 0, "rejected": 0}
+        reasons = {}
+
+        def reject(record, email, reason):
+            counts["rejected"] += 1
+            reasons[reason] = reasons.get(reason, 0) + 1
+            if rejects:
+                rejects.writerow([record, email, reason])
+
+        seen = set()
+        # Emails are compared lowercased, whatever the case of existing users.
+        existing = set() if options["dry_run"] else self.registered()
+        start = time.perf_counter()
+        records = enumerate(self.read_rows(path, file_format), start=1)
+        try:
+            while batch := list(islice(records, options["batch_size"])):
+                users = []
+                for record, row in batch:
+                    user, reason = self.build_user(row)
+                    if user is not None and user.username in seen:
+                        reason = "duplicate email in file"
+                    if reason:
+                        email = row.get("email", "") if isinstance(row, dict) else ""
+                        reject(record, email, reason)
+                        continue
+                    seen.add(user.username)
+                    users.append((record, user))
+
+                if not options["dry_run"] and users:
+                    skipped = self.insert([user for _, user in users], existing)
+                    skipped = {user.email for user in skipped}
+                    for record, user in users:
+                        if user.email in skipped:
+                            reject(record, user.email, "email already registered")
+                    users = [item for item in users if item[1].email not in skipped]
+
+                counts["imported"] += len(users)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{counts['imported']} imported, {counts['rejected']} rejected "
+                    f"({counts['imported'] / elapsed:.0f} users/s)"
+                )
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        elapsed = time.perf_counter() - start
+        for reason, count in sorted(reasons.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {count} rejected: {reason}")
+        verb = "Validated" if options["dry_run"] else "Imported"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} {counts['imported']} users in {elapsed:.1f}s "
+                f"({counts['imported'] / max(elapsed, 1e-9):.0f} users/s), "
+                f"{counts['rejected']} rejected"
+            )
+        )
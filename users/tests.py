@@ -1,3 +1,91 @@
+import csv
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from .management.commands import import_users
+from .models import UserProfile
+
+
+class UserProfileTests(TestCase):
+    def test_profile_is_created_with_the_user(self):
+        user = User.objects.create_user("reader", password="secret-pass")
+        self.assertIsNotNone(user.profile.pk)
+
+    def test_superusers_get_no_profile(self):
+        user = User.objects.create_superuser("admin", password="secret-pass")
+        self.assertFalse(hasattr(user, "profile"))
+
+
+class ImportUsersTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "users.jsonl"
+        self.rejects = Path(directory.name) / "rejects.csv"
+
+    def run_import(self, *rows):
+        self.path.write_text("\n".join(json.dumps(row) for row in rows))
+        call_command(
+            "import_users", str(self.path), rejects=str(self.rejects), stdout=StringIO()
+        )
+        with open(self.rejects, newline="") as handle:
+            return {row["record"]: row["reason"] for row in csv.DictReader(handle)}
+
+    def test_rows_with_values_that_are_not_strings_are_rejected(self):
+        rejected = self.run_import(
+            {"email": 123},
+            {"email": "list@example.com", "first_name": ["x"]},
+            {"email": "date@example.com", "date_joined": 5},
+            {"email": "ok@example.com", "first_name": None},
+        )
+
+        self.assertEqual(
+            rejected,
+            {
+                "1": "email is not a string",
+                "2": "first_name is not a string",
+                "3": "date_joined is not a string",
+            },
+        )
+        self.assertTrue(User.objects.filter(username="ok@example.com").exists())
+        self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_existing_users_are_matched_ignoring_case(self):
+        User.objects.create_user("Reader@Example.com", "Reader@Example.com")
+
+        rejected = self.run_import({"email": "reader@example.com"})
+
+        self.assertEqual(rejected, {"1": "email already registered"})
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_batch_is_retried_while_users_are_created_concurrently(self):
+        for email in ("first@example.com", "second@example.com"):
+            User.objects.create_user(email, email)
+        command = import_users.Command
+        registered = command.registered
+        # Neither user exists when the import starts, and the second one is
+        # only created after the first retry.
+        seen = iter([set(), {"first@example.com"}])
+
+        def racing_registered(self, emails=None):
+            return next(seen, None) or registered(self, emails)
+
+        with mock.patch.object(command, "registered", racing_registered):
+            rejected = self.run_import(
+                {"email": "first@example.com"},
+                {"email": "second@example.com"},
+                {"email": "third@example.com"},
+            )
+
+        self.assertEqual(
+            rejected,
+            {"1": "email already registered", "2": "email already registered"},
+        )
+        self.assertTrue(User.objects.filter(username="third@example.com").exists())
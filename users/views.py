@@ -35,7 +35,9 @@ class SignUpAPIView(APIView):
                     username=data["email"],
                     password=make_password(data["password"]),
                 )
-                login(request, user)
+                # No session exists for stateless API requests; clients use the JWT below.
+                if hasattr(request, "session"):
+                    login(request, user)
                 refresh = RefreshToken.for_user(user)
                 return Response(
                     {